@@ -0,0 +1,163 @@
+# ai_module/consumers.py
+"""
+Streaming voice trigger over a WebSocket (served by mutesos_project.asgi).
+
+The browser sends 16 kHz mono signed 16-bit PCM frames as binary messages
+while it records, plus JSON text messages for control:
+
+    {"type": "start", "latitude": "...", "longitude": "...", "idempotency_key": "..."}
+    {"type": "location", "latitude": "...", "longitude": "..."}
+    {"type": "stop"}
+
+The keyword is searched on a sliding window as audio arrives and the SOS
+fires as soon as it is heard. Server messages are JSON with a "type" of
+ready, triggered, no_keyword, unavailable or error.
+"""
+import json
+import asyncio
+import logging
+from importlib import import_module
+from types import SimpleNamespace
+from urllib.parse import urlparse
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import aget_user
+from django.http.cookie import parse_cookie
+from django.http.request import split_domain_port, validate_host
+
+from .kws import SlidingWindowDetector, spotter_available
+from .matcher import parse_keywords
+
+logger = logging.getLogger(__name__)
+
+# Defaults (override via settings.VOICE_STREAM_*)
+DEFAULT_WINDOW = 2.5        # seconds of audio searched per step
+DEFAULT_HOP = 0.5           # seconds of new audio between searches
+DEFAULT_MAX_SECONDS = 60    # longest stream accepted per connection
+
+
+def _headers(scope):
+    return {k.decode('latin1').lower(): v.decode('latin1') for k, v in scope.get('headers', [])}
+
+
+def _origin_allowed(headers):
+    """Reject cross-site sockets: the Origin must match the Host (or a trusted origin)."""
+    host = headers.get('host', '')
+    domain, _ = split_domain_port(host)
+    if not domain or not validate_host(domain, settings.ALLOWED_HOSTS):
+        return False
+    origin = headers.get('origin')
+    if origin is None:
+        return True  # not a browser: it cannot carry the session cookie cross-site
+    return urlparse(origin).netloc == host or origin in getattr(settings, 'CSRF_TRUSTED_ORIGINS', [])
+
+
+async def _scope_user(headers):
+    """The logged-in user for the session cookie, or AnonymousUser."""
+    session_key = parse_cookie(headers.get('cookie', '')).get(settings.SESSION_COOKIE_NAME)
+    engine = import_module(settings.SESSION_ENGINE)
+    return await aget_user(SimpleNamespace(session=engine.SessionStore(session_key)))
+
+
+async def _fire_sos(user, incident_args):
+    from sos.recipients import aget_recipients
+    from sos.incidents import atrigger_incident, parse_coordinate
+
+    latitude, longitude = incident_args.get('latitude'), incident_args.get('longitude')
+    maps_link = f"\n📍 Location: https://www.google.com/maps?q={latitude},{longitude}" if latitude and longitude else ""
+    recipients = await aget_recipients(user.pk)
+    return await atrigger_incident(
+        user, 'voice', recipients, f"🚨 Emergency Alert! {user.username} detected danger!{maps_link}",
+        idempotency_key=incident_args.get('idempotency_key'),
+        latitude=parse_coordinate(latitude), longitude=parse_coordinate(longitude),
+    )
+
+
+async def voice_stream(scope, receive, send):
+    """Raw ASGI WebSocket app for /ai_module/voice_stream/."""
+    async def send_json(payload):
+        await send({'type': 'websocket.send', 'text': json.dumps(payload)})
+
+    async def close(code=1000):
+        await send({'type': 'websocket.close', 'code': code})
+
+    event = await receive()
+    if event['type'] != 'websocket.connect':
+        return
+
+    headers = _headers(scope)
+    if not _origin_allowed(headers):
+        return await close(4403)
+    user = await _scope_user(headers)
+    if not user.is_authenticated:
+        return await close(4401)
+
+    await send({'type': 'websocket.accept'})
+
+    from users.models import Profile
+    profile = await Profile.objects.filter(user=user).afirst()
+    keywords = parse_keywords(getattr(profile, 'voice_keyword', ''))
+    if not keywords:
+        await send_json({'type': 'error', 'status': 'Set a voice keyword in your profile first.'})
+        return await close()
+    if not getattr(settings, 'VOICE_KEYWORD_SPOTTING', True) or not spotter_available():
+        # the client falls back to uploading a recorded clip
+        await send_json({'type': 'unavailable', 'status': 'Streaming detection unavailable'})
+        return await close()
+
+    detector = SlidingWindowDetector(
+        keywords,
+        window=getattr(settings, 'VOICE_STREAM_WINDOW', DEFAULT_WINDOW),
+        hop=getattr(settings, 'VOICE_STREAM_HOP', DEFAULT_HOP),
+    )
+    max_seconds = getattr(settings, 'VOICE_STREAM_MAX_SECONDS', DEFAULT_MAX_SECONDS)
+    incident_args = {}
+    await send_json({'type': 'ready', 'sample_rate': 16000})
+
+    while True:
+        event = await receive()
+        if event['type'] == 'websocket.disconnect':
+            return
+        if event['type'] != 'websocket.receive':
+            continue
+
+        hit = None
+        if event.get('bytes'):
+            hit = await sync_to_async(detector.feed, thread_sensitive=False)(event['bytes'])
+        elif event.get('text'):
+            try:
+                message = json.loads(event['text'])
+            except ValueError:
+                continue
+            if message.get('type') in ('start', 'location'):
+                incident_args.update({k: str(message[k]) for k in ('latitude', 'longitude', 'idempotency_key') if message.get(k)})
+            elif message.get('type') == 'stop':
+                hit = await sync_to_async(detector.flush, thread_sensitive=False)()
+                if not hit:
+                    await send_json({'type': 'no_keyword', 'status': 'No keyword detected'})
+                    return await close()
+
+        if hit:
+            from .models import AIInteraction
+            from .emotion import aanalyze_voice
+            from .interactions import alog_interaction
+
+            interaction = AIInteraction(user=user, input_text=hit.keyword, detected_danger=True)
+            analysis = asyncio.ensure_future(aanalyze_voice(bytes(detector.buffer)))
+            try:
+                results = await _fire_sos(user, incident_args)
+            except Exception as e:
+                logger.exception(f"Streaming SOS trigger failed for {user.username}")
+                await send_json({'type': 'error', 'status': 'error', 'message': str(e)})
+                await alog_interaction(interaction, await analysis)
+                return await close(1011)
+            await send_json({
+                'type': 'triggered', 'status': '✅ SOS Triggered via voice keyword!',
+                'spoken_text': hit.keyword, 'confidence': hit.confidence, 'results': results,
+            })
+            await alog_interaction(interaction, await analysis)
+            return await close()
+
+        if detector.seconds >= max_seconds:
+            await send_json({'type': 'no_keyword', 'status': 'No keyword detected'})
+            return await close()
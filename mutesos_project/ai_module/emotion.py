@@ -0,0 +1,321 @@
+# ai_module/emotion.py
+"""
+Distress classification with sos/emotion_model.h5.
+
+The model (a Keras 2 Conv1D classifier over 65 per-frame MFCC means) is
+read once per process with h5py and evaluated with NumPy, so neither
+TensorFlow nor a per-request model load is needed. Concurrent requests are
+micro-batched: a worker thread collects feature windows for up to
+VOICE_EMOTION_MAX_WAIT seconds (or VOICE_EMOTION_MAX_BATCH windows) and runs
+them through the model in one call.
+"""
+import os
+import json
+import time
+import queue
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass
+import numpy as np
+from django.conf import settings
+
+from sos.metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# Defaults (override via settings.VOICE_EMOTION_* / VOICE_DISTRESS_LABELS)
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sos', 'emotion_model.h5')
+DEFAULT_LABELS = ('angry', 'disgust', 'fear', 'happy', 'neutral', 'sad', 'surprise')
+DEFAULT_DISTRESS_LABELS = ('angry', 'fear')
+DEFAULT_MAX_BATCH = 32
+DEFAULT_MAX_WAIT = 0.01     # seconds the batcher waits for company
+DEFAULT_TIMEOUT = 2.0       # seconds a request waits for its result
+MAX_WINDOWS = 4             # windows scored per clip
+
+# Feature extraction the model was trained with: mean over 13 MFCCs per
+# frame, 1.5 s at 22.05 kHz -> 65 frames
+FEATURE_RATE = 22050
+WINDOW_SAMPLES = 33075
+N_FFT = 2048
+HOP = 512
+N_MELS = 128
+N_MFCC = 13
+
+
+class EmotionUnavailable(Exception):
+    """h5py is not installed or the model file cannot be read."""
+
+
+@dataclass
+class Emotion:
+    label: str
+    probabilities: dict
+    distress: float       # probability mass on the distress labels
+    danger_level: str     # VoiceAnalysis.DANGER_LEVEL_CHOICES
+
+
+# -----------------------------
+# Features
+# -----------------------------
+def _mel_filters():
+    """Slaney-style mel filterbank (librosa.filters.mel defaults)."""
+    def hz_to_mel(f):
+        f = np.asarray(f, dtype=np.float64)
+        return np.where(f < 1000, f * 3 / 200, 15 + np.log(np.maximum(f, 1e-10) / 1000) / (np.log(6.4) / 27))
+
+    def mel_to_hz(m):
+        return np.where(m < 15, m * 200 / 3, 1000 * np.exp((m - 15) * np.log(6.4) / 27))
+
+    fft_freqs = np.linspace(0, FEATURE_RATE / 2, 1 + N_FFT // 2)
+    mel_f = mel_to_hz(np.linspace(hz_to_mel(0), hz_to_mel(FEATURE_RATE / 2), N_MELS + 2))
+    fdiff = np.diff(mel_f)
+    ramps = mel_f[:, None] - fft_freqs[None, :]
+    lower = -ramps[:-2] / fdiff[:-1, None]
+    upper = ramps[2:] / fdiff[1:, None]
+    weights = np.maximum(0, np.minimum(lower, upper))
+    return weights * (2.0 / (mel_f[2:] - mel_f[:-2]))[:, None]
+
+
+def _dct_matrix():
+    """Orthonormal DCT-II basis, first N_MFCC rows."""
+    n = np.arange(N_MELS)
+    basis = np.cos(np.pi / N_MELS * (n[None, :] + 0.5) * np.arange(N_MFCC)[:, None]) * np.sqrt(2.0 / N_MELS)
+    basis[0] /= np.sqrt(2)
+    return basis
+
+
+_MEL = None
+_DCT = None
+_WINDOW = None
+
+
+def _frame_features(y):
+    global _MEL, _DCT, _WINDOW
+    if _MEL is None:
+        _MEL, _DCT = _mel_filters(), _dct_matrix()
+        _WINDOW = 0.5 - 0.5 * np.cos(2 * np.pi * np.arange(N_FFT) / N_FFT)
+
+    y = np.pad(y, N_FFT // 2, mode='reflect')
+    frames = np.lib.stride_tricks.sliding_window_view(y, N_FFT)[::HOP]
+    power = np.abs(np.fft.rfft(frames * _WINDOW, axis=1)) ** 2
+    log_mel = 10 * np.log10(np.maximum(power @ _MEL.T, 1e-10))
+    log_mel = np.maximum(log_mel, log_mel.max() - 80.0)
+    return (log_mel @ _DCT.T).mean(axis=1)
+
+
+def extract_features(pcm, sample_rate=16000):
+    """
+    (windows, 65) feature matrix for 16-bit mono PCM: up to MAX_WINDOWS
+    consecutive 1.5 s windows, the last one zero-padded.
+    """
+    samples = np.frombuffer(pcm[:len(pcm) // 2 * 2], dtype='<i2').astype(np.float64) / 32768.0
+    if sample_rate != FEATURE_RATE and len(samples):
+        positions = np.arange(int(len(samples) * FEATURE_RATE / sample_rate)) * (sample_rate / FEATURE_RATE)
+        samples = np.interp(positions, np.arange(len(samples)), samples)
+    count = min(MAX_WINDOWS, max(1, -(-len(samples) // WINDOW_SAMPLES)))
+    samples = np.pad(samples[:count * WINDOW_SAMPLES], (0, max(0, count * WINDOW_SAMPLES - len(samples))))
+    return np.stack([_frame_features(w) for w in samples.reshape(count, WINDOW_SAMPLES)]).astype(np.float32)
+
+
+# -----------------------------
+# Model
+# -----------------------------
+class EmotionModel:
+    """Forward pass of the Keras Sequential model stored in an .h5 file."""
+
+    SUPPORTED = {'Conv1D', 'Activation', 'Dropout', 'MaxPooling1D', 'Flatten', 'Dense'}
+
+    def __init__(self, path):
+        try:
+            import h5py
+        except ImportError as e:
+            raise EmotionUnavailable("h5py is not installed") from e
+        try:
+            with h5py.File(path, 'r') as f:
+                config = json.loads(f.attrs['model_config'])
+                weights = f['model_weights']
+                self.layers = []
+                for layer in config['config']['layers']:
+                    kind, cfg = layer['class_name'], layer['config']
+                    if kind not in self.SUPPORTED:
+                        raise EmotionUnavailable(f"unsupported layer {kind}")
+                    params = {}
+                    if kind in ('Conv1D', 'Dense'):
+                        group = weights[cfg['name']][cfg['name']]
+                        params = {'kernel': group['kernel:0'][()].astype(np.float32), 'bias': group['bias:0'][()].astype(np.float32)}
+                    self.layers.append((kind, cfg, params))
+        except (OSError, KeyError) as e:
+            raise EmotionUnavailable(f"could not read {path}: {e}") from e
+        self.input_length = self.layers[0][1]['batch_input_shape'][1]
+
+    @staticmethod
+    def _activate(x, name):
+        if name == 'relu':
+            return np.maximum(x, 0)
+        if name == 'softmax':
+            e = np.exp(x - x.max(axis=-1, keepdims=True))
+            return e / e.sum(axis=-1, keepdims=True)
+        return x
+
+    def predict(self, features):
+        """Class probabilities for a (batch, 65) feature matrix."""
+        x = np.asarray(features, dtype=np.float32)[:, :, None]
+        for kind, cfg, params in self.layers:
+            if kind == 'Conv1D':
+                kernel = params['kernel']
+                width = kernel.shape[0]
+                if cfg['padding'] == 'same':
+                    x = np.pad(x, ((0, 0), ((width - 1) // 2, width // 2), (0, 0)))
+                windows = np.lib.stride_tricks.sliding_window_view(x, width, axis=1)  # (n, L, C, k)
+                x = np.einsum('nlck,kco->nlo', windows, kernel, optimize=True) + params['bias']
+                x = self._activate(x, cfg['activation'])
+            elif kind == 'MaxPooling1D':
+                size = cfg['pool_size'][0]
+                steps = x.shape[1] // size
+                x = x[:, :steps * size].reshape(x.shape[0], steps, size, x.shape[2]).max(axis=2)
+            elif kind == 'Flatten':
+                x = x.reshape(x.shape[0], -1)
+            elif kind == 'Dense':
+                x = self._activate(x @ params['kernel'] + params['bias'], cfg['activation'])
+            elif kind == 'Activation':
+                x = self._activate(x, cfg['activation'])
+        return x
+
+
+# -----------------------------
+# Micro-batching service
+# -----------------------------
+class EmotionService:
+    def __init__(self, model, max_batch=DEFAULT_MAX_BATCH, max_wait=DEFAULT_MAX_WAIT):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _ensure_worker(self):
+        # The model may be loaded in a preloaded parent; the queue and thread
+        # belong to each forked worker.
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                    threading.Thread(target=self._run, name='emotion-batcher', daemon=True).start()
+                    self._pid = os.getpid()
+
+    def submit(self, features):
+        """Queue a (windows, 65) matrix; returns a Future of its probabilities."""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((features, future))
+        return future
+
+    def _run(self):
+        pending = self._queue
+        while True:
+            items = [pending.get()]
+            size = len(items[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+                size += len(items[-1][0])
+
+            try:
+                probabilities = self.model.predict(np.concatenate([features for features, _ in items]))
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+            offset = 0
+            for features, future in items:
+                future.set_result(probabilities[offset:offset + len(features)])
+                offset += len(features)
+
+
+def interpret(probabilities):
+    """Emotion for a (windows, classes) probability matrix."""
+    labels = getattr(settings, 'VOICE_EMOTION_LABELS', DEFAULT_LABELS)
+    distress_labels = getattr(settings, 'VOICE_DISTRESS_LABELS', DEFAULT_DISTRESS_LABELS)
+    mean = np.asarray(probabilities).mean(axis=0)
+    scores = {label: round(float(p), 4) for label, p in zip(labels, mean)}
+    distress = float(sum(scores.get(label, 0.0) for label in distress_labels))
+    level = 'High' if distress >= 0.6 else 'Medium' if distress >= 0.3 else 'Low'
+    return Emotion(max(scores, key=scores.get), scores, round(distress, 4), level)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_emotion_service():
+    """Return the process-wide EmotionService, loading the model on first use."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                model = EmotionModel(getattr(settings, 'VOICE_EMOTION_MODEL', DEFAULT_MODEL_PATH))
+                _service = EmotionService(
+                    model,
+                    max_batch=getattr(settings, 'VOICE_EMOTION_MAX_BATCH', DEFAULT_MAX_BATCH),
+                    max_wait=getattr(settings, 'VOICE_EMOTION_MAX_WAIT', DEFAULT_MAX_WAIT),
+                )
+                logger.info("Emotion model loaded")
+    return _service
+
+
+def preload():
+    """
+    Load the model at web server start (mutesos_project.asgi/wsgi with
+    VOICE_EMOTION_PRELOAD): before gunicorn forks (--preload), so workers
+    share it. Management commands never load it.
+    """
+    try:
+        get_emotion_service()
+    except EmotionUnavailable as e:
+        logger.warning(f"Emotion model not preloaded: {e}")
+
+
+def classify(pcm):
+    """Blocking classification of a clip's 16 kHz PCM."""
+    future = get_emotion_service().submit(extract_features(pcm))
+    return interpret(future.result(getattr(settings, 'VOICE_EMOTION_TIMEOUT', DEFAULT_TIMEOUT)))
+
+
+async def aclassify(pcm):
+    from asgiref.sync import sync_to_async
+
+    service = await sync_to_async(get_emotion_service, thread_sensitive=False)()
+    features = await sync_to_async(extract_features, thread_sensitive=False)(pcm)
+    probabilities = await asyncio.wait_for(
+        asyncio.wrap_future(service.submit(features)), getattr(settings, 'VOICE_EMOTION_TIMEOUT', DEFAULT_TIMEOUT)
+    )
+    return interpret(probabilities)
+
+
+async def aanalyze_voice(pcm):
+    """
+    Classify `pcm` into an unsaved VoiceAnalysis (logged with its
+    interaction, see ai_module.interactions), or None.
+    Never raises: analysis must not get in the way of an SOS.
+    """
+    from .models import VoiceAnalysis
+
+    if not pcm or not getattr(settings, 'VOICE_EMOTION_ENABLED', True):
+        return None
+    try:
+        with stage('emotion'):
+            emotion = await aclassify(pcm)
+        return VoiceAnalysis(confidence_score=emotion.distress, danger_level=emotion.danger_level)
+    except EmotionUnavailable as e:
+        logger.info(f"Voice analysis skipped: {e}")
+    except Exception:
+        logger.exception("Voice analysis failed")
+    return None
@@ -0,0 +1,163 @@
+# ai_module/interactions.py
+"""
+Buffered logging of AIInteraction rows.
+
+Views build the finished interaction (and its VoiceAnalysis, if any) in
+memory and hand it to the log, which writes it once instead of
+create/save/save. With AI_LOG_FLUSH_INTERVAL > 0 rows are buffered per
+process and a background thread writes them with bulk_create every
+interval (or as soon as AI_LOG_MAX_BATCH rows are waiting), off the
+response path, so workers contend for the SQLite write lock once per
+batch instead of several times per request. With an interval of 0 each
+row is written inline.
+"""
+import os
+import atexit
+import logging
+import threading
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import OperationalError, close_old_connections, transaction
+
+from sos.metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# Defaults (override via settings.AI_LOG_*)
+DEFAULT_FLUSH_INTERVAL = 0.5   # seconds; 0 writes every row inline
+DEFAULT_MAX_BATCH = 100        # rows that trigger an early flush
+DEFAULT_MAX_PENDING = 5000     # rows kept for retry when the database is unavailable
+
+
+def write_interactions(entries):
+    """Insert (interaction, analysis-or-None) pairs: one INSERT per table."""
+    from .models import AIInteraction, VoiceAnalysis
+
+    if not entries:
+        return
+    with transaction.atomic():
+        interactions = AIInteraction.objects.bulk_create([interaction for interaction, _ in entries])
+        analyses = []
+        for interaction, analysis in zip(interactions, (analysis for _, analysis in entries)):
+            if analysis is not None:
+                analysis.interaction = interaction
+                analyses.append(analysis)
+        VoiceAnalysis.objects.bulk_create(analyses)
+
+
+class InteractionLog:
+    def __init__(self, flush_interval=DEFAULT_FLUSH_INTERVAL, max_batch=DEFAULT_MAX_BATCH, max_pending=DEFAULT_MAX_PENDING):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._pending = []
+        self._pid = None
+
+    @property
+    def buffered(self):
+        return self.flush_interval > 0
+
+    def _ensure_worker(self):
+        # Buffer, wake-up event and flush thread belong to each forked worker
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pending = []
+                    self._wake = threading.Event()
+                    threading.Thread(target=self._run, name='interaction-log', daemon=True).start()
+                    atexit.register(self.flush)
+                    self._pid = os.getpid()
+
+    def record(self, interaction, analysis=None):
+        """Queue an unsaved AIInteraction (and VoiceAnalysis) for the next flush."""
+        if not self.buffered:
+            return write_interactions([(interaction, analysis)])
+        self._ensure_worker()
+        with self._lock:
+            self._pending.append((interaction, analysis))
+            full = len(self._pending) >= self.max_batch
+        if full:
+            self._wake.set()
+
+    async def arecord(self, interaction, analysis=None):
+        if not self.buffered:
+            return await sync_to_async(write_interactions)([(interaction, analysis)])
+        self.record(interaction, analysis)
+
+    def flush(self):
+        """
+        Write everything buffered so far; returns the number of rows written.
+        While the database is unavailable the batch is kept for the next
+        flush. Any other failure is down to some row (e.g. its user was
+        deleted), so the rows are then written one at a time and the ones
+        that still fail are dropped; they must not block the rest forever.
+        """
+        with self._lock:
+            entries, self._pending = self._pending, []
+        try:
+            write_interactions(entries)
+        except OperationalError:
+            logger.exception(f"Writing {len(entries)} AI interactions failed; keeping them for the next flush")
+            self._requeue(entries)
+            return 0
+        except Exception:
+            logger.exception(f"Writing {len(entries)} AI interactions failed; retrying them one at a time")
+            return self._write_each(entries)
+        return len(entries)
+
+    def _write_each(self, entries):
+        written = 0
+        for index, entry in enumerate(entries):
+            try:
+                write_interactions([entry])
+            except OperationalError:
+                logger.exception(f"Writing {len(entries) - index} AI interactions failed; keeping them for the next flush")
+                self._requeue(entries[index:])
+                break
+            except Exception:
+                logger.exception(f"Dropping AI interaction for user {entry[0].user_id}: it cannot be written")
+            else:
+                written += 1
+        return written
+
+    def _requeue(self, entries):
+        with self._lock:
+            self._pending[:0] = entries
+            del self._pending[:-self.max_pending]
+
+    def _run(self):
+        wake = self._wake
+        while True:
+            wake.wait(self.flush_interval)
+            wake.clear()
+            if self._pending:
+                self.flush()
+                close_old_connections()
+
+
+_log = None
+_log_lock = threading.Lock()
+
+
+def get_interaction_log():
+    """Return the process-wide InteractionLog."""
+    global _log
+    if _log is None:
+        with _log_lock:
+            if _log is None:
+                _log = InteractionLog(
+                    flush_interval=getattr(settings, 'AI_LOG_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL),
+                    max_batch=getattr(settings, 'AI_LOG_MAX_BATCH', DEFAULT_MAX_BATCH),
+                    max_pending=getattr(settings, 'AI_LOG_MAX_PENDING', DEFAULT_MAX_PENDING),
+                )
+    return _log
+
+
+async def alog_interaction(interaction, analysis=None):
+    """Log a finished, unsaved AIInteraction (with its VoiceAnalysis). Never raises."""
+    try:
+        with stage('log'):
+            await get_interaction_log().arecord(interaction, analysis)
+    except Exception:
+        logger.exception(f"Logging AI interaction for user {interaction.user_id} failed")
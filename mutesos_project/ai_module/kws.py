@@ -0,0 +1,218 @@
+# ai_module/kws.py
+import os
+import queue
+import hashlib
+import importlib.util
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Defaults (override via settings.VOICE_KWS_*)
+# PocketSphinx keyword thresholds by phrase length in words (the last covers
+# longer phrases); larger = fewer false alarms. Short phrases are easily
+# confused, so they need the strictest threshold.
+DEFAULT_THRESHOLDS = (1e-5, 1e-10, 1e-15, 1e-20)
+DEFAULT_DECODERS = 2       # decoders kept per process (each holds the acoustic model)
+DEFAULT_SEARCHES = 16      # keyword searches kept per decoder, least recently used dropped first
+
+
+class SpotterUnavailable(Exception):
+    """PocketSphinx is not installed or cannot load its model."""
+
+
+@dataclass
+class KeywordHit:
+    keyword: str
+    confidence: float
+
+
+class _DecoderSlot:
+    def __init__(self, decoder):
+        self.decoder = decoder
+        self.searches = OrderedDict()  # search name -> None, least recently used first
+
+
+def spotter_available():
+    """Whether pocketsphinx can be imported (the model loads on first use)."""
+    return importlib.util.find_spec('pocketsphinx') is not None
+
+
+class KeywordSpotter:
+    """
+    Offline keyword spotting on 16 kHz mono PCM with PocketSphinx.
+    The acoustic model is loaded once per decoder; decoders are pooled and
+    keep a keyword search for each of the `max_searches` most recently used
+    keyword sets, so a request usually only pays for decoding its own clip.
+    `threshold` is one value for every phrase, or a sequence indexed by the
+    phrase's word count (see DEFAULT_THRESHOLDS).
+    """
+
+    def __init__(self, pool_size=DEFAULT_DECODERS, threshold=DEFAULT_THRESHOLDS, max_searches=DEFAULT_SEARCHES):
+        self.pool_size = pool_size
+        self.threshold = threshold
+        self.max_searches = max(1, max_searches)
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _new_decoder(self):
+        try:
+            from pocketsphinx import Decoder
+        except ImportError as e:
+            raise SpotterUnavailable("pocketsphinx is not installed") from e
+        try:
+            # keyword search only: skip loading the n-gram language model
+            return Decoder(lm=None, logfn=os.devnull)
+        except Exception as e:
+            raise SpotterUnavailable(f"could not load PocketSphinx model: {e}") from e
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.pool_size:
+                slot = _DecoderSlot(self._new_decoder())
+                self._created += 1
+                logger.info(f"Keyword spotter decoder {self._created}/{self.pool_size} loaded")
+                return slot
+        return self._idle.get()
+
+    def threshold_for(self, keyword):
+        """Detection threshold for one keyword phrase."""
+        if isinstance(self.threshold, (int, float)):
+            return self.threshold
+        return self.threshold[min(len(keyword.split()), len(self.threshold)) - 1]
+
+    def _activate(self, slot, keywords):
+        """Activate the search for `keywords` on `slot`, adding it (and dropping the least recently used) as needed."""
+        name = "kws_" + hashlib.sha1("|".join(keywords).encode()).hexdigest()[:16]
+        if name in slot.searches:
+            slot.searches.move_to_end(name)
+        else:
+            with tempfile.NamedTemporaryFile("w", suffix=".kws", delete=False) as f:
+                f.writelines(f"{keyword} /{self.threshold_for(keyword):g}/\n" for keyword in keywords)
+            try:
+                slot.decoder.add_kws(name, f.name)
+            finally:
+                os.remove(f.name)
+            slot.searches[name] = None
+        slot.decoder.activate_search(name)
+        # only after activating: the active search is never the one dropped
+        while len(slot.searches) > self.max_searches:
+            stale, _ = slot.searches.popitem(last=False)
+            slot.decoder.remove_search(stale)
+
+    def spot(self, pcm, keywords):
+        """
+        Search `pcm` for any of `keywords`. Returns the most confident
+        KeywordHit, or None. Confidence is the decoder's posterior for the hit.
+        """
+        keywords = sorted({k.lower().strip() for k in keywords if k and k.strip()})
+        if not keywords or not pcm:
+            return None
+        slot = self._acquire()
+        try:
+            decoder = slot.decoder
+            self._activate(slot, keywords)
+            decoder.start_utt()
+            decoder.process_raw(pcm, False, True)
+            decoder.end_utt()
+
+            logmath = decoder.get_logmath()
+            best = None
+            for seg in decoder.seg():
+                word = seg.word.strip().lower()
+                if word not in keywords:
+                    continue
+                confidence = min(1.0, max(0.0, logmath.exp(seg.prob)))
+                if best is None or confidence > best.confidence:
+                    best = KeywordHit(word, confidence)
+            return best
+        finally:
+            self._idle.put(slot)
+
+
+class SlidingWindowDetector:
+    """
+    Incremental keyword detection over a live PCM stream: the last `window`
+    seconds are searched every `hop` seconds of new audio, so a keyword is
+    reported within about one hop of being spoken. With `gate`, windows the
+    voice-activity detector finds no speech in are not searched; the noise
+    floor is tracked across the whole stream.
+    """
+
+    def __init__(self, keywords, spotter=None, window=2.5, hop=0.5, sample_rate=16000, sample_width=2, gate=True):
+        self.keywords = list(keywords)
+        self.spotter = spotter or get_spotter()
+        self.gate = gate
+        self.noise_floor = None
+        self.bytes_per_second = sample_rate * sample_width
+        self.window_bytes = int(window * self.bytes_per_second) // sample_width * sample_width
+        self.hop_bytes = int(hop * self.bytes_per_second) // sample_width * sample_width
+        self.buffer = bytearray()
+        self.pending = 0
+        self.received = 0
+
+    @property
+    def seconds(self):
+        """Audio received so far, in seconds."""
+        return self.received / self.bytes_per_second
+
+    def feed(self, pcm):
+        """Append PCM; returns a KeywordHit once a full hop has arrived and matched, else None."""
+        self.buffer.extend(pcm)
+        self.pending += len(pcm)
+        self.received += len(pcm)
+        if len(self.buffer) > self.window_bytes:
+            del self.buffer[:len(self.buffer) - self.window_bytes]
+        if self.pending < self.hop_bytes:
+            return None
+        self.pending = 0
+        return self._search()
+
+    def _search(self):
+        window = bytes(self.buffer)
+        if self.gate:
+            from .vad import estimate_noise_floor, detect_speech
+
+            # quick to fall, slow to rise: speech must not lift the floor
+            estimate = estimate_noise_floor(window)
+            if self.noise_floor is None or estimate < self.noise_floor:
+                self.noise_floor = estimate
+            else:
+                self.noise_floor += 0.05 * (estimate - self.noise_floor)
+            if not detect_speech(window, noise_floor_db=self.noise_floor).has_speech:
+                return None
+        return self.spotter.spot(window, self.keywords)
+
+    def flush(self):
+        """Search whatever arrived since the last hop (end of stream)."""
+        if not self.pending:
+            return None
+        self.pending = 0
+        return self._search()
+
+
+_spotter = None
+_spotter_lock = threading.Lock()
+
+
+def get_spotter():
+    """Return the process-wide KeywordSpotter."""
+    global _spotter
+    if _spotter is None:
+        with _spotter_lock:
+            if _spotter is None:
+                _spotter = KeywordSpotter(
+                    pool_size=getattr(settings, 'VOICE_KWS_DECODERS', DEFAULT_DECODERS),
+                    threshold=getattr(settings, 'VOICE_KWS_THRESHOLD', None) or DEFAULT_THRESHOLDS,
+                    max_searches=getattr(settings, 'VOICE_KWS_SEARCHES', DEFAULT_SEARCHES),
+                )
+    return _spotter
@@ -0,0 +1,196 @@
+# ai_module/matcher.py
+"""
+Keyword matching for voice transcripts.
+
+A user's trigger phrases (Profile.voice_keyword, comma-separated) are
+compiled once into Aho-Corasick automata holding every phrase plus its
+one-edit variants ("kelp me" for "help me") and a phonetic key of each
+phrase. The edit always falls inside one word of at least MIN_FUZZY_LENGTH
+letters; shorter words must match exactly, so "help my mom" and "help men"
+are not "help me". A transcript is then scanned once per automaton, so matching is
+linear in the transcript length however many phrases and variants there
+are. A match only counts when it spans whole words of the transcript:
+"help me" is not found in "help moving", nor its phonetic key in "slip my
+mind". Compiled matchers are cached by keyword text, so they are rebuilt
+only when a profile's keywords change.
+"""
+import re
+import string
+from collections import deque
+from dataclasses import dataclass
+from functools import lru_cache
+
+# Confidence per kind of match
+EXACT = 1.0
+PHONETIC = 0.7
+# Default trigger threshold: exact and one-edit matches (0.8+), not phonetic ones
+MIN_CONFIDENCE = 0.8
+
+# One-edit variants are only generated for words at least this long (an edit
+# to a shorter word turns "me" into "my" or "men": ordinary speech), and for
+# phrases at most MAX_FUZZY_LENGTH long: a phrase has ~70 variants per
+# character, so long ones cost seconds and hundreds of MB to compile; they
+# still match exactly and phonetically
+MIN_FUZZY_LENGTH = 4
+MAX_FUZZY_LENGTH = 24
+# Shorter consonant keys ("415" = help me, will pm) recur all over ordinary speech
+MIN_PHONETIC_LENGTH = 4
+
+_NON_ALNUM = re.compile(r'[^a-z0-9]+')
+_ALPHABET = string.ascii_lowercase + string.digits
+
+# Letter -> consonant class (Soundex groups); vowels and h/w/y drop out
+_PHONETIC_CLASSES = {
+    **dict.fromkeys('bfpv', '1'), **dict.fromkeys('cgjkqsxz', '2'), **dict.fromkeys('dt', '3'),
+    'l': '4', **dict.fromkeys('mn', '5'), 'r': '6',
+}
+
+
+@dataclass
+class KeywordMatch:
+    keyword: str       # the trigger phrase as the user wrote it
+    confidence: float
+    kind: str          # 'exact', 'fuzzy' or 'phonetic'
+
+
+def parse_keywords(text):
+    """Trigger phrases from a comma/newline-separated keyword field."""
+    return [k.strip() for k in re.split(r'[,\n;]+', text or '') if k.strip()]
+
+
+def squash(text):
+    """Lowercase alphanumerics only (transcribers disagree on spacing)."""
+    return _NON_ALNUM.sub('', (text or '').lower())
+
+
+def words(text):
+    """Lowercase alphanumeric words of `text`."""
+    return [word for word in _NON_ALNUM.split((text or '').lower()) if word]
+
+
+def phonetic_key(text):
+    """Consonant-class skeleton of `text`, repeats collapsed."""
+    key = []
+    for char in squash(text):
+        code = _PHONETIC_CLASSES.get(char, '')
+        if code and (not key or key[-1] != code):
+            key.append(code)
+        elif not code and char.isdigit():
+            key.append(char)
+    return ''.join(key)
+
+
+def joined(parts):
+    """Concatenate `parts`; returns (text, offsets where a part starts or ends)."""
+    offsets, end = {0}, 0
+    for part in parts:
+        end += len(part)
+        offsets.add(end)
+    return ''.join(parts), offsets
+
+
+def one_edit_variants(word):
+    """Every string one deletion, substitution or insertion away from `word`."""
+    splits = [(word[:i], word[i:]) for i in range(len(word) + 1)]
+    variants = {a + b[1:] for a, b in splits if b}
+    variants |= {a + c + b[1:] for a, b in splits if b for c in _ALPHABET}
+    variants |= {a + c + b for a, b in splits for c in _ALPHABET}
+    variants.discard(word)
+    return variants
+
+
+class AhoCorasick:
+    """Multi-pattern automaton; each pattern carries a payload, the best one wins."""
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()]  # (rank, length, payload) of every pattern ending here
+
+    def add(self, pattern, payload, rank):
+        state = 0
+        for char in pattern:
+            nxt = self.goto[state].get(char)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[state][char] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append(())
+            state = nxt
+        if not self.out[state] or rank > self.out[state][0][0]:
+            self.out[state] = ((rank, len(pattern), payload),)
+
+    def build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self.goto[state].items():
+                queue.append(nxt)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[nxt] = self.goto[fallback].get(char, 0)
+                # inherit the outputs along the failure chain
+                self.out[nxt] += self.out[self.fail[nxt]]
+        return self
+
+    def best(self, text, boundaries=None):
+        """
+        Best (rank, payload) found in `text`, or None. With `boundaries`
+        (offsets where words start or end) a match must span whole words.
+        """
+        state, found = 0, None
+        for end, char in enumerate(text, 1):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for rank, length, payload in self.out[state]:
+                if found is not None and rank <= found[0]:
+                    continue
+                if boundaries is None or (end in boundaries and end - length in boundaries):
+                    found = (rank, payload)
+        return found
+
+
+class KeywordMatcher:
+    def __init__(self, keywords):
+        self.keywords = list(keywords)
+        self.spelled = AhoCorasick()
+        self.phonetic = AhoCorasick()
+        for keyword in self.keywords:
+            parts = words(keyword)
+            phrase = ''.join(parts)
+            if not phrase:
+                continue
+            self.spelled.add(phrase, KeywordMatch(keyword, EXACT, 'exact'), EXACT)
+            if len(phrase) <= MAX_FUZZY_LENGTH:
+                fuzzy = KeywordMatch(keyword, round(1 - 1 / len(phrase), 3), 'fuzzy')
+                for i, part in enumerate(parts):
+                    if len(part) < MIN_FUZZY_LENGTH:
+                        continue
+                    before, after = ''.join(parts[:i]), ''.join(parts[i + 1:])
+                    for variant in one_edit_variants(part):
+                        self.spelled.add(before + variant + after, fuzzy, fuzzy.confidence)
+            key = ''.join(phonetic_key(part) for part in words(keyword))
+            if len(key) >= MIN_PHONETIC_LENGTH:
+                self.phonetic.add(key, KeywordMatch(keyword, PHONETIC, 'phonetic'), PHONETIC)
+        self.spelled.build()
+        self.phonetic.build()
+
+    def search(self, transcript):
+        """Best KeywordMatch spanning whole words of `transcript`, or None."""
+        parts = words(transcript)
+        found = self.spelled.best(*joined(parts))
+        if found is None or found[0] < PHONETIC:
+            phonetic = self.phonetic.best(*joined([phonetic_key(part) for part in parts]))
+            if phonetic and (found is None or phonetic[0] > found[0]):
+                found = phonetic
+        return found[1] if found else None
+
+
+# A matcher is ~20k automaton states (~5 MB) per phrase of MAX_FUZZY_LENGTH
+@lru_cache(maxsize=256)
+def get_matcher(keyword_text):
+    """Compiled matcher for a Profile.voice_keyword value (cached by its text)."""
+    return KeywordMatcher(parse_keywords(keyword_text))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 12:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_module', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aiinteraction',
+            name='occurred_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
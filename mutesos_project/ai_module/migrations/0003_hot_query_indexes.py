@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-17 12:32
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_module', '0002_aiinteraction_occurred_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='aiinteraction',
+            index=models.Index(fields=['user', '-timestamp'], name='aiinteraction_user_recent'),
+        ),
+        migrations.AddIndex(
+            model_name='aiinteraction',
+            index=models.Index(fields=['timestamp'], name='aiinteraction_timestamp'),
+        ),
+        migrations.AddIndex(
+            model_name='aiinteraction',
+            index=models.Index(fields=['input_voice_file'], name='aiinteraction_voice_file'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.4 on 2026-10-17 13:44
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_module', '0003_hot_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aiinteraction',
+            name='event_key',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='aiinteraction',
+            constraint=models.UniqueConstraint(fields=('user', 'event_key'), name='unique_interaction_event_key'),
+        ),
+    ]
@@ -14,7 +14,21 @@ class AIInteraction(models.Model):
         upload_to='voice_inputs/', blank=True, null=True
     )
     timestamp = models.DateTimeField(auto_now_add=True)
+    # when the client heard it, for events replayed after being queued offline
+    occurred_at = models.DateTimeField(blank=True, null=True)
     detected_danger = models.BooleanField(default=False)
+    # client event id of a replayed offline event (see ai_module.views.voice_batch), so a resent batch is stored once
+    event_key = models.CharField(max_length=64, null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'event_key'], name='unique_interaction_event_key'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-timestamp'], name='aiinteraction_user_recent'),
+            models.Index(fields=['timestamp'], name='aiinteraction_timestamp'),        # retention sweeps
+            models.Index(fields=['input_voice_file'], name='aiinteraction_voice_file'),  # shared-blob lookups
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.timestamp.strftime('%Y-%m-%d %H:%M:%S')}"
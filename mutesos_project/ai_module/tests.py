@@ -1,3 +1,485 @@
-from django.test import TestCase
+import os
+import sys
+import json
+import time
+import asyncio
+import subprocess
+from importlib.util import find_spec
+from unittest import mock, skipUnless
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import OperationalError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
-# Create your tests here.
+from sos.models import SosAlert
+from sos.testing import QueryBudgetMixin
+from sos.transport import FakeTransport, set_transport
+from .consumers import voice_stream
+from .emotion import (
+    DEFAULT_MODEL_PATH, FEATURE_RATE, WINDOW_SAMPLES, EmotionModel, EmotionService, aanalyze_voice, extract_features, interpret,
+)
+from .interactions import InteractionLog, alog_interaction
+from .models import AIInteraction, VoiceAnalysis
+from .kws import KeywordHit, KeywordSpotter, SpotterUnavailable
+from .matcher import KeywordMatcher, MIN_CONFIDENCE, get_matcher
+from .vad import detect_speech
+from .voice import analyze_clip, match_transcript
+
+
+def clip(*parts):
+    """16 kHz PCM from (seconds, amplitude) parts: a 220 Hz tone, or silence at amplitude 0."""
+    pieces = []
+    for seconds, amplitude in parts:
+        t = np.arange(int(seconds * 16000)) / 16000
+        pieces.append(amplitude * np.sin(2 * np.pi * 220 * t))
+    return (np.concatenate(pieces) * 32767).astype('<i2').tobytes()
+
+
+class StubSpotter:
+    def __init__(self, hit=None, error=None):
+        self.hit, self.error = hit, error
+
+    def spot(self, pcm, keywords):
+        if self.error:
+            raise self.error
+        return self.hit
+
+
+class FakeDecoder:
+    """Records the searches a KeywordSpotter keeps on a PocketSphinx decoder."""
+
+    def __init__(self):
+        self.searches, self.active = {}, None
+
+    def add_kws(self, name, path):
+        with open(path) as f:
+            self.searches[name] = f.read()
+
+    def activate_search(self, name):
+        assert name in self.searches
+        self.active = name
+
+    def remove_search(self, name):
+        assert name != self.active
+        del self.searches[name]
+
+    def start_utt(self):
+        pass
+
+    def process_raw(self, pcm, no_search, full_utt):
+        pass
+
+    def end_utt(self):
+        pass
+
+    def seg(self):
+        return []
+
+    def get_logmath(self):
+        return None
+
+
+class KeywordSpotterTests(SimpleTestCase):
+    def spotter(self, **kwargs):
+        spotter = KeywordSpotter(pool_size=1, **kwargs)
+        self.decoder = FakeDecoder()
+        spotter._new_decoder = lambda: self.decoder
+        return spotter
+
+    def test_searches_are_kept_for_recent_keyword_sets_only(self):
+        spotter = self.spotter(max_searches=2)
+        for phrase in ["help me", "save me", "help me", "bachao"]:
+            spotter.spot(b"\0\0", [phrase])
+
+        # "save me" was least recently used when "bachao" needed room
+        self.assertEqual(len(self.decoder.searches), 2)
+        self.assertEqual(sorted(self.decoder.searches.values()), ["bachao /1e-05/\n", "help me /1e-10/\n"])
+
+    def test_short_phrases_get_stricter_thresholds(self):
+        spotter = self.spotter()
+        self.assertEqual([spotter.threshold_for(p) for p in ["help", "help me", "please help me now", "somebody please help me now"]],
+                         [1e-5, 1e-10, 1e-20, 1e-20])
+        self.assertEqual(self.spotter(threshold=1e-30).threshold_for("help"), 1e-30)
+
+
+@override_settings(VOICE_FULL_TRANSCRIPTION=False, VOICE_KEYWORD_SPOTTING=True)
+class KeywordSpottingTests(TestCase):
+    def setUp(self):
+        self.pcm = clip((0.5, 0), (1.0, 0.3), (0.5, 0))
+
+    def test_silent_clip_is_rejected_before_recognition(self):
+        self.pcm = clip((2.0, 0.001))
+        with mock.patch("ai_module.voice.get_spotter") as spotter, mock.patch("ai_module.voice.transcribe_pcm") as transcribe:
+            result = analyze_clip(self.pcm, "help me")
+
+        self.assertEqual((result.detected, result.engine), (False, "vad"))
+        spotter.assert_not_called()
+        transcribe.assert_not_called()
+
+    def test_spotted_keyword_skips_network_transcription(self):
+        with mock.patch("ai_module.voice.get_spotter", return_value=StubSpotter(KeywordHit("help me", 0.8))), \
+             mock.patch("ai_module.voice.transcribe_pcm") as transcribe:
+            result = analyze_clip(self.pcm, "Help me")
+
+        self.assertTrue(result.detected)
+        self.assertEqual((result.keyword, result.confidence, result.engine), ("help me", 0.8, "kws"))
+        transcribe.assert_not_called()
+
+    def test_falls_back_to_transcription_without_spotter(self):
+        with mock.patch("ai_module.voice.get_spotter", return_value=StubSpotter(error=SpotterUnavailable())), \
+             mock.patch("ai_module.voice.transcribe_pcm", return_value="please help me now"):
+            result = analyze_clip(self.pcm, "help me")
+
+        self.assertTrue(result.detected)
+        self.assertEqual(result.engine, "stt")
+
+
+class KeywordMatcherTests(SimpleTestCase):
+    def test_matches_any_phrase_exactly_or_with_one_mistake(self):
+        matcher = get_matcher("help me, call mom")
+
+        exact = matcher.search("please HELP me now")
+        self.assertEqual((exact.keyword, exact.kind, exact.confidence), ("help me", "exact", 1.0))
+        mistaken = matcher.search("kelp me")
+        self.assertEqual((mistaken.keyword, mistaken.kind), ("help me", "fuzzy"))
+        self.assertLess(mistaken.confidence, 1.0)
+        self.assertEqual(matcher.search("coll mom").keyword, "call mom")
+        self.assertIsNone(matcher.search("i am fine, thanks"))
+
+    def test_short_words_of_a_phrase_must_match_exactly(self):
+        matcher = get_matcher("help me, call mom")
+        for sentence in ("can you help my mom with the groceries", "help men carry it", "call mum"):
+            with self.subTest(sentence=sentence):
+                self.assertIsNone(matcher.search(sentence))
+                self.assertIsNone(match_transcript(sentence, "help me, call mom"))
+
+    def test_ordinary_speech_does_not_match(self):
+        matcher = get_matcher("help me, call mom")
+        for sentence in ("I'll pay more tomorrow", "it must have slipped my mind", "slip my mind",
+                         "will pm you later", "whale pumps", "I need help moving the couch"):
+            with self.subTest(sentence=sentence):
+                self.assertIsNone(match_transcript(sentence, "help me, call mom"))
+                match = matcher.search(sentence)
+                self.assertTrue(match is None or match.confidence < MIN_CONFIDENCE, match)
+
+    def test_matches_span_whole_words(self):
+        matcher = get_matcher("bachao, emergency help")
+        self.assertEqual(matcher.search("ba chao").kind, "exact")
+        self.assertIsNone(matcher.search("abachaos"))
+        self.assertEqual(matcher.search("emergancy help now").kind, "fuzzy")
+        self.assertEqual(matcher.search("emurjensee halp").kind, "phonetic")
+        self.assertIsNone(matcher.search("the emergency helpline"))
+
+    def test_long_phrases_match_exactly_without_fuzzy_variants(self):
+        phrase = "please send someone to the old warehouse on fifth street"
+        started = time.perf_counter()
+        matcher = KeywordMatcher([phrase, "x" * 199])
+        self.assertLess(time.perf_counter() - started, 0.5)
+        self.assertLess(len(matcher.spelled.goto), 1000)
+        self.assertEqual(matcher.search(f"{phrase} now").kind, "exact")
+
+    def test_matcher_is_compiled_once_per_keyword_text(self):
+        self.assertIs(get_matcher("bachao"), get_matcher("bachao"))
+        self.assertIsNot(get_matcher("bachao"), get_matcher("bachao, help"))
+
+
+class VoiceActivityTests(TestCase):
+    def test_trims_to_speech_with_noise_floor_from_clip(self):
+        result = detect_speech(clip((1.0, 0.001), (0.6, 0.3), (1.0, 0.001)))
+
+        self.assertEqual(len(result.regions), 1)
+        start, end = result.regions[0]
+        self.assertAlmostEqual(start, 1.0 - 0.24, delta=0.06)
+        self.assertAlmostEqual(end, 1.6 + 0.24, delta=0.06)
+        self.assertLess(len(result.speech), 2 * 16000 * 1.2)
+        self.assertLess(result.noise_floor_db, -50)
+
+
+class SpotAfter:
+    """Reports the keyword once `seconds` of audio have been searched."""
+    def __init__(self, seconds):
+        self.bytes = int(seconds * 32000)
+
+    def spot(self, pcm, keywords):
+        return KeywordHit(keywords[0], 0.9) if len(pcm) >= self.bytes else None
+
+
+@override_settings(VOICE_STREAM_WINDOW=1.0, VOICE_STREAM_HOP=0.25, SOS_USE_OUTBOX=True)
+class VoiceStreamTests(TestCase):
+    def setUp(self):
+        set_transport(FakeTransport())
+        self.addCleanup(set_transport, None)
+        self.user = User.objects.create_user("alice", password="pw")
+        self.user.profile.voice_keyword = "help me"
+        self.user.profile.save()
+        self.client.force_login(self.user)
+        self.cookie = f"{settings.SESSION_COOKIE_NAME}={self.client.cookies[settings.SESSION_COOKIE_NAME].value}"
+
+    async def _run(self, messages, origin="http://testserver"):
+        inbox = asyncio.Queue()
+        for message in [{"type": "websocket.connect"}] + messages + [{"type": "websocket.disconnect"}]:
+            inbox.put_nowait(message)
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "websocket", "path": "/ai_module/voice_stream/", "headers": [
+            (b"host", b"testserver"), (b"origin", origin.encode()), (b"cookie", self.cookie.encode()),
+        ]}
+        with mock.patch("ai_module.consumers.spotter_available", return_value=True), \
+             mock.patch("ai_module.kws.get_spotter", return_value=SpotAfter(1.0)):
+            await voice_stream(scope, inbox.get, send)
+        return sent
+
+    async def test_fires_once_keyword_heard_mid_stream(self):
+        silence = {"type": "websocket.receive", "bytes": clip((0.25, 0))}
+        speech = {"type": "websocket.receive", "bytes": clip((0.25, 0.3))}
+        start = {"type": "websocket.receive", "text": json.dumps({"type": "start", "idempotency_key": "k1"})}
+        sent = await self._run([start] + [silence] * 4 + [speech] * 4)
+
+        replies = [json.loads(m["text"]) for m in sent if m["type"] == "websocket.send"]
+        self.assertEqual([r["type"] for r in replies], ["ready", "triggered"])
+        self.assertEqual(replies[-1]["results"]["outcome"], "new")
+        self.assertEqual(await SosAlert.objects.filter(user=self.user, method="voice", idempotency_key="k1").acount(), 1)
+
+    async def test_cross_site_origin_is_rejected(self):
+        sent = await self._run([], origin="https://evil.example")
+
+        self.assertEqual(sent, [{"type": "websocket.close", "code": 4403}])
+
+
+class RecordingModel:
+    """Stand-in for EmotionModel: remembers batch sizes, predicts fear."""
+    def __init__(self):
+        self.batches = []
+
+    def predict(self, features):
+        self.batches.append(len(features))
+        probabilities = np.zeros((len(features), 7), dtype=np.float32)
+        probabilities[:, 2] = 0.8  # fear
+        probabilities[:, 4] = 0.2  # neutral
+        return probabilities
+
+
+class EmotionServiceTests(TestCase):
+    def test_concurrent_requests_share_one_batch(self):
+        model = RecordingModel()
+        service = EmotionService(model, max_batch=8, max_wait=0.2)
+        futures = [service.submit(np.zeros((2, 65), dtype=np.float32)) for _ in range(4)]
+
+        self.assertTrue(all(f.result(2).shape == (2, 7) for f in futures))
+        self.assertEqual(model.batches, [8])
+
+    async def test_voice_analysis_is_recorded_for_interaction(self):
+        user = await User.objects.acreate(username="bob")
+        interaction = AIInteraction(user=user)
+        service = EmotionService(RecordingModel(), max_wait=0)
+
+        with mock.patch("ai_module.emotion.get_emotion_service", return_value=service):
+            await alog_interaction(interaction, await aanalyze_voice(clip((1.0, 0.3))))
+
+        analysis = await VoiceAnalysis.objects.aget(interaction=interaction)
+        self.assertEqual(analysis.danger_level, "High")
+        self.assertAlmostEqual(analysis.confidence_score, 0.8, places=3)
+
+
+def naive_forward(model, features):
+    """The model's layers evaluated position by position, as a reference for EmotionModel.predict."""
+    outputs = []
+    for sample in np.asarray(features, dtype=np.float64):
+        x = sample[:, None]
+        for kind, cfg, params in model.layers:
+            if kind == "Conv1D":
+                kernel, width = params["kernel"], params["kernel"].shape[0]
+                if cfg["padding"] == "same":
+                    padded = np.zeros((len(x) + width - 1, x.shape[1]))
+                    padded[(width - 1) // 2:(width - 1) // 2 + len(x)] = x
+                    x = padded
+                x = np.array([sum(x[i + k] @ kernel[k] for k in range(width)) for i in range(len(x) - width + 1)]) + params["bias"]
+            elif kind == "MaxPooling1D":
+                size = cfg["pool_size"][0]
+                x = np.array([x[i:i + size].max(axis=0) for i in range(0, len(x) - size + 1, size)])
+            elif kind == "Flatten":
+                x = x.reshape(-1)
+            elif kind == "Dense":
+                x = x @ params["kernel"] + params["bias"]
+            if cfg.get("activation") == "relu":
+                x = np.maximum(x, 0)
+            elif cfg.get("activation") == "softmax":
+                x = np.exp(x - x.max()) / np.exp(x - x.max()).sum()
+        outputs.append(x)
+    return np.array(outputs)
+
+
+@skipUnless(find_spec("h5py"), "h5py not installed")
+class BundledEmotionModelTests(SimpleTestCase):
+    """sos/emotion_model.h5 itself, not a stand-in."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.model = EmotionModel(DEFAULT_MODEL_PATH)
+
+    def test_forward_pass_matches_a_naive_evaluation(self):
+        features = np.random.default_rng(0).normal(-20, 15, size=(3, 65)).astype(np.float32)
+        np.testing.assert_allclose(self.model.predict(features), naive_forward(self.model, features), atol=1e-5)
+
+    def test_known_clip_scores_fixed_probabilities(self):
+        t = np.arange(24000) / 16000
+        chirp = (0.3 * np.sin(2 * np.pi * (220 + 200 * t) * t) * 32767).astype("<i2").tobytes()
+
+        emotion = interpret(self.model.predict(extract_features(chirp)))
+
+        self.assertEqual((emotion.label, emotion.danger_level), ("fear", "High"))
+        self.assertAlmostEqual(emotion.probabilities["fear"], 0.9712, places=3)
+        self.assertAlmostEqual(emotion.probabilities["sad"], 0.0288, places=3)
+
+    @skipUnless(find_spec("librosa"), "librosa not installed")
+    def test_features_match_librosa_mfcc(self):
+        import librosa
+
+        y = 0.3 * np.sin(2 * np.pi * 440 * np.arange(WINDOW_SAMPLES) / FEATURE_RATE)
+        # the Keras 2-era librosa padded frames by reflection, the model's training setup
+        expected = librosa.feature.mfcc(y=y, sr=FEATURE_RATE, n_mfcc=13, pad_mode="reflect").mean(axis=0)
+        np.testing.assert_allclose(extract_features((y * 32768).astype("<i2").tobytes(), FEATURE_RATE)[0], expected, atol=1e-2)
+
+
+class EmotionPreloadTests(SimpleTestCase):
+    """VOICE_EMOTION_PRELOAD loads the model in web processes only; each case runs in a fresh interpreter."""
+
+    def loaded_after(self, code):
+        script = f"import sys, django; django.setup(); {code}; print(sorted({{'numpy', 'h5py'}} & set(sys.modules)))"
+        env = {**os.environ, "DJANGO_SETTINGS_MODULE": "mutesos_project.settings", "VOICE_EMOTION_PRELOAD": "True"}
+        out = subprocess.run([sys.executable, "-c", script], cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True)
+        return out.stdout.strip().splitlines()[-1]
+
+    def test_management_commands_do_not_load_the_model(self):
+        self.assertEqual(self.loaded_after("from django.core.management import call_command; call_command('check', verbosity=0)"), "[]")
+
+    @skipUnless(find_spec("h5py"), "h5py is not installed")
+    def test_web_entry_point_loads_the_model(self):
+        self.assertIn("numpy", self.loaded_after("import mutesos_project.asgi"))
+
+
+class InteractionLogTests(TestCase):
+    def test_buffered_rows_are_written_in_one_batch(self):
+        user = User.objects.create_user("dave", password="pw")
+        log = InteractionLog(flush_interval=60, max_batch=1000)
+        for i in range(5):
+            log.record(AIInteraction(user=user, input_text=f"clip {i}"), VoiceAnalysis(danger_level="Low") if i % 2 else None)
+        self.assertFalse(AIInteraction.objects.exists())
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(log.flush(), 5)
+
+        self.assertEqual(len([q for q in queries if q["sql"].startswith("INSERT")]), 2)
+        self.assertEqual(AIInteraction.objects.filter(user=user).count(), 5)
+        self.assertEqual(sorted(VoiceAnalysis.objects.values_list("interaction__input_text", flat=True)), ["clip 1", "clip 3"])
+
+    def test_rows_are_kept_while_the_database_is_unavailable(self):
+        user = User.objects.create_user("dave", password="pw")
+        log = InteractionLog(flush_interval=60, max_batch=1000)
+        log.record(AIInteraction(user=user, input_text="clip"))
+        with mock.patch("ai_module.interactions.write_interactions", side_effect=OperationalError("database is locked")):
+            self.assertEqual(log.flush(), 0)
+
+        self.assertEqual(log.flush(), 1)
+        self.assertTrue(AIInteraction.objects.filter(user=user).exists())
+
+
+class InteractionLogCommitTests(TransactionTestCase):
+    """Foreign keys are checked when the flush commits, which TestCase would defer to its rollback."""
+
+    def test_a_row_that_cannot_be_written_is_dropped_alone(self):
+        user, gone = User.objects.create_user("dave", password="pw"), User.objects.create_user("gone", password="pw")
+        log = InteractionLog(flush_interval=60, max_batch=1000)
+        log.record(AIInteraction(user=user, input_text="before"))
+        log.record(AIInteraction(user_id=gone.pk, input_text="orphan"), VoiceAnalysis(danger_level="Low"))
+        log.record(AIInteraction(user=user, input_text="after"))
+        gone.delete()
+
+        self.assertEqual(log.flush(), 2)
+        self.assertEqual(sorted(AIInteraction.objects.values_list("input_text", flat=True)), ["after", "before"])
+        self.assertEqual(log.flush(), 0)
+
+
+@override_settings(SOS_USE_OUTBOX=True)
+class VoiceBatchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("carol", password="pw")
+        self.user.profile.voice_keyword = "help me"
+        self.user.profile.save()
+        self.client.force_login(self.user)
+
+    def post(self, events):
+        return self.client.post("/ai_module/voice_batch/", json.dumps({"events": events}), content_type="application/json")
+
+    def test_backlog_is_stored_in_one_insert_and_raises_one_sos(self):
+        now_ms = time.time() * 1000
+        events = [
+            {"transcript": "all good", "timestamp": now_ms - 60000},
+            {"transcript": "help me", "timestamp": now_ms - 30000, "idempotency_key": "a"},
+            {"transcript": "kelp me please", "timestamp": now_ms - 5000, "latitude": 12.9, "longitude": 77.6, "idempotency_key": "b"},
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            data = self.post(events).json()
+
+        inserts = [q for q in queries if q["sql"].startswith("INSERT") and 'INTO "ai_module_aiinteraction"' in q["sql"]]
+        self.assertEqual(len(inserts), 1)
+
+        self.assertEqual((data["received"], data["detected"]), (3, 2))
+        self.assertEqual(data["results"]["outcome"], "new")
+        self.assertEqual(AIInteraction.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(AIInteraction.objects.filter(user=self.user, detected_danger=True).count(), 2)
+        incident = SosAlert.objects.get(user=self.user)
+        self.assertEqual((incident.idempotency_key, incident.latitude), ("b", 12.9))
+
+    def test_stale_detections_are_recorded_without_alerting(self):
+        data = self.post([{"transcript": "help me", "timestamp": "2020-01-01T10:00:00Z"}]).json()
+
+        self.assertIsNone(data["results"])
+        self.assertFalse(SosAlert.objects.exists())
+        self.assertEqual(AIInteraction.objects.get(user=self.user).occurred_at.year, 2020)
+
+    def test_resent_batch_is_stored_once(self):
+        now_ms = time.time() * 1000
+        events = [
+            {"transcript": "all good", "timestamp": now_ms - 60000},
+            {"transcript": "all good", "timestamp": now_ms - 30000},
+            {"transcript": "help me", "timestamp": now_ms - 5000, "idempotency_key": "k1"},
+        ]
+        first = self.post(events).json()
+        second = self.post(events).json()
+
+        self.assertEqual(AIInteraction.objects.filter(user=self.user).count(), 3)
+        self.assertEqual((first["results"]["outcome"], second["results"]["outcome"]), ("new", "replay"))
+        self.assertEqual(SosAlert.objects.filter(user=self.user).count(), 1)
+
+    def test_unusable_timestamps_do_not_fail_the_batch(self):
+        events = [{"transcript": "all good", "timestamp": value} for value in (1e20, -1e18, float("nan"), True, "2026-13-45T00:00:00")]
+        response = self.post(events + [{"transcript": "help me", "timestamp": 1e20}])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"]["outcome"], "new")
+        self.assertEqual(AIInteraction.objects.filter(user=self.user).count(), 6)
+
+
+@override_settings(SOS_USE_OUTBOX=True)
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.user = self.seed_recipients("erin", voice_keyword="help me")
+
+    def test_views_stay_within_query_budget(self):
+        batch = {"events": [{"transcript": f"clip {i}"} for i in range(10)] + [{"transcript": "help me", "idempotency_key": "b"}]}
+        cases = [
+            ("/ai_module/voice_trigger/", {"transcript": "help me", "idempotency_key": "a"}, 17),
+            ("/ai_module/voice_trigger/", {"transcript": "all good"}, 6),
+            ("/ai_module/voice_batch/", batch, 9),  # folds into the first trigger: replay + window SELECTs, one UPDATE
+        ]
+        for url, payload, budget in cases:
+            with self.subTest(url=url, payload=payload), self.assertMaxQueries(budget):
+                response = self.client.post(url, json.dumps(payload), content_type="application/json")
+                self.assertEqual(response.status_code, 200)
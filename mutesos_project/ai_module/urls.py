@@ -5,4 +5,5 @@ app_name = 'ai_module'
 
 urlpatterns = [
     path('voice_trigger/', views.voice_trigger, name='voice_trigger'),
+    path('voice_batch/', views.voice_batch, name='voice_batch'),
 ]
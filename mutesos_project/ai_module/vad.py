@@ -0,0 +1,103 @@
+# ai_module/vad.py
+"""
+Voice-activity gate for the voice pipeline.
+
+Works on 16 kHz mono signed 16-bit PCM in fixed frames, fully vectorized:
+per-frame energy (dBFS) and zero-crossing rate decide which frames are
+speech, relative to a noise floor estimated from the quietest frames of the
+clip itself (nothing is consumed for calibration). Silent or non-speech
+clips are rejected before any recognition runs; speech clips are trimmed to
+their speech regions.
+"""
+from dataclasses import dataclass, field
+import numpy as np
+from django.conf import settings
+
+SAMPLE_RATE = 16000
+FRAME_MS = 30
+
+# Defaults (override via settings.VOICE_VAD_*)
+DEFAULT_MARGIN_DB = 10.0       # speech must be this far above the noise floor
+DEFAULT_MIN_DB = -50.0         # ...and above this absolute level
+DEFAULT_MIN_SPEECH = 0.25      # seconds of speech needed to accept a clip
+DEFAULT_HANGOVER_MS = 240      # padding kept around speech (also bridges short pauses)
+MAX_SPEECH_ZCR = 0.5           # crossings per sample above this is hiss, not voice
+NOISE_PERCENTILE = 10
+
+
+@dataclass
+class VadResult:
+    speech: bytes                                  # PCM of the speech regions, concatenated
+    regions: list = field(default_factory=list)    # [(start_s, end_s), ...]
+    noise_floor_db: float = DEFAULT_MIN_DB
+    speech_seconds: float = 0.0
+
+    @property
+    def has_speech(self):
+        return bool(self.regions)
+
+
+def _setting(name, default):
+    return getattr(settings, f'VOICE_VAD_{name}', default)
+
+
+def _frames(pcm, sample_rate):
+    frame_len = sample_rate * FRAME_MS // 1000
+    samples = np.frombuffer(pcm[:len(pcm) // 2 * 2], dtype='<i2')
+    count = len(samples) // frame_len
+    return samples[:count * frame_len].reshape(count, frame_len).astype(np.float32) / 32768.0, frame_len
+
+
+def frame_energy_db(frames):
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    return 20.0 * np.log10(np.maximum(rms, 1e-6))
+
+
+def frame_zcr(frames):
+    signs = np.signbit(frames)
+    return np.mean(signs[:, 1:] != signs[:, :-1], axis=1)
+
+
+def estimate_noise_floor(pcm, sample_rate=SAMPLE_RATE):
+    """Noise floor (dBFS) from the quietest frames of `pcm`."""
+    frames, _ = _frames(pcm, sample_rate)
+    if not len(frames):
+        return _setting('MIN_DB', DEFAULT_MIN_DB)
+    return float(np.percentile(frame_energy_db(frames), NOISE_PERCENTILE))
+
+
+def detect_speech(pcm, sample_rate=SAMPLE_RATE, noise_floor_db=None):
+    """
+    Find speech in `pcm`. `noise_floor_db` defaults to an estimate from the
+    clip; pass a running estimate when `pcm` is a short window of a stream.
+    """
+    frames, frame_len = _frames(pcm, sample_rate)
+    if not len(frames):
+        return VadResult(b'')
+
+    energy = frame_energy_db(frames)
+    if noise_floor_db is None:
+        noise_floor_db = float(np.percentile(energy, NOISE_PERCENTILE))
+    threshold = max(noise_floor_db + _setting('MARGIN_DB', DEFAULT_MARGIN_DB), _setting('MIN_DB', DEFAULT_MIN_DB))
+    voiced = (energy > threshold) & (frame_zcr(frames) < MAX_SPEECH_ZCR)
+
+    speech_seconds = voiced.sum() * FRAME_MS / 1000
+    if speech_seconds < _setting('MIN_SPEECH', DEFAULT_MIN_SPEECH):
+        return VadResult(b'', noise_floor_db=noise_floor_db, speech_seconds=float(speech_seconds))
+
+    # Pad speech frames by the hangover on both sides, merging nearby regions
+    hangover = max(1, _setting('HANGOVER_MS', DEFAULT_HANGOVER_MS) // FRAME_MS)
+    padded = np.convolve(voiced.astype(np.int8), np.ones(2 * hangover + 1, dtype=np.int8), mode='same') > 0
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], padded.astype(np.int8), [0]))))
+    starts, ends = edges[::2], edges[1::2]
+
+    pcm_view = memoryview(pcm)
+    bytes_per_frame = frame_len * 2
+    speech = b''.join(pcm_view[s * bytes_per_frame:e * bytes_per_frame] for s, e in zip(starts, ends))
+    seconds_per_frame = FRAME_MS / 1000
+    return VadResult(
+        speech,
+        regions=[(float(s * seconds_per_frame), float(e * seconds_per_frame)) for s, e in zip(starts, ends)],
+        noise_floor_db=noise_floor_db,
+        speech_seconds=float(speech_seconds),
+    )
@@ -1,84 +1,42 @@
 # ai_module/views.py
 import json
-import os
-import tempfile
-import re
+import hashlib
+import asyncio
 import logging
+from asgiref.sync import sync_to_async
 from django.shortcuts import render
+from datetime import timedelta
+from django.conf import settings
 from django.http import JsonResponse, HttpResponseBadRequest
 from django.contrib.auth.decorators import login_required
-from django.conf import settings
-import speech_recognition as sr
-from pydub import AudioSegment
+from django.utils import timezone
+
+from sos.metrics import stage
 
 logger = logging.getLogger(__name__)
 
 # Try to import utilities from sos
 try:
-    from sos.utils import send_sos_alert, save_uploaded_audio, format_phone_number
+    from sos.utils import send_sos_alert, save_uploaded_audio
+    from sos.recipients import aget_recipients
+    from sos.incidents import atrigger_incident, get_idempotency_key, parse_coordinate, parse_event_time
+    from sos.audio import stream_audio_uploads, uploaded_pcm
+    from ai_module.voice import analyze_clip, match_transcript
 except Exception as imp_err:
     logger.exception(f"sos.utils import failed: {imp_err}")
     send_sos_alert = None
+    atrigger_incident = None
+    aget_recipients = None
     save_uploaded_audio = None
-    def format_phone_number(x): return x
-
-# If pydub can't find ffmpeg, uncomment and set the path:
-# AudioSegment.converter = r"C:\ffmpeg\bin\ffmpeg.exe"
-
-
-def _collect_active_numbers_for_user(user):
-    """Return a list of formatted phone-number strings to alert for this user."""
-    numbers = []
-    try:
-        contacts = getattr(user, 'contacts_trusted_contacts', None) or getattr(user, 'trusted_contacts', None)
-        if contacts is not None:
-            iterable = contacts.all() if hasattr(contacts, 'all') else contacts
-            for c in (iterable.filter(is_active=True) if hasattr(iterable, 'filter') else iterable):
-                num = getattr(c, 'phone_number', None) or getattr(c, 'phone', None)
-                if num and isinstance(num, str) and num.strip():
-                    numbers.append(format_phone_number(num.strip()))
-    except Exception as e:
-        logger.warning(f"Could not gather trusted contacts: {e}")
-
-    # Helplines from contacts app (model) if available
-    try:
-        from contacts.models import Helpline
-        helplines = Helpline.objects.filter(is_active=True)
-        for h in helplines:
-            num = getattr(h, 'phone_number', None) or getattr(h, 'number', None)
-            if num and isinstance(num, str) and num.strip():
-                numbers.append(format_phone_number(num.strip()))
-    except Exception:
-        # fallback to settings.EMERGENCY_HELPLINES if model unavailable
-        try:
-            helps = getattr(settings, 'EMERGENCY_HELPLINES', [])
-            if isinstance(helps, dict):
-                for num, active in helps.items():
-                    if active and isinstance(num, str) and num.strip():
-                        numbers.append(format_phone_number(num.strip()))
-            elif isinstance(helps, (list, tuple)):
-                for entry in helps:
-                    if isinstance(entry, dict):
-                        num = entry.get('number') or entry.get('phone') or entry.get('tel')
-                        if entry.get('active', True) and isinstance(num, str) and num.strip():
-                            numbers.append(format_phone_number(num.strip()))
-                    elif isinstance(entry, str) and entry.strip():
-                        numbers.append(format_phone_number(entry.strip()))
-        except Exception as e:
-            logger.warning(f"Could not gather helplines from settings: {e}")
+    def stream_audio_uploads(view): return view
 
-    # dedupe while preserving order
-    seen = set()
-    out = []
-    for n in numbers:
-        if n not in seen:
-            out.append(n)
-            seen.add(n)
-    return out
+# Uploads are decoded by ffmpeg while they stream in (see sos.audio); it must be on PATH.
+# The voice keyword is spotted on-box with PocketSphinx (see ai_module.voice).
 
 
 @login_required
-def voice_trigger(request):
+@stream_audio_uploads
+async def voice_trigger(request):
     """
     Accepts either:
       - JSON: { "transcript": "...", "latitude": "...", "longitude": "..." }
@@ -91,7 +49,13 @@ def voice_trigger(request):
         return JsonResponse({'status': 'Server misconfigured', 'message': 'sos.utils import failed'}, status=500)
 
     # initialize
+    user = await request.auser()
     transcript = ""
+    result = None
+    pcm = None
+    from users.models import Profile
+    profile = await Profile.objects.filter(user=user).afirst()
+    keyword = getattr(profile, 'voice_keyword', '') if profile else ''
     latitude = request.POST.get('latitude') or request.GET.get('latitude') or ''
     longitude = request.POST.get('longitude') or request.GET.get('longitude') or ''
 
@@ -101,6 +65,7 @@ def voice_trigger(request):
         try:
             payload = json.loads(request.body.decode('utf-8') or "{}")
             transcript = (payload.get('transcript') or "").strip()
+            idempotency_key = get_idempotency_key(request, payload)
             latitude = str(payload.get('latitude') or latitude or "")
             longitude = str(payload.get('longitude') or longitude or "")
         except Exception as e:
@@ -111,115 +76,172 @@ def voice_trigger(request):
         if request.method != "POST" or 'audio' not in request.FILES:
             return JsonResponse({'status': 'No audio or transcript received', 'spoken_text': ''})
         audio_file = request.FILES['audio']
+        idempotency_key = get_idempotency_key(request)
 
         # Save uploaded audio (non-fatal)
         saved_path = None
         try:
             if save_uploaded_audio:
-                saved_path = save_uploaded_audio(audio_file)
+                saved_path = await sync_to_async(save_uploaded_audio, thread_sensitive=False)(audio_file)
             else:
                 logger.debug("save_uploaded_audio not available")
         except Exception as e:
             logger.warning(f"save_uploaded_audio failed: {e}")
 
-        # create temp file and run speech recognition
-        tmp_path = wav_path = None
+        # decode, spot the keyword and (optionally) transcribe off the event loop
         try:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(getattr(audio_file, 'name', '') or '.wav')[1]) as tmp:
-                for chunk in audio_file.chunks():
-                    tmp.write(chunk)
-                tmp_path = tmp.name
-
-            wav_path = tmp_path + "_conv.wav"
-            try:
-                sound = AudioSegment.from_file(tmp_path)
-            except Exception:
-                # try common extensions fallback
-                ext = os.path.splitext(getattr(audio_file, 'name', '') or '')[1].lower()
-                ext_map = {'.m4a': 'mp4', '.mp3': 'mp3', '.ogg': 'ogg', '.webm': 'webm'}
-                fmt = ext_map.get(ext, None)
-                if fmt:
-                    sound = AudioSegment.from_file(tmp_path, format=fmt)
-                else:
-                    sound = AudioSegment.from_file(tmp_path)
-
-            sound = sound.set_frame_rate(16000).set_channels(1)
-            sound.export(wav_path, format="wav")
-
-            recognizer = sr.Recognizer()
-            with sr.AudioFile(wav_path) as source:
-                recognizer.adjust_for_ambient_noise(source, duration=0.5)
-                audio_data = recognizer.record(source)
-                try:
-                    transcript = recognizer.recognize_google(audio_data)
-                except sr.UnknownValueError:
-                    transcript = ""
-                except sr.RequestError as e:
-                    logger.warning(f"Google API error in voice_trigger: {e}")
-                    try:
-                        transcript = recognizer.recognize_sphinx(audio_data)
-                    except Exception as sphinx_err:
-                        logger.warning(f"Sphinx fallback failed: {sphinx_err}")
-                        transcript = ""
+            pcm = await sync_to_async(uploaded_pcm, thread_sensitive=False)(audio_file)
+            result = await sync_to_async(analyze_clip, thread_sensitive=False)(pcm, keyword)
+            transcript = result.transcript
         except Exception as e:
             logger.exception("Audio processing failed in voice_trigger")
             return JsonResponse({'status': 'error', 'message': f'Audio processing failed: {str(e)}'}, status=500)
-        finally:
-            for p in (tmp_path, wav_path):
-                try:
-                    if p and os.path.exists(p):
-                        os.remove(p)
-                except Exception:
-                    pass
-
-    # Save AIInteraction only if model exists and user provided audio or transcript
-    try:
-        from ai_module.models import AIInteraction
-        if transcript or (request.FILES.get('audio') if hasattr(request, 'FILES') else False):
-            ai = AIInteraction.objects.create(user=request.user, input_text=transcript or "", detected_danger=False)
-            if 'saved_path' in locals() and saved_path:
-                ai.input_voice_file = saved_path
-            ai.save()
-        else:
-            ai = None
-    except Exception as e:
-        logger.debug(f"AIInteraction model not available or save failed: {e}")
-        ai = None
-
-    # Normalize and check keyword
-    profile = getattr(request.user, 'profile', None)
-    keyword = getattr(profile, 'voice_keyword', '') if profile else ''
-    keyword_norm = re.sub(r'[^a-z0-9]', '', (keyword or "").lower())
-    spoken_norm = re.sub(r'[^a-z0-9]', '', (transcript or "").lower())
 
-    if keyword_norm and keyword_norm in spoken_norm:
+    # Record an AIInteraction when the user provided audio or a transcript; it is
+    # finished in memory and logged once when the response is ready
+    from ai_module.models import AIInteraction
+    from ai_module.interactions import alog_interaction
+    ai = None
+    if transcript or (request.FILES.get('audio') if hasattr(request, 'FILES') else False):
+        ai = AIInteraction(user=user, input_text=transcript or "", detected_danger=False)
+        if 'saved_path' in locals() and saved_path:
+            ai.input_voice_file = saved_path
+
+    # Distress analysis of the clip runs alongside the SOS (see ai_module.emotion)
+    analysis = None
+    if ai and pcm:
+        from ai_module.emotion import aanalyze_voice  # NumPy: loaded on first voice request
+        analysis = asyncio.ensure_future(aanalyze_voice(pcm))
+
+    async def respond(payload, status=200):
+        voice_analysis = None
+        if analysis is not None:
+            voice_analysis = await analysis
+            payload['danger_level'] = voice_analysis.danger_level if voice_analysis else None
+        if ai:
+            await alog_interaction(ai, voice_analysis)
+        return JsonResponse(payload, status=status)
+
+    # Check keyword: the audio path already decided; typed transcripts are matched here
+    if result is not None:
+        detected, confidence = result.detected, result.confidence
+    else:
+        # precompiled per-keyword matcher: exact, one-edit and phonetic variants
+        match = match_transcript(transcript, keyword)
+        detected, confidence = bool(match), (match.confidence if match else 0.0)
+
+    if detected:
         if ai:
             ai.detected_danger = True
-            ai.save()
 
-        # collect active recipients (formatted)
-        recipients = _collect_active_numbers_for_user(request.user)
-        results = []
+        # cached, normalized and deduplicated recipients (see sos.recipients)
+        with stage('recipients'):
+            recipients = await aget_recipients(user.pk)
         if not recipients:
             # fallback: send to user object
             try:
-                r = send_sos_alert(request.user, message="🚨 Emergency Alert! Danger detected!", latitude=latitude or None, longitude=longitude or None)
-                return JsonResponse({'status': '✅ SOS Triggered (fallback to user)', 'spoken_text': transcript, 'results': r})
+                r = await sync_to_async(send_sos_alert)(user, message="🚨 Emergency Alert! Danger detected!", latitude=latitude or None, longitude=longitude or None)
+                return await respond({'status': '✅ SOS Triggered (fallback to user)', 'spoken_text': transcript, 'confidence': confidence, 'results': r})
             except Exception as e:
                 logger.exception("Fallback send_sos_alert failed")
-                return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+                return await respond({'status': 'error', 'message': str(e)}, status=500)
 
-        # send alerts (SMS + call + location) to each recipient
-        for number in recipients:
-            try:
-                res = send_sos_alert(number, message=f"🚨 Emergency Alert! {request.user.username} detected danger!", latitude=latitude or None, longitude=longitude or None)
-                results.append({number: res})
-            except Exception as e:
-                logger.exception(f"send_sos_alert failed for {number}: {e}")
-                results.append({number: {'error': str(e)}})
+        # send alerts (SMS + call + location) to all recipients at once
+        try:
+            maps_link = f"\n📍 Location: https://www.google.com/maps?q={latitude},{longitude}" if latitude and longitude else ""
+            results = await atrigger_incident(
+                user, 'voice', recipients, f"🚨 Emergency Alert! {user.username} detected danger!{maps_link}",
+                idempotency_key=idempotency_key, latitude=parse_coordinate(latitude), longitude=parse_coordinate(longitude),
+            )
+        except Exception as e:
+            logger.exception(f"atrigger_incident failed for {recipients}: {e}")
+            results = {'ok': False, 'targets': [], 'errors': [{'error': str(e)}]}
 
-        return JsonResponse({'status': '✅ SOS Triggered via voice keyword!', 'spoken_text': transcript, 'results': results})
+        return await respond({'status': '✅ SOS Triggered via voice keyword!', 'spoken_text': transcript, 'confidence': confidence, 'results': results})
 
     # no keyword matched
-    return JsonResponse({'status': 'No keyword detected', 'spoken_text': transcript})
+    return await respond({'status': 'No keyword detected', 'spoken_text': transcript, 'confidence': confidence})
+
+
+
+# -----------------------------
+# Batch ingestion of offline-queued transcripts
+# -----------------------------
+DEFAULT_BATCH_MAX_EVENTS = 200
+DEFAULT_BATCH_MAX_AGE = 3600  # seconds; older detections are recorded but do not alert
+
+
+def event_key(event):
+    """Id of a queued event: the client's idempotency key, or a digest of its timestamp and transcript."""
+    key = str(event.get('idempotency_key') or '').strip()[:64]
+    if key:
+        return key
+    return hashlib.sha256(json.dumps([event.get('timestamp'), event.get('transcript')], default=str).encode()).hexdigest()
 
+
+@login_required
+async def voice_batch(request):
+    """
+    Accepts JSON: { "events": [ { "transcript": "...", "timestamp": <ISO or epoch ms>,
+                                  "latitude": ..., "longitude": ..., "idempotency_key": "..." }, ... ] }
+    Matches every transcript in one pass, stores them with a single bulk insert
+    and raises at most one SOS: for the latest recent detection. Replaying a
+    batch (a client whose flush timed out) stores nothing twice: every event
+    is keyed by its idempotency_key, or else its timestamp and transcript.
+    """
+    if request.method != "POST":
+        return JsonResponse({'status': 'error', 'message': 'POST required'}, status=405)
+    if atrigger_incident is None:
+        return JsonResponse({'status': 'Server misconfigured', 'message': 'sos.utils import failed'}, status=500)
+    try:
+        events = json.loads(request.body.decode('utf-8') or "{}").get('events')
+    except (ValueError, AttributeError):
+        return HttpResponseBadRequest("Invalid JSON")
+    if not isinstance(events, list) or not all(isinstance(e, dict) for e in events):
+        return HttpResponseBadRequest("'events' must be a list of objects")
+    if len(events) > getattr(settings, 'VOICE_BATCH_MAX_EVENTS', DEFAULT_BATCH_MAX_EVENTS):
+        return JsonResponse({'status': 'error', 'message': 'Too many events'}, status=413)
+
+    from ai_module.models import AIInteraction
+    from users.models import Profile
+
+    user = await request.auser()
+    profile = await Profile.objects.filter(user=user).afirst()
+    keyword = getattr(profile, 'voice_keyword', '') if profile else ''
+    now = timezone.now()
+
+    interactions, detections = [], []
+    for event in events:
+        transcript = str(event.get('transcript') or '').strip()
+        occurred_at = parse_event_time(event.get('timestamp'), now)
+        match = match_transcript(transcript, keyword) if transcript else None
+        interactions.append(AIInteraction(
+            user=user, input_text=transcript, occurred_at=occurred_at, detected_danger=bool(match), event_key=event_key(event),
+        ))
+        if match:
+            detections.append((occurred_at, match, event))
+    await AIInteraction.objects.abulk_create(interactions, ignore_conflicts=True)
+
+    response = {'status': 'No keyword detected', 'received': len(events), 'detected': len(detections), 'results': None}
+    max_age = timedelta(seconds=getattr(settings, 'VOICE_BATCH_MAX_AGE', DEFAULT_BATCH_MAX_AGE))
+    recent = [d for d in detections if now - d[0] <= max_age]
+    if detections and not recent:
+        response['status'] = 'Keyword detected in stale events only; recorded without alerting'
+    if recent:
+        occurred_at, match, event = max(recent, key=lambda d: d[0])
+        latitude, longitude = str(event.get('latitude') or ''), str(event.get('longitude') or '')
+        maps_link = f"\n📍 Location: https://www.google.com/maps?q={latitude},{longitude}" if latitude and longitude else ""
+        heard = timezone.localtime(occurred_at).strftime('%H:%M')
+        try:
+            recipients = await aget_recipients(user.pk)
+            response['results'] = await atrigger_incident(
+                user, 'voice', recipients,
+                f"🚨 Emergency Alert! {user.username} detected danger at {heard}!{maps_link}",
+                idempotency_key=get_idempotency_key(request, event),
+                latitude=parse_coordinate(latitude), longitude=parse_coordinate(longitude),
+            )
+        except Exception as e:
+            logger.exception(f"atrigger_incident failed for batch from {user.username}: {e}")
+            response['results'] = {'ok': False, 'targets': [], 'errors': [{'error': str(e)}]}
+        response.update({'status': '✅ SOS Triggered via voice keyword!', 'spoken_text': event.get('transcript'), 'confidence': match.confidence})
+    return JsonResponse(response)
@@ -0,0 +1,107 @@
+# ai_module/voice.py
+import logging
+from dataclasses import dataclass
+from django.conf import settings
+
+from sos.audio import pcm_to_wav_buffer
+from sos.metrics import stage
+from .kws import get_spotter, SpotterUnavailable
+from .matcher import get_matcher, parse_keywords, MIN_CONFIDENCE
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class VoiceResult:
+    transcript: str
+    detected: bool
+    keyword: str = ''
+    confidence: float = 0.0
+    engine: str = 'stt'  # 'kws' when the on-box spotter made the call, 'vad' when no speech was found
+
+
+def match_transcript(transcript, keyword_text):
+    """
+    Best KeywordMatch of the user's trigger phrases in `transcript`, or None
+    when nothing reaches settings.VOICE_MATCH_MIN_CONFIDENCE.
+    """
+    match = get_matcher(keyword_text or '').search(transcript)
+    if match and match.confidence >= getattr(settings, 'VOICE_MATCH_MIN_CONFIDENCE', MIN_CONFIDENCE):
+        return match
+    return None
+
+
+def transcribe_pcm(pcm):
+    """
+    Full transcription of 16 kHz mono PCM: Google first, PocketSphinx when
+    the API is unreachable. Returns "" when nothing was recognized.
+    """
+    import speech_recognition as sr
+
+    recognizer = sr.Recognizer()
+    with sr.AudioFile(pcm_to_wav_buffer(pcm)) as source:
+        audio_data = recognizer.record(source)
+    try:
+        with stage('stt'):
+            return recognizer.recognize_google(audio_data)
+    except sr.UnknownValueError:
+        return ""
+    except sr.RequestError as e:
+        logger.warning(f"Google API error, falling back to Sphinx: {e}")
+        try:
+            with stage('stt_sphinx'):
+                return recognizer.recognize_sphinx(audio_data)
+        except Exception as sphinx_err:
+            logger.warning(f"Sphinx fallback failed: {sphinx_err}")
+            return ""
+
+
+def analyze_clip(pcm, keyword):
+    """
+    Decide whether a clip's 16 kHz mono PCM contains one of the user's
+    trigger phrases (`keyword` is the comma-separated Profile.voice_keyword).
+    Blocking; run off the event loop.
+
+    Clips without speech are rejected by the voice-activity gate before any
+    recognition; the rest are trimmed to their speech regions. The keyword
+    is then spotted on-box. The network transcription only runs
+    when the spotter is unavailable or settings.VOICE_FULL_TRANSCRIPTION asks
+    for a transcript to be stored.
+    """
+    if getattr(settings, 'VOICE_VAD_ENABLED', True):
+        from .vad import detect_speech  # NumPy: loaded on first use
+
+        with stage('vad'):
+            vad = detect_speech(pcm)
+        if not vad.has_speech:
+            logger.info(f"No speech in clip ({vad.speech_seconds:.2f}s voiced, floor {vad.noise_floor_db:.1f} dBFS)")
+            return VoiceResult("", False, engine='vad')
+        pcm = vad.speech
+
+    keywords = parse_keywords(keyword)
+    full_transcription = getattr(settings, 'VOICE_FULL_TRANSCRIPTION', False)
+
+    hit = None
+    spotted = False
+    if keywords and getattr(settings, 'VOICE_KEYWORD_SPOTTING', True):
+        try:
+            with stage('kws'):
+                hit = get_spotter().spot(pcm, keywords)
+            spotted = True
+        except SpotterUnavailable as e:
+            logger.info(f"Keyword spotter unavailable, using transcription: {e}")
+        except Exception:
+            # e.g. a keyword missing from the pronunciation dictionary
+            logger.exception("Keyword spotting failed, using transcription")
+
+    if hit:
+        transcript = transcribe_pcm(pcm) if full_transcription else hit.keyword
+        return VoiceResult(transcript, True, hit.keyword, hit.confidence, engine='kws')
+    if spotted and not full_transcription:
+        return VoiceResult("", False, engine='kws')
+
+    transcript = transcribe_pcm(pcm)
+    match = match_transcript(transcript, keyword) if keywords else None
+    if match:
+        return VoiceResult(transcript, True, match.keyword, match.confidence)
+    return VoiceResult(transcript, False)
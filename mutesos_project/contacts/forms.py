@@ -1,5 +1,6 @@
 from django import forms
 from .models import TrustedContact, Helpline
+from sos.helpers import format_phone_number
 
 
 class TrustedContactForm(forms.ModelForm):
@@ -14,6 +15,16 @@ class TrustedContactForm(forms.ModelForm):
             'is_active': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
         }
 
+    def clean_phone_number(self):
+        # scoped to the owner of the bound instance, so edits are checked as well as adds
+        phone = self.cleaned_data['phone_number']
+        duplicates = TrustedContact.objects.filter(user_id=self.instance.user_id, phone_normalized=format_phone_number(phone))
+        if self.instance.pk:
+            duplicates = duplicates.exclude(pk=self.instance.pk)
+        if duplicates.exists():
+            raise forms.ValidationError("This number is already one of your trusted contacts.")
+        return phone
+
 
 class HelplineForm(forms.ModelForm):
     class Meta:
@@ -24,3 +35,12 @@ class HelplineForm(forms.ModelForm):
             'phone_number': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Enter Phone Number'}),
             'is_active': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
         }
+
+    def clean_phone_number(self):
+        phone = self.cleaned_data['phone_number']
+        duplicates = Helpline.objects.filter(phone_normalized=format_phone_number(phone))
+        if self.instance.pk:
+            duplicates = duplicates.exclude(pk=self.instance.pk)
+        if duplicates.exists():
+            raise forms.ValidationError("This helpline number already exists.")
+        return phone
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.4 on 2026-10-17 12:07
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def format_phone_number(number, country_code='91'):
+    """
+    Frozen copy of sos.helpers.format_phone_number as of this migration, so
+    later changes to the live normalizer never alter what it backfills.
+    """
+    number = str(number).strip()
+    digits = ''.join(ch for ch in number if ch.isdigit())
+    if not digits:
+        return number
+    if number.startswith('+'):
+        return '+' + digits
+    if len(digits) <= 5:
+        return digits
+    if digits.startswith('00'):
+        return '+' + digits[2:]
+    if digits.startswith('0'):
+        digits = digits[1:]
+    if len(digits) == 10 + len(country_code) and digits.startswith(country_code):
+        return '+' + digits
+    return '+' + country_code + digits
+
+
+def backfill_phone_normalized(apps, schema_editor):
+    for model_name in ('TrustedContact', 'Helpline'):
+        model = apps.get_model('contacts', model_name)
+        rows = list(model.objects.all())
+        for row in rows:
+            row.phone_normalized = format_phone_number(row.phone_number)
+        model.objects.bulk_update(rows, ['phone_normalized'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0005_alter_helpline_phone_number_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='helpline',
+            name='phone_normalized',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=16),
+        ),
+        migrations.AddField(
+            model_name='trustedcontact',
+            name='phone_normalized',
+            field=models.CharField(blank=True, editable=False, max_length=16),
+        ),
+        migrations.AddIndex(
+            model_name='trustedcontact',
+            index=models.Index(fields=['user', 'phone_normalized'], name='contacts_tr_user_id_460137_idx'),
+        ),
+        migrations.RunPython(backfill_phone_normalized, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-17 12:32
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0006_phone_normalized'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='helpline',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['id'], name='helpline_active'),
+        ),
+        migrations.AddIndex(
+            model_name='trustedcontact',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['user', 'id'], name='contact_active_by_user'),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import RegexValidator
+from sos.helpers import format_phone_number
 
 # Validator for Trusted Contacts (strict E.164 format)
 trusted_phone_validator = RegexValidator(
@@ -25,6 +26,19 @@ class TrustedContact(models.Model):
     email = models.EmailField()
     relationship = models.CharField(max_length=50)
     is_active = models.BooleanField(default=True)
+    # E.164 form of phone_number, kept in sync on save; read directly by the SOS dispatch path
+    phone_normalized = models.CharField(max_length=16, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'phone_normalized']),
+            # SOS recipients: a user's active contacts in id order
+            models.Index(fields=['user', 'id'], condition=models.Q(is_active=True), name='contact_active_by_user'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.phone_normalized = format_phone_number(self.phone_number)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.name} ({self.relationship})"
@@ -34,6 +48,15 @@ class Helpline(models.Model):
     label = models.CharField(max_length=100)
     phone_number = models.CharField(max_length=15, validators=[helpline_phone_validator])
     is_active = models.BooleanField(default=True)
+    # Normalized form of phone_number (short codes kept as-is), kept in sync on save
+    phone_normalized = models.CharField(max_length=16, blank=True, editable=False, db_index=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['id'], condition=models.Q(is_active=True), name='helpline_active')]
+
+    def save(self, *args, **kwargs):
+        self.phone_normalized = format_phone_number(self.phone_number)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.label} - {self.phone_number}"
@@ -1,3 +1,66 @@
 from django.test import TestCase
 
-# Create your tests here.
+from sos.testing import QueryBudgetMixin
+from .forms import TrustedContactForm
+from .models import Helpline, TrustedContact
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Per-view query budgets; the lists hold several rows so N+1 patterns exceed them."""
+
+    def setUp(self):
+        self.user = self.seed_recipients("carol")
+        self.contact = TrustedContact.objects.first()
+        self.helpline = Helpline.objects.first()
+
+    def test_views_stay_within_query_budget(self):
+        cases = [
+            ("get", "/contacts/", {}, 3),
+            ("post", "/contacts/", {"name": "New", "phone_number": "+919812345678", "email": "n@example.com", "relationship": "sister"}, 4),
+            ("get", f"/contacts/toggle/{self.contact.pk}/", {}, 4),
+            ("get", "/contacts/helplines/", {}, 3),
+            ("post", "/contacts/helplines/", {"label": "Police", "phone_number": "112"}, 4),
+            ("get", f"/contacts/helplines/toggle/{self.helpline.pk}/", {}, 4),
+            ("get", f"/contacts/delete/{self.contact.pk}/", {}, 4),
+            ("get", f"/contacts/helplines/delete/{self.helpline.pk}/", {}, 4),
+        ]
+        for method, url, data, budget in cases:
+            with self.subTest(method=method, url=url), self.assertMaxQueries(budget):
+                response = getattr(self.client, method)(url, data)
+                self.assertLess(response.status_code, 400)
+
+
+class TrustedContactDuplicateTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+
+        self.user = User.objects.create_user("dave", password="pw")
+        self.first = TrustedContact.objects.create(user=self.user, name="Mum", phone_number="+919876543210")
+        self.second = TrustedContact.objects.create(user=self.user, name="Dad", phone_number="+919876543211")
+
+    def form(self, phone, instance):
+        data = {"name": instance.name or "New", "phone_number": phone, "email": "c@example.com", "relationship": "family", "is_active": True}
+        return TrustedContactForm(data, instance=instance)
+
+    def test_adding_a_number_in_another_format_is_rejected(self):
+        self.assertFalse(self.form("9876543210", TrustedContact(user=self.user)).is_valid())
+
+    def test_editing_onto_another_contacts_number_is_rejected(self):
+        form = self.form("9876543210", self.second)
+        self.assertFalse(form.is_valid())
+        self.assertIn("phone_number", form.errors)
+
+    def test_editing_a_contact_may_keep_its_own_number(self):
+        self.assertTrue(self.form("919876543211", self.second).is_valid())
+
+    def test_other_users_may_share_a_number(self):
+        from django.contrib.auth.models import User
+
+        other = User.objects.create_user("erin", password="pw")
+        self.assertTrue(self.form("+919876543210", TrustedContact(user=other)).is_valid())
+
+    def test_duplicate_add_through_the_view_is_rejected(self):
+        self.client.force_login(self.user)
+        response = self.client.post("/contacts/", {"name": "Again", "phone_number": "9876543210", "email": "c@example.com", "relationship": "family"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(TrustedContact.objects.filter(user=self.user).count(), 2)
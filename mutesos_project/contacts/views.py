@@ -4,25 +4,15 @@ from django.contrib import messages
 from .models import TrustedContact, Helpline
 from .forms import TrustedContactForm, HelplineForm
 
-# Helper function to format phone numbers correctly for Twilio
-def format_phone_number(number):
-    digits = ''.join(filter(str.isdigit, number))
-    if digits.startswith('0'):
-        digits = digits[1:]
-    if not digits.startswith('91'):
-        digits = '91' + digits
-    return '+' + digits
-
 # 📇 Manage Trusted Contacts
 @login_required
 def manage_contacts(request):
     contacts = TrustedContact.objects.filter(user=request.user)
     if request.method == "POST":
-        form = TrustedContactForm(request.POST)
+        # The form's duplicate check is an index lookup on the owner's stored normalized numbers
+        form = TrustedContactForm(request.POST, instance=TrustedContact(user=request.user))
         if form.is_valid():
-            contact = form.save(commit=False)
-            contact.user = request.user
-            contact.save()
+            form.save()
             messages.success(request, "✅ Trusted contact added successfully.")
             return redirect('contacts:manage_contacts')
     else:
@@ -5,5 +5,7 @@ app_name = 'emergency'
 
 urlpatterns = [
     path('', views.home, name='home'),  # Home page
+    path('service-worker.js', views.service_worker, name='service_worker'),  # PWA worker, root scope
+    path('metrics', views.metrics, name='metrics'),  # Prometheus scrape target
     path('trigger/', views.emergency_trigger, name='emergency_trigger'),  # SOS trigger
 ]
@@ -1,3 +1,8 @@
+import hmac
+from functools import lru_cache
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.http import HttpResponse, HttpResponseForbidden, Http404
 from django.shortcuts import render
 from contacts.models import Helpline  # optional: to show active helplines on home
 
@@ -24,3 +29,47 @@ def emergency_trigger(request):
     """
     # TODO: Implement actual SOS logic here
     return render(request, 'emergency/home.html', {'message': 'Emergency Triggered!'})
+
+
+# -----------------------------
+# Service Worker
+# -----------------------------
+@lru_cache(maxsize=1)
+def _service_worker_source():
+    path = finders.find('service-worker.js')
+    if path is None:
+        return None
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def service_worker(request):
+    """
+    Serve static/service-worker.js from the site root, so its scope covers
+    every page (a worker under /static/ could never see the SOS form posts).
+    """
+    source = _service_worker_source()
+    if source is None:
+        raise Http404("service-worker.js not found")
+    response = HttpResponse(source, content_type='application/javascript')
+    response['Cache-Control'] = 'no-cache'
+    response['Service-Worker-Allowed'] = '/'
+    return response
+
+
+def metrics(request):
+    """
+    Stage and request timing histograms in the Prometheus text format (see
+    sos.metrics). Needs "Authorization: Bearer <settings.METRICS_TOKEN>";
+    without a token it is only served under DEBUG.
+    """
+    from sos.metrics import metrics_enabled, render_metrics
+
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if not metrics_enabled() or not (token or settings.DEBUG):
+        raise Http404("Metrics are disabled")
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        return HttpResponseForbidden()
+    response = HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+    response['Cache-Control'] = 'no-store'
+    return response
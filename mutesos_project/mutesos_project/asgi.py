@@ -2,6 +2,8 @@
 ASGI config for mutesos_project project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP goes to Django; WebSocket paths listed in ``websocket_routes`` go to
+their raw ASGI apps.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +15,27 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mutesos_project.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after Django is set up
+from django.conf import settings  # noqa: E402
+from ai_module.consumers import voice_stream  # noqa: E402
+
+# Web processes only: workers and management commands never set up Django through here
+if settings.VOICE_EMOTION_PRELOAD:
+    from ai_module.emotion import preload
+    preload()
+
+websocket_routes = {
+    '/ai_module/voice_stream/': voice_stream,
+}
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        app = websocket_routes.get(scope['path'])
+        if app is None:
+            await receive()
+            return await send({'type': 'websocket.close', 'code': 4404})
+        return await app(scope, receive, send)
+    return await django_application(scope, receive, send)
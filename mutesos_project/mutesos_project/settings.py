@@ -39,6 +39,7 @@ INSTALLED_APPS = [
 
 # Middleware
 MIDDLEWARE = [
+    'sos.middleware.ServerTimingMiddleware',  # outermost, so "total" covers the whole stack
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -70,14 +71,53 @@ TEMPLATES = [
 # WSGI
 WSGI_APPLICATION = 'mutesos_project.wsgi.application'
 
-# Database - SQLite
+# Database - SQLite, shared by the web workers, deliver_alerts and
+# sweep_retention. Every new connection runs SQLITE_PRAGMAS (Django's
+# init_command hook):
+#   - WAL: readers never block the writer, nor the writer the readers
+#   - synchronous=NORMAL: no fsync per commit; safe under WAL, an OS crash
+#     (not an app crash) can lose only the last commits
+#   - busy_timeout: a writer waits up to this many ms for the write lock
+#     instead of raising "database is locked"
+#   - mmap_size: reads come straight from the page cache
+# IMMEDIATE transactions take the write lock when they begin. A deferred one
+# that reads first and then writes would otherwise fail at once when another
+# writer got there first; busy_timeout cannot help there.
+# Connections are kept for DB_CONN_MAX_AGE seconds in long-lived threads and
+# processes (deliver_alerts, sweep_retention, buffered log/status flushers).
+# Under ASGI each request still gets its own connection.
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    f"PRAGMA busy_timeout={int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 20000))}",
+    'PRAGMA mmap_size=268435456',  # 256 MiB
+)
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'init_command': ';'.join(SQLITE_PRAGMAS),
+            'transaction_mode': 'IMMEDIATE',
+        },
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Cache - must be shared by all workers so recipient-list invalidation is
+# seen everywhere: Redis when REDIS_URL is set, a file cache in production,
+# and local memory for single-process development/tests.
+if os.getenv('REDIS_URL'):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': os.getenv('REDIS_URL')}}
+elif DEBUG:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': BASE_DIR / '.cache'}}
+
+# Cached recipient lists expire after this many seconds even without a change signal
+SOS_RECIPIENT_CACHE_TIMEOUT = 3600
+
 # Password Validation
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -123,6 +163,109 @@ TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID')
 TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
 TWILIO_PHONE_NUMBER = os.getenv('TWILIO_PHONE_NUMBER')
 
+# SOS fan-out: all recipients/channels are alerted concurrently on a bounded
+# pool; jobs still running after the deadline (seconds) are reported as errors
+SOS_DISPATCH_MAX_WORKERS = int(os.getenv('SOS_DISPATCH_MAX_WORKERS', 32))
+SOS_DISPATCH_DEADLINE = float(os.getenv('SOS_DISPATCH_DEADLINE', 25))
+
+# SOS transport: built once per worker process and reused for every send.
+# Use 'sos.transport.FakeTransport' to test/benchmark without the network.
+SOS_TRANSPORT = os.getenv('SOS_TRANSPORT', 'sos.transport.TwilioTransport')
+SOS_TRANSPORT_OPTIONS = {}
+
+# SOS outbox: trigger views send alerts inline and leave the failures in the
+# outbox, where `python manage.py deliver_alerts` retries them with backoff.
+# Sending stays inline unless SOS_USE_OUTBOX=True, which queues every alert
+# for the worker and returns at once; only set it where the worker is known
+# to run (render.yaml sets it, since the Procfile runs deliver_alerts).
+SOS_USE_OUTBOX = os.getenv('SOS_USE_OUTBOX', 'False') == 'True'
+SOS_OUTBOX_BATCH_SIZE = 50
+SOS_OUTBOX_MAX_ATTEMPTS = 5
+SOS_OUTBOX_BACKOFF = 5        # seconds, doubled per attempt
+SOS_OUTBOX_MAX_BACKOFF = 300
+SOS_OUTBOX_LEASE = 120        # seconds before a dead worker's claim is released
+
+# Delivery status callbacks (sos.callbacks): the provider posts SMS/call
+# status changes to SOS_STATUS_CALLBACK_URL (the public URL of /sos/status/);
+# updates are buffered per process and applied in bulk every FLUSH_INTERVAL
+# seconds (or MAX_BATCH SIDs); 0 applies each callback inline
+SOS_STATUS_CALLBACK_URL = os.getenv('SOS_STATUS_CALLBACK_URL')
+SOS_STATUS_FLUSH_INTERVAL = float(os.getenv('SOS_STATUS_FLUSH_INTERVAL', 0 if DEBUG else 1.0))
+SOS_STATUS_MAX_BATCH = 500
+
+# Stage timings (sos.metrics): per-stage histograms of the SOS/voice paths are
+# served in Prometheus format at /metrics to "Authorization: Bearer <METRICS_TOKEN>"
+# (without a token, only under DEBUG). Figures are per worker process.
+# SERVER_TIMING adds a per-stage Server-Timing header to every response; it
+# names internal stages, so it is off outside DEBUG unless opted in.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True') == 'True'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'False') == 'True'
+
+# Voice evidence retention (sos.retention, `manage.py sweep_retention`):
+# interactions and clips are deleted after the TTL of their class, clips are
+# transcoded to Opus after COMPACT_AFTER_DAYS, unreferenced files are removed
+AUDIO_RETENTION_DAYS = {'danger': 365, 'routine': 30}
+AUDIO_COMPACT_AFTER_DAYS = 2
+AUDIO_SWEEP_BATCH_SIZE = 200
+AUDIO_SWEEP_GRACE_SECONDS = 3600
+
+# Repeat SOS triggers by one user inside this window (seconds) fold into the
+# open incident and only push location updates
+SOS_COALESCE_WINDOW = 120
+
+# Voice trigger: the user's keyword is spotted on-box with PocketSphinx
+# (decoders are loaded once per process). The Google transcription only runs
+# when the spotter is unavailable, or always with VOICE_FULL_TRANSCRIPTION=True
+# when the full transcript should be stored.
+VOICE_KEYWORD_SPOTTING = os.getenv('VOICE_KEYWORD_SPOTTING', 'True') == 'True'
+VOICE_FULL_TRANSCRIPTION = os.getenv('VOICE_FULL_TRANSCRIPTION', 'False') == 'True'
+# Keyword threshold for every phrase; unset uses ai_module.kws.DEFAULT_THRESHOLDS,
+# which is stricter for short phrases
+VOICE_KWS_THRESHOLD = float(os.getenv('VOICE_KWS_THRESHOLD', 0)) or None
+VOICE_KWS_DECODERS = 2
+VOICE_KWS_SEARCHES = 16
+# Transcripts are matched against the user's comma-separated trigger phrases
+# including one-edit (0.8+) and phonetic (0.7) variants; 1.0 = exact only.
+# Phonetic matches are too loose to raise an SOS unless this is lowered to 0.7.
+VOICE_MATCH_MIN_CONFIDENCE = 0.8
+
+# AIInteraction logging (ai_module.interactions): rows are buffered per
+# process and bulk-inserted every FLUSH_INTERVAL seconds (or MAX_BATCH rows)
+# by a background thread; 0 writes each row inline (development/tests)
+AI_LOG_FLUSH_INTERVAL = float(os.getenv('AI_LOG_FLUSH_INTERVAL', 0 if DEBUG else 0.5))
+AI_LOG_MAX_BATCH = 100
+
+# Batch endpoint for transcripts queued offline (/ai_module/voice_batch/):
+# at most one SOS per batch, and only for detections younger than MAX_AGE
+VOICE_BATCH_MAX_EVENTS = 200
+VOICE_BATCH_MAX_AGE = 3600  # seconds
+
+# Voice-activity gate (ai_module.vad): clips without speech are rejected
+# before recognition and the rest are trimmed to their speech regions
+VOICE_VAD_ENABLED = True
+VOICE_VAD_MARGIN_DB = 10.0    # speech level above the clip's noise floor
+VOICE_VAD_MIN_SPEECH = 0.25   # seconds
+
+# Distress analysis (ai_module.emotion): sos/emotion_model.h5 is loaded once
+# per process (or, with VOICE_EMOTION_PRELOAD, when the web server loads
+# mutesos_project.asgi/wsgi: in the gunicorn master with --preload; never in
+# management commands) and concurrent clips are micro-batched through it
+VOICE_EMOTION_ENABLED = os.getenv('VOICE_EMOTION_ENABLED', 'True') == 'True'
+VOICE_EMOTION_PRELOAD = os.getenv('VOICE_EMOTION_PRELOAD', 'False') == 'True'
+VOICE_EMOTION_MODEL = BASE_DIR / 'sos' / 'emotion_model.h5'
+VOICE_EMOTION_LABELS = ('angry', 'disgust', 'fear', 'happy', 'neutral', 'sad', 'surprise')
+VOICE_DISTRESS_LABELS = ('angry', 'fear')
+VOICE_EMOTION_MAX_BATCH = 32
+VOICE_EMOTION_MAX_WAIT = 0.01  # seconds
+VOICE_EMOTION_TIMEOUT = 2.0    # seconds
+
+# Streaming voice trigger (WebSocket /ai_module/voice_stream/): the last
+# WINDOW seconds are searched every HOP seconds of audio
+VOICE_STREAM_WINDOW = 2.5
+VOICE_STREAM_HOP = 0.5
+VOICE_STREAM_MAX_SECONDS = 60
+
 # -----------------------------
 # Emergency Helplines
 # Only numbers listed here will be triggered
@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mutesos_project.settings')
 
 application = get_wsgi_application()
+
+# Web processes only: workers and management commands never set up Django through here
+from django.conf import settings  # noqa: E402
+
+if settings.VOICE_EMOTION_PRELOAD:
+    from ai_module.emotion import preload
+    preload()
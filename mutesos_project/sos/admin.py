@@ -1,7 +1,73 @@
 from django.contrib import admin
-from .models import Helpline
+from django.contrib.admin.views.main import ChangeList
+from .models import Helpline, AlertOutbox, SosAlert, AlertDelivery
 from .forms import HelplineForm
 
+CURSOR_VAR = 'before'
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Changelist paged by primary key: a page is `pk < cursor ORDER BY pk DESC
+    LIMIT n`, so it costs one index range read however deep you page and
+    never runs COUNT(*) or an OFFSET scan over the table.
+    """
+
+    def __init__(self, request, *args, **kwargs):
+        try:
+            self.cursor = int(request.GET[CURSOR_VAR])
+        except (KeyError, ValueError):
+            self.cursor = None
+        super().__init__(request, *args, **kwargs)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # filter and search links start again from the newest row
+        if CURSOR_VAR not in (new_params or {}):
+            remove = [*(remove or []), CURSOR_VAR]
+        return super().get_query_string(new_params, remove)
+
+    def get_ordering(self, request, queryset):
+        return ['-pk']
+
+    def get_results(self, request):
+        queryset = self.queryset
+        if self.cursor is not None:
+            queryset = queryset.filter(pk__lt=self.cursor)
+        page = list(queryset[:self.list_per_page + 1])
+        self.result_list = page[:self.list_per_page]
+        self.next_cursor = self.result_list[-1].pk if len(page) > self.list_per_page else None
+        self.result_count = len(self.result_list)
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.can_show_all = False
+        self.multi_page = False
+        self.paginator = None
+
+    @property
+    def first_page_url(self):
+        return self.get_query_string()
+
+    @property
+    def next_page_url(self):
+        return self.get_query_string({CURSOR_VAR: self.next_cursor}) if self.next_cursor else None
+
+
+class KeysetPaginationMixin:
+    """Admin for tables too large to count: newest first, 'Older' links instead of page numbers."""
+    change_list_template = 'admin/keyset_change_list.html'
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+    sortable_by = ()
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
 
 class HelplineAdmin(admin.ModelAdmin):
     form = HelplineForm
@@ -11,4 +77,60 @@ class HelplineAdmin(admin.ModelAdmin):
 admin.site.register(Helpline, HelplineAdmin)
 
 
-# Register your models here.
+class AlertOutboxAdmin(KeysetPaginationMixin, admin.ModelAdmin):
+    list_display = ('to_number', 'channels', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('to_number', 'user__username')
+
+
+admin.site.register(AlertOutbox, AlertOutboxAdmin)
+
+
+class DeliveryStatusFilter(admin.SimpleListFilter):
+    """Fixed status list: the default filter would SELECT DISTINCT over every delivery."""
+    title = 'status'
+    parameter_name = 'status'
+
+    def lookups(self, request, model_admin):
+        return [
+            (AlertDelivery.STATUS_PENDING, 'Pending'),
+            (AlertDelivery.STATUS_RETRYING, 'Retrying'),
+            ('queued', 'Queued'),
+            ('sent', 'Sent'),
+            ('delivered', 'Delivered'),
+            ('completed', 'Completed (call)'),
+            ('undelivered', 'Undelivered'),
+            (AlertDelivery.STATUS_FAILED, 'Failed'),
+        ]
+
+    def queryset(self, request, queryset):
+        return queryset.filter(status=self.value()) if self.value() else queryset
+
+
+class AlertDeliveryInline(admin.TabularInline):
+    model = AlertDelivery
+    fields = ('to_number', 'channel', 'status', 'provider_sid', 'latency_ms', 'attempts', 'error', 'updated_at')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+
+class SosAlertAdmin(KeysetPaginationMixin, admin.ModelAdmin):
+    list_display = ('user', 'method', 'timestamp', 'last_triggered_at', 'trigger_count')
+    list_select_related = ('user',)
+    search_fields = ('user__username',)
+    inlines = [AlertDeliveryInline]
+
+
+admin.site.register(SosAlert, SosAlertAdmin)
+
+
+class AlertDeliveryAdmin(KeysetPaginationMixin, admin.ModelAdmin):
+    list_display = ('to_number', 'channel', 'status', 'latency_ms', 'attempts', 'provider_sid', 'incident', 'created_at')
+    list_select_related = ('incident__user',)
+    list_filter = ('channel', DeliveryStatusFilter)
+    search_fields = ('to_number', 'provider_sid')
+    raw_id_fields = ('incident', 'outbox')
+
+
+admin.site.register(AlertDelivery, AlertDeliveryAdmin)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class SosConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'sos'
+
+    def ready(self):
+        import sos.signals
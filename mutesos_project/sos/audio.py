@@ -0,0 +1,247 @@
+# sos/audio.py
+import io
+import os
+import wave
+import shutil
+import logging
+import threading
+import subprocess
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+
+from .audio_store import BlobWriter, retire_blob
+from .metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# Recognition input: 16 kHz mono signed 16-bit PCM
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+
+# Form field carrying the voice clip
+AUDIO_FIELD = 'audio'
+
+
+class AudioDecodeError(Exception):
+    pass
+
+
+class StreamingPcmDecoder:
+    """
+    Decodes an audio byte stream to 16 kHz mono PCM as it arrives.
+    Bytes are piped into ffmpeg's stdin; reader threads drain stdout into
+    memory and stderr into a short tail, so no pipe can fill up and block
+    ffmpeg (and with it the upload).
+    """
+    STDERR_TAIL = 4096
+
+    def __init__(self):
+        self._pcm = bytearray()
+        self._stderr = b''
+        self.process = subprocess.Popen(
+            ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0',
+             '-f', 's16le', '-acodec', 'pcm_s16le', '-ac', '1', '-ar', str(SAMPLE_RATE), 'pipe:1'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        )
+        self._readers = [threading.Thread(target=self._drain, daemon=True), threading.Thread(target=self._drain_errors, daemon=True)]
+        for reader in self._readers:
+            reader.start()
+        self.failed = False
+
+    def _drain(self):
+        for block in iter(lambda: self.process.stdout.read(65536), b''):
+            self._pcm.extend(block)
+
+    def _drain_errors(self):
+        for block in iter(lambda: self.process.stderr.read(4096), b''):
+            self._stderr = (self._stderr + block)[-self.STDERR_TAIL:]
+
+    def feed(self, data):
+        if self.failed:
+            return
+        try:
+            self.process.stdin.write(data)
+        except (BrokenPipeError, OSError):
+            # ffmpeg gave up on the stream (e.g. a container that needs seeking)
+            self.failed = True
+
+    def finish(self):
+        """Close the input and return the decoded PCM bytes, or None on failure."""
+        try:
+            self.process.stdin.close()
+        except (BrokenPipeError, OSError):
+            self.failed = True
+        for reader in self._readers:
+            reader.join()
+        stderr = self._stderr.decode(errors='replace').strip()
+        if self.process.wait() != 0 or self.failed or not self._pcm:
+            logger.warning(f"Streaming decode failed: {stderr or 'no audio decoded'}")
+            return None
+        return bytes(self._pcm)
+
+    def abort(self):
+        self.process.kill()
+        self.process.wait()
+
+
+def decode_file_to_pcm(path_or_file):
+    """Fallback decode of a stored clip (used when streaming decode is unavailable)."""
+    from pydub import AudioSegment
+
+    with stage('decode'):
+        try:
+            sound = AudioSegment.from_file(path_or_file)
+        except Exception as e:
+            raise AudioDecodeError(f"Could not decode {path_or_file}: {e}") from e
+        return sound.set_frame_rate(SAMPLE_RATE).set_channels(1).set_sample_width(SAMPLE_WIDTH).raw_data
+
+
+def uploaded_pcm(audio_file):
+    """16 kHz mono PCM for an uploaded clip, decoded in memory."""
+    if isinstance(audio_file, StreamedAudioFile):
+        return audio_file.pcm
+    audio_file.seek(0)
+    return decode_file_to_pcm(audio_file)
+
+
+def pcm_to_wav_buffer(pcm):
+    """Wrap PCM in an in-memory WAV container (what speech_recognition.AudioFile reads)."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(SAMPLE_WIDTH)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(pcm)
+    buffer.seek(0)
+    return buffer
+
+
+class StreamedAudioFile(UploadedFile):
+    """
+    An uploaded clip that is already stored (blob `stored_name` at
+    `saved_path`), with its 16 kHz mono PCM available in memory as `pcm`.
+    """
+
+    def __init__(self, stored_name, saved_path, name, content_type, size, charset, pcm=None, content_type_extra=None, deduplicated=False):
+        super().__init__(open(saved_path, 'rb'), name, content_type, size, charset, content_type_extra)
+        self.stored_name = stored_name
+        self.saved_path = saved_path
+        self.deduplicated = deduplicated
+        self.stored_at = os.stat(saved_path).st_mtime  # a later mtime means an identical upload reused the blob
+        self.sample_rate = SAMPLE_RATE
+        self._pcm = pcm
+
+    @property
+    def pcm(self):
+        if self._pcm is None:
+            self._pcm = decode_file_to_pcm(self.saved_path)
+        return self._pcm
+
+    def temporary_file_path(self):
+        return self.saved_path
+
+
+class StreamingAudioUploadHandler(FileUploadHandler):
+    """
+    Upload handler for voice clips: every chunk is written once to the
+    audio store (hashed on the way, see sos.audio_store) and fed to the PCM
+    decoder at the same time, so the clip is never re-read or copied.
+    """
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self.active = field_name == AUDIO_FIELD
+        if not self.active:
+            return
+        self.sink = BlobWriter(file_name)
+        self.decoder = StreamingPcmDecoder() if shutil.which('ffmpeg') else None
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+        self.sink.write(raw_data)
+        if self.decoder:
+            self.decoder.feed(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if not self.active:
+            return None
+        self.active = False
+        stored_name, saved_path, deduplicated = self.sink.commit()
+        pcm = None
+        if self.decoder:
+            with stage('decode'):  # only the tail: ffmpeg decoded the rest while the upload streamed in
+                pcm = self.decoder.finish()
+        logger.info(f"Saved audio file: {stored_name}{' (already stored)' if deduplicated else ''}")
+        return StreamedAudioFile(
+            stored_name, saved_path, self.file_name, self.content_type, file_size, self.charset,
+            pcm=pcm, content_type_extra=self.content_type_extra, deduplicated=deduplicated,
+        )
+
+    def upload_interrupted(self):
+        if getattr(self, 'active', False):
+            self.sink.abort()
+            if self.decoder:
+                self.decoder.abort()
+
+
+def discard_upload(audio_file):
+    """
+    Remove a clip stored by StreamingAudioUploadHandler that no view took.
+    The blob stays when this upload did not create it, when a row refers to
+    it, or when an identical upload has reused it since (its row may not be
+    written yet); sos.retention.sweep_orphans removes it if nobody keeps it.
+    """
+    from ai_module.models import AIInteraction
+
+    audio_file.close()
+    if audio_file.deduplicated or AIInteraction.objects.filter(input_voice_file=audio_file.stored_name).exists():
+        return
+    retired = retire_blob(audio_file.saved_path, audio_file.stored_at)
+    if retired:
+        os.remove(retired)
+
+
+def _csrf_secret_missing(request):
+    """True when the CSRF check is bound to reject `request` without reading its body."""
+    if request.method in ('GET', 'HEAD', 'OPTIONS', 'TRACE') or getattr(request, '_dont_enforce_csrf_checks', False):
+        return False
+    return not settings.CSRF_USE_SESSIONS and settings.CSRF_COOKIE_NAME not in request.COOKIES
+
+
+def stream_audio_uploads(view):
+    """
+    Decorator for async voice views: installs StreamingAudioUploadHandler and
+    parses the body off the event loop. The CSRF check runs after the handler
+    is in place (the middleware would otherwise parse the upload first); if
+    it fails, the stored clip is removed again. A request without any CSRF
+    cookie is rejected before the upload is stored or decoded.
+    """
+    @wraps(view)
+    async def accepted(request, *args, **kwargs):
+        request.audio_upload_accepted = True
+        return await view(request, *args, **kwargs)
+
+    protected = csrf_protect(accepted)
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if _csrf_secret_missing(request):
+            return await protected(request, *args, **kwargs)
+        request.upload_handlers.insert(0, StreamingAudioUploadHandler(request))
+        with stage('upload'):
+            await sync_to_async(lambda: request.FILES, thread_sensitive=False)()
+        response = await protected(request, *args, **kwargs)
+        if not getattr(request, 'audio_upload_accepted', False):
+            for audio_file in request.FILES.getlist(AUDIO_FIELD):
+                if isinstance(audio_file, StreamedAudioFile):
+                    await sync_to_async(discard_upload)(audio_file)
+        return response
+
+    return csrf_exempt(wrapper)
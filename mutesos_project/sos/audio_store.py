@@ -0,0 +1,127 @@
+# sos/audio_store.py
+"""
+Content-addressed store for voice clips.
+
+A clip is hashed (SHA-256) while it is written to a temporary file and then
+moved to MEDIA_ROOT/sos_audio/<h[0:2]>/<h[2:4]>/<hash><ext>. Identical
+uploads (client retries, replays) map to the same blob, which is stored
+once; the two-level shard keeps every directory small (at most 65536
+leaves, a few entries each) however many clips accumulate. Writes are a
+rename and lookups a path computation, both independent of the store size.
+
+AIInteraction.input_voice_file holds the MEDIA_ROOT-relative blob name, so
+one blob may be referenced by several rows (see sos.retention).
+"""
+import os
+import re
+import uuid
+import hashlib
+import tempfile
+from django.conf import settings
+
+STORE_DIR = 'sos_audio'
+DEFAULT_EXTENSION = '.wav'
+_EXTENSION = re.compile(r'^\.[a-z0-9]{1,8}$')
+
+
+def clean_extension(name):
+    """Lowercased extension of an uploaded file name, or the default for odd ones."""
+    ext = os.path.splitext(name or '')[1].lower()
+    return ext if _EXTENSION.match(ext) else DEFAULT_EXTENSION
+
+
+def blob_name(digest, ext=DEFAULT_EXTENSION):
+    """MEDIA_ROOT-relative name of the blob with hex `digest`."""
+    return '/'.join((STORE_DIR, digest[:2], digest[2:4], digest + ext))
+
+
+def blob_path(name):
+    """Filesystem path of a stored clip (absolute names from before the store are kept as is)."""
+    return name if os.path.isabs(name) else os.path.join(settings.MEDIA_ROOT, name)
+
+
+class BlobWriter:
+    """
+    Incremental writer: feed chunks with write(), then commit() to get the
+    blob name. The temporary file lives inside the store so the final move
+    is an atomic rename on the same filesystem.
+    """
+
+    def __init__(self, file_name=''):
+        self.ext = clean_extension(file_name)
+        tmp_dir = os.path.join(settings.MEDIA_ROOT, STORE_DIR, 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(dir=tmp_dir, suffix=self.ext)
+        self.sink = os.fdopen(fd, 'wb')
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk):
+        self.sink.write(chunk)
+        self.hash.update(chunk)
+        self.size += len(chunk)
+
+    def commit(self):
+        """
+        Move the data into the store (or drop it if the blob exists); returns
+        (name, path, deduplicated). A reused blob has its mtime bumped, which
+        keeps the retention sweepers off it until the new row referencing it
+        is written (see sos.retention).
+        """
+        self.sink.close()
+        name = blob_name(self.hash.hexdigest(), self.ext)
+        path = blob_path(name)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        else:
+            os.remove(self.tmp_path)
+            return name, path, True
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(self.tmp_path, path)
+        return name, path, False
+
+    def abort(self):
+        self.sink.close()
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+def store_file(file):
+    """Store an uploaded file's chunks; returns its blob name."""
+    writer = BlobWriter(getattr(file, 'name', ''))
+    try:
+        for chunk in file.chunks():
+            writer.write(chunk)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.commit()[0]
+
+
+def retire_blob(path, touched_after):
+    """
+    Take the blob at `path` out of the store for deletion, unless it was
+    written or reused (BlobWriter.commit bumps its mtime) after the
+    `touched_after` timestamp. Returns the path it was moved to (the caller
+    removes it), or None when it stays.
+
+    The move is an atomic rename, so a concurrent upload of the same
+    content cannot lose its blob: one committing after the rename finds no
+    blob and stores a fresh copy, and one that reused the blob before it
+    shows in the moved file's mtime, in which case the blob is put back.
+    """
+    retired = f"{path}.{uuid.uuid4().hex}.retired"
+    try:
+        if os.stat(path).st_mtime > touched_after:
+            return None
+        os.rename(path, retired)
+    except FileNotFoundError:
+        return None
+    if os.stat(retired).st_mtime > touched_after:
+        os.replace(retired, path)  # a fresh copy stored meanwhile has the same content
+        return None
+    return retired
@@ -0,0 +1,184 @@
+# sos/callbacks.py
+"""
+Delivery status callbacks (provider webhooks) -> AlertDelivery.status.
+
+The status_callback view only parses a webhook and hands (sid, status) to
+the process-wide StatusBuffer. Updates for the same SID are coalesced, and
+a status is never allowed to move backwards (callbacks can arrive out of
+order). Every SOS_STATUS_FLUSH_INTERVAL seconds, or once
+SOS_STATUS_MAX_BATCH SIDs are waiting, a background thread applies them.
+It does one indexed SELECT by SID and one bulk UPDATE. A burst of
+thousands of callbacks after a mass event therefore takes the SQLite write
+lock a handful of times instead of once per callback. An update whose
+delivery row is not written yet is retried for SOS_STATUS_UNMATCHED_TTL
+seconds; this happens when the worker records the SID after the provider
+has already called back.
+"""
+import os
+import time
+import atexit
+import logging
+import threading
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import AlertDelivery
+
+logger = logging.getLogger(__name__)
+
+# Defaults (override via settings.SOS_STATUS_*)
+DEFAULT_FLUSH_INTERVAL = 1.0   # seconds; 0 applies every callback inline
+DEFAULT_MAX_BATCH = 500        # SIDs that trigger an early flush (and rows per UPDATE)
+DEFAULT_UNMATCHED_TTL = 300    # seconds an update waits for its delivery row
+
+# Rank of each status along its lifecycle; a late callback never moves a
+# delivery to a lower rank. Unknown statuses rank with the initial ones.
+STATUS_RANK = {
+    AlertDelivery.STATUS_PENDING: 0, AlertDelivery.STATUS_RETRYING: 0,
+    # SMS
+    'accepted': 1, 'scheduled': 1, 'queued': 1, 'sending': 2, 'sent': 3,
+    'delivered': 5, 'undelivered': 5, 'failed': 5, 'canceled': 5, 'delivery_unknown': 5, 'read': 6,
+    # Calls
+    'initiated': 2, 'ringing': 3, 'in-progress': 4, 'answered': 4,
+    'completed': 5, 'busy': 5, 'no-answer': 5,
+}
+
+
+def status_rank(status):
+    return STATUS_RANK.get(status, 1)
+
+
+def parse_callback(data):
+    """(sid, status, error) from a Twilio-style webhook payload, or None if it carries no status."""
+    sid = data.get('MessageSid') or data.get('SmsSid') or data.get('CallSid')
+    status = data.get('MessageStatus') or data.get('SmsStatus') or data.get('CallStatus')
+    if not sid or not status:
+        return None
+    error = " ".join(part for part in (data.get('ErrorCode'), data.get('ErrorMessage')) if part)
+    return sid[:64], status.strip().lower()[:20], error
+
+
+def apply_status_updates(updates, batch_size=DEFAULT_MAX_BATCH):
+    """
+    Apply {sid: (status, error)} to the matching deliveries: one SELECT by SID
+    (delivery_by_sid index) and one bulk UPDATE. Returns the set of SIDs
+    that matched no delivery.
+    """
+    if not updates:
+        return set()
+    deliveries = list(
+        AlertDelivery.objects.filter(provider_sid__in=list(updates)).only('id', 'provider_sid', 'status', 'error')
+    )
+    now = timezone.now()
+    changed = []
+    for delivery in deliveries:
+        status, error = updates[delivery.provider_sid][:2]
+        if status == delivery.status or status_rank(status) < status_rank(delivery.status):
+            continue
+        delivery.status = status
+        delivery.error = error or delivery.error
+        delivery.updated_at = now
+        changed.append(delivery)
+    AlertDelivery.objects.bulk_update(changed, ['status', 'error', 'updated_at'], batch_size=batch_size)
+    return set(updates) - {delivery.provider_sid for delivery in deliveries}
+
+
+class StatusBuffer:
+    def __init__(self, flush_interval=DEFAULT_FLUSH_INTERVAL, max_batch=DEFAULT_MAX_BATCH, unmatched_ttl=DEFAULT_UNMATCHED_TTL):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.unmatched_ttl = unmatched_ttl
+        self._lock = threading.Lock()
+        self._pending = {}  # sid -> (status, error, received_at)
+        self._pid = None
+
+    @property
+    def buffered(self):
+        return self.flush_interval > 0
+
+    def _ensure_worker(self):
+        # Buffer, wake-up event and flush thread belong to each forked worker
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pending = {}
+                    self._wake = threading.Event()
+                    threading.Thread(target=self._run, name='status-callbacks', daemon=True).start()
+                    atexit.register(self.flush)
+                    self._pid = os.getpid()
+
+    def _merge(self, sid, entry):
+        # caller holds the lock; keeps the most advanced status per SID
+        current = self._pending.get(sid)
+        if current is None or status_rank(entry[0]) >= status_rank(current[0]):
+            self._pending[sid] = entry
+
+    def record(self, sid, status, error=''):
+        """Queue one status update for the next flush."""
+        if not self.buffered:
+            return apply_status_updates({sid: (status, error)})
+        self._ensure_worker()
+        with self._lock:
+            self._merge(sid, (status, error, time.monotonic()))
+            full = len(self._pending) >= self.max_batch
+        if full:
+            self._wake.set()
+
+    async def arecord(self, sid, status, error=''):
+        if not self.buffered:
+            return await sync_to_async(apply_status_updates)({sid: (status, error)})
+        self.record(sid, status, error)
+
+    def flush(self):
+        """Apply everything buffered so far; returns the number of SIDs applied."""
+        with self._lock:
+            updates, self._pending = self._pending, {}
+        if not updates:
+            return 0
+        items = list(updates.items())
+        unmatched = set()
+        try:
+            for start in range(0, len(items), self.max_batch):
+                unmatched |= apply_status_updates(dict(items[start:start + self.max_batch]), self.max_batch)
+        except Exception:
+            logger.exception(f"Applying {len(updates)} delivery status update(s) failed; keeping them for the next flush")
+            unmatched = set(updates)
+
+        # keep what could not be applied yet, unless it has waited too long
+        cutoff = time.monotonic() - self.unmatched_ttl
+        retry = {sid: updates[sid] for sid in unmatched if updates[sid][2] >= cutoff}
+        if len(retry) < len(unmatched):
+            logger.warning(f"Dropped {len(unmatched) - len(retry)} status update(s) for unknown SIDs")
+        with self._lock:
+            for sid, entry in retry.items():
+                self._merge(sid, entry)
+        return len(updates) - len(unmatched)
+
+    def _run(self):
+        wake = self._wake
+        while True:
+            wake.wait(self.flush_interval)
+            wake.clear()
+            if self._pending:
+                self.flush()
+                close_old_connections()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_status_buffer():
+    """Return the process-wide StatusBuffer."""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = StatusBuffer(
+                    flush_interval=getattr(settings, 'SOS_STATUS_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL),
+                    max_batch=getattr(settings, 'SOS_STATUS_MAX_BATCH', DEFAULT_MAX_BATCH),
+                    unmatched_ttl=getattr(settings, 'SOS_STATUS_UNMATCHED_TTL', DEFAULT_UNMATCHED_TTL),
+                )
+    return _buffer
@@ -0,0 +1,45 @@
+# sos/deliveries.py
+"""
+Per-recipient delivery records (sos.models.AlertDelivery).
+
+An incident gets one row per recipient and channel. The rows are written
+with a single bulk INSERT, together with the incident's outbox rows, in
+the transaction that opens the incident (see sos.incidents.trigger_incident).
+The inline send or the outbox worker then updates a whole batch with a
+single bulk UPDATE, so the bookkeeping costs the same few statements
+however many people are alerted.
+"""
+from django.utils import timezone
+
+from .models import AlertDelivery
+from .dispatch import SUCCESS_KEYS
+
+# Fields touched when a delivery attempt finishes
+UPDATE_FIELDS = ['to_number', 'provider_sid', 'status', 'attempts', 'latency_ms', 'error', 'updated_at']
+
+
+def apply_result(delivery, res, final=True):
+    """
+    Copy one sender result dict onto `delivery` (unsaved). A failure becomes
+    'failed' when `final`, otherwise 'retrying'. Returns the delivery.
+    """
+    delivery.attempts += 1
+    delivery.to_number = res.get("to") or delivery.to_number
+    delivery.latency_ms = res.get("latency_ms")
+    delivery.updated_at = timezone.now()
+    if res.get(SUCCESS_KEYS.get(delivery.channel, "sent")):
+        delivery.provider_sid = res.get("sid") or ''
+        delivery.status = res.get("status") or AlertDelivery.STATUS_SENT
+        delivery.error = ''
+    else:
+        delivery.status = AlertDelivery.STATUS_FAILED if final else AlertDelivery.STATUS_RETRYING
+        delivery.error = str(res.get("error") or "unknown")
+    return delivery
+
+
+def pending_deliveries(incident, outbox_rows):
+    """Unsaved pending deliveries for freshly inserted outbox rows, one per channel."""
+    return [
+        AlertDelivery(incident=incident, outbox=row, to_number=row.to_number, channel=channel)
+        for row in outbox_rows for channel in row.channels.split(",")
+    ]
@@ -0,0 +1,194 @@
+# sos/dispatch.py
+import time
+import asyncio
+import logging
+import contextvars
+import threading
+import traceback
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, wait
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Defaults (override via settings.SOS_DISPATCH_MAX_WORKERS / SOS_DISPATCH_DEADLINE)
+DEFAULT_MAX_WORKERS = 32
+DEFAULT_DEADLINE = 25.0  # seconds for a whole incident
+
+# Result key used by each channel's sender to report success
+SUCCESS_KEYS = {"sms": "sent", "call": "placed"}
+
+_executor = None
+_executor_lock = threading.Lock()
+# async sends still running after their deadline; held here so they finish
+_in_flight = set()
+
+
+def get_executor():
+    """
+    Return the process-wide bounded worker pool, creating it on first use.
+    Created lazily so gunicorn forks never inherit a pool with dead threads.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                max_workers = getattr(settings, 'SOS_DISPATCH_MAX_WORKERS', DEFAULT_MAX_WORKERS)
+                _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sos-dispatch")
+    return _executor
+
+
+def _unique(numbers):
+    """Strip and dedupe numbers while preserving order."""
+    seen = set()
+    out = []
+    for number in numbers:
+        if not isinstance(number, str) or not number.strip():
+            continue
+        number = number.strip()
+        if number not in seen:
+            seen.add(number)
+            out.append(number)
+    return out
+
+
+def _timed(sender, number, message):
+    """Run one send and stamp its provider round trip on the result as latency_ms."""
+    started = time.monotonic()
+    res = sender(number, message)
+    res["latency_ms"] = round((time.monotonic() - started) * 1000)
+    return res
+
+
+def _outcome(job, number, channel):
+    """Result dict of a finished job; a raised exception becomes an error result."""
+    try:
+        return job.result()
+    except Exception as e:
+        tb = "".join(traceback.format_exception(e))
+        logger.error(f"{channel} alert to {number} raised: {e}\n{tb}")
+        return {"to": number, "error": str(e)}
+
+
+def _late(on_late, number, channel, job):
+    """Done callback of a job that outlived its deadline: hand its result to on_late on the pool."""
+    if not job.cancelled():
+        get_executor().submit(on_late, number, channel, _outcome(job, number, channel))
+
+
+def _collect(numbers, senders, jobs, done, cancel, on_late=None):
+    """
+    Fold finished (number, channel) jobs into the send_sos_alert aggregate.
+    Unfinished jobs are cancelled when `cancel(key, job)` manages to stop
+    them before they send: those report "deadline_exceeded" and are safe to
+    retry. The rest are still sending; they report "in_flight" and their
+    result goes to `on_late(number, channel, result)` once they finish.
+    """
+    results = {"ok": True, "targets": [], "errors": []}
+    for number in numbers:
+        target_entry = {"to": number}
+        for channel in senders:
+            job = jobs[(number, channel)]
+            if job in done:
+                res = _outcome(job, number, channel)
+            elif cancel((number, channel), job):
+                res = {"to": number, "error": "deadline_exceeded"}
+            else:
+                res = {"to": number, "error": "in_flight", "in_flight": True}
+                if on_late is not None:
+                    job.add_done_callback(partial(_late, on_late, number, channel))
+
+            target_entry[channel] = res
+            if res.get("to"):
+                target_entry["to"] = res["to"]
+            if not res.get(SUCCESS_KEYS.get(channel, "sent")):
+                results["ok"] = False
+                if res.get("error"):
+                    results["errors"].append({"to": number, f"{channel}_error": res["error"]})
+        results["targets"].append(target_entry)
+    return results
+
+
+def dispatch_alerts(numbers, message, senders, deadline=None, on_late=None):
+    """
+    Send `message` to every number over every channel in `senders` at once.
+
+    `senders` maps a channel name ("sms", "call") to a callable(number, message)
+    returning a result dict, which is stamped with its "latency_ms". All
+    (number, channel) jobs run concurrently on the shared pool; jobs not
+    finished when the deadline expires are reported as errors instead of
+    holding up the caller. A job that had not started yet is cancelled
+    ("deadline_exceeded"); one that is already sending cannot be, and is
+    reported "in_flight" with its result passed to `on_late` later (see
+    _collect), so it must not be retried meanwhile.
+
+    Returns the same aggregate as send_sos_alert:
+      {"ok": bool, "targets": [{"to": ..., "sms": {...}, "call": {...}}], "errors": [...]}
+    """
+    numbers = _unique(numbers)
+    if not numbers:
+        return {"ok": True, "targets": [], "errors": []}
+
+    if deadline is None:
+        deadline = getattr(settings, 'SOS_DISPATCH_DEADLINE', DEFAULT_DEADLINE)
+
+    executor = get_executor()
+    started = time.monotonic()
+    jobs = {}
+    for number in numbers:
+        for channel, sender in senders.items():
+            # in the caller's context, so per-request stage timings see the sends
+            jobs[(number, channel)] = executor.submit(contextvars.copy_context().run, _timed, sender, number, message)
+
+    done, not_done = wait(jobs.values(), timeout=deadline)
+    if not_done:
+        logger.warning(f"SOS dispatch deadline of {deadline}s hit with {len(not_done)} job(s) still running")
+
+    results = _collect(numbers, senders, jobs, done, lambda key, job: job.cancel(), on_late)
+    logger.info(f"SOS dispatch to {len(numbers)} recipient(s) finished in {time.monotonic() - started:.3f}s")
+    return results
+
+
+async def adispatch_alerts(numbers, message, senders, deadline=None, on_late=None):
+    """
+    Async twin of dispatch_alerts for ASGI views.
+    `senders` map channels to coroutine functions; at most
+    SOS_DISPATCH_MAX_WORKERS sends are in flight per incident. At the
+    deadline, sends still waiting for a slot are cancelled; started ones
+    keep running on the event loop and report to `on_late`.
+    """
+    numbers = _unique(numbers)
+    if not numbers:
+        return {"ok": True, "targets": [], "errors": []}
+
+    if deadline is None:
+        deadline = getattr(settings, 'SOS_DISPATCH_DEADLINE', DEFAULT_DEADLINE)
+
+    semaphore = asyncio.Semaphore(getattr(settings, 'SOS_DISPATCH_MAX_WORKERS', DEFAULT_MAX_WORKERS))
+
+    sending = set()
+
+    async def _bounded(sender, number, key):
+        async with semaphore:
+            sending.add(key)
+            started = time.monotonic()
+            res = await sender(number, message)
+            res["latency_ms"] = round((time.monotonic() - started) * 1000)
+            return res
+
+    started = time.monotonic()
+    jobs = {}
+    for number in numbers:
+        for channel, sender in senders.items():
+            jobs[(number, channel)] = asyncio.ensure_future(_bounded(sender, number, (number, channel)))
+
+    done, not_done = await asyncio.wait(jobs.values(), timeout=deadline)
+    if not_done:
+        logger.warning(f"SOS dispatch deadline of {deadline}s hit with {len(not_done)} job(s) still running")
+        for job in not_done:
+            _in_flight.add(job)
+            job.add_done_callback(_in_flight.discard)
+
+    results = _collect(numbers, senders, jobs, done, lambda key, job: key not in sending and job.cancel(), on_late)
+    logger.info(f"SOS async dispatch to {len(numbers)} recipient(s) finished in {time.monotonic() - started:.3f}s")
+    return results
@@ -1,11 +1,30 @@
 # sos/helpers.py
+from functools import lru_cache
+
+DEFAULT_COUNTRY_CODE = '91'  # India – change if needed
+
+
+@lru_cache(maxsize=4096)
 def format_phone_number(number):
     """
-    Format the phone number to include country code if missing.
-    Example: '9876543210' → '+919876543210' (for India)
+    Canonical phone normalizer: returns E.164 for subscriber numbers, and
+    short codes (3-5 digits, e.g. '100' or '1091') unchanged.
+    Examples: '9876543210' → '+919876543210', '09876543210' → '+919876543210',
+              '+91 98765-43210' → '+919876543210', '919876543210' → '+919876543210'
+    Idempotent, so already-normalized numbers pass through untouched.
     """
     number = str(number).strip()
-    if not number.startswith('+'):
-        # Default to India code (+91) – change if needed
-        number = '+91' + number
-    return number
+    digits = ''.join(ch for ch in number if ch.isdigit())
+    if not digits:
+        return number
+    if number.startswith('+'):
+        return '+' + digits
+    if len(digits) <= 5:
+        return digits
+    if digits.startswith('00'):
+        return '+' + digits[2:]
+    if digits.startswith('0'):
+        digits = digits[1:]
+    if len(digits) == 10 + len(DEFAULT_COUNTRY_CODE) and digits.startswith(DEFAULT_COUNTRY_CODE):
+        return '+' + digits
+    return '+' + DEFAULT_COUNTRY_CODE + digits
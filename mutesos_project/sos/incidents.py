@@ -0,0 +1,160 @@
+# sos/incidents.py
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .metrics import stage
+from .models import SosAlert
+from .outbox import claim_alerts, enqueue_alerts
+from .utils import aalert_recipients
+
+logger = logging.getLogger(__name__)
+
+# Repeat triggers by one user inside this many seconds fold into one incident
+DEFAULT_COALESCE_WINDOW = 120
+
+# open_incident outcomes
+NEW = 'new'                  # first trigger: alert everybody
+LOCATION_UPDATE = 'location'  # repeat trigger from a new position: push the location only
+COALESCED = 'coalesced'      # repeat trigger, nothing new to send
+REPLAY = 'replay'            # same idempotency key seen before
+
+
+def parse_coordinate(value):
+    """Float coordinate from request data, or None."""
+    try:
+        return float(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_event_time(value, now):
+    """
+    Client timestamp (ISO 8601 or epoch milliseconds) as an aware datetime,
+    never in the future. Anything unusable (out of range, NaN, a bool, an
+    impossible date) falls back to `now`: one bad event must not fail the
+    whole batch, or the client would resend it forever.
+    """
+    when = None
+    try:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            when = datetime.fromtimestamp(value / 1000, tz=dt_timezone.utc)
+        elif isinstance(value, str):
+            when = parse_datetime(value)
+            if when is not None and timezone.is_naive(when):
+                when = timezone.make_aware(when, dt_timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        when = None
+    return min(when, now) if when else now
+
+
+def get_idempotency_key(request, data=None):
+    """Client idempotency key from the form/JSON field or the Idempotency-Key header."""
+    key = (data if data is not None else request.POST).get('idempotency_key') or request.headers.get('Idempotency-Key') or ''
+    return str(key).strip()[:64] or None
+
+
+def open_incident(user, method, idempotency_key=None, latitude=None, longitude=None):
+    """
+    Record a trigger and decide what to send. Returns (incident, outcome).
+
+    A repeat trigger folds into the user's incident only while that incident
+    is younger than SOS_COALESCE_WINDOW: repeats bump trigger_count and
+    last_triggered_at but never extend the window. A replayed idempotency
+    key changes nothing. Call it inside the transaction that also queues the
+    incident's alerts (see trigger_incident), so an incident is never seen
+    by later triggers without them.
+
+    Safe across gunicorn workers: on backends with row locks the user row is
+    locked first; on SQLite the IMMEDIATE transaction holds the database
+    write lock from its first statement.
+    """
+    window = getattr(settings, 'SOS_COALESCE_WINDOW', DEFAULT_COALESCE_WINDOW)
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=window)
+    # joins the caller's transaction (no savepoint): all or nothing
+    with transaction.atomic(savepoint=False):
+        if connection.features.has_select_for_update:
+            list(User.objects.select_for_update().filter(pk=user.pk).values_list('pk', flat=True))
+
+        if idempotency_key:
+            replayed = SosAlert.objects.filter(user=user, idempotency_key=idempotency_key).first()
+            if replayed:
+                return replayed, REPLAY
+
+        # last_triggered_at >= timestamp, so this stays on the (user, last_triggered_at) index
+        incident = SosAlert.objects.filter(
+            user=user, last_triggered_at__gte=cutoff, timestamp__gte=cutoff
+        ).order_by('-timestamp', '-id').first()
+        if incident:
+            moved = latitude is not None and longitude is not None and (latitude, longitude) != (incident.latitude, incident.longitude)
+            fields = {'latitude': latitude, 'longitude': longitude} if moved else {}
+            SosAlert.objects.filter(pk=incident.pk).update(trigger_count=F('trigger_count') + 1, last_triggered_at=now, **fields)
+            if moved:
+                incident.latitude, incident.longitude = latitude, longitude
+                return incident, LOCATION_UPDATE
+            return incident, COALESCED
+
+        incident = SosAlert.objects.create(
+            user=user, method=method, idempotency_key=idempotency_key or None,
+            latitude=latitude, longitude=longitude, last_triggered_at=now,
+        )
+        return incident, NEW
+
+
+def _alert_for(user, outcome, message, latitude, longitude):
+    """(message, channels) to send for an open_incident outcome, or None."""
+    if outcome == NEW:
+        return message, None
+    if outcome == LOCATION_UPDATE:
+        return f"📍 MuteSOS location update from {user.username}: https://www.google.com/maps?q={latitude},{longitude}", ("sms",)
+    return None
+
+
+def trigger_incident(user, method, recipients, message, idempotency_key=None, latitude=None, longitude=None):
+    """
+    Open (or fold into) an incident and write its outbox and delivery rows
+    in the same transaction. If that fails the incident is rolled back too,
+    so the user's retry raises a new SOS instead of folding into a silent
+    one. Returns (incident, outcome, queued, claimed): with
+    settings.SOS_USE_OUTBOX the rows are queued for the worker; otherwise
+    they are claimed, as (rows, deliveries), for the caller to send inline.
+    """
+    outbox = getattr(settings, 'SOS_USE_OUTBOX', False)
+    with transaction.atomic():
+        incident, outcome = open_incident(user, method, idempotency_key, latitude, longitude)
+        alert = _alert_for(user, outcome, message, latitude, longitude)
+        if alert is None:
+            return incident, outcome, 0, None
+        with stage('enqueue'):
+            if not outbox:
+                return incident, outcome, None, claim_alerts(user, recipients, alert[0], alert[1], incident=incident)
+            queued = enqueue_alerts(user, recipients, alert[0], alert[1], incident=incident)
+    return incident, outcome, queued, None
+
+
+async def atrigger_incident(user, method, recipients, message, idempotency_key=None, latitude=None, longitude=None):
+    """
+    Open (or fold into) an incident and alert `recipients` accordingly.
+    `message` should already carry the location link. Returns the
+    alert_recipients aggregate plus "incident" and "outcome".
+    """
+    with stage('incident'):
+        incident, outcome, queued, claimed = await sync_to_async(trigger_incident)(
+            user, method, recipients, message, idempotency_key, latitude, longitude
+        )
+    if queued is None:
+        text, channels = _alert_for(user, outcome, message, latitude, longitude)
+        results = await aalert_recipients(user, recipients, text, channels=channels, incident=incident, claimed=claimed)
+    else:
+        if not queued:
+            logger.info(f"SOS trigger by {user.username} folded into incident {incident.pk} ({outcome})")
+        results = {"ok": True, "queued": queued, "targets": [], "errors": []}
+    results.update({"incident": incident.pk, "outcome": outcome})
+    return results
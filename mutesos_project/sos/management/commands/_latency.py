@@ -0,0 +1,340 @@
+# sos/management/commands/_latency.py
+"""
+End-to-end SOS latency benchmark.
+
+Kept beside the latency_benchmark command, away from the app modules the
+server imports, because it patches the transport and settings the way the
+tests do.
+
+Every scenario seeds `users` fresh users, each with `contacts` trusted
+contacts; `helplines` helplines are shared by all of them. The provider is
+swapped for a FakeTransport that takes `provider_latency` seconds per
+send. The scenario then fires one trigger per user, all at once, through
+the full ASGI stack: middleware, auth, views, incident and outbox writes.
+Each trigger is timed from the start of its request to the first and the
+last alert the fake provider receives, and to its response. The figures
+are reported as p50/p95/p99 in milliseconds.
+
+Scenarios:
+  tap, passphrase  POST /sos/emergency/
+  voice            audio clip to /sos/voice_trigger/
+  transcript       JSON to /ai_module/voice_trigger/
+
+Keyword recognition is not measured. In the voice scenario it is replaced
+by a stand-in that takes `recognition_latency` seconds and always hears the
+keyword. In outbox mode a deliver_alerts loop polls every OUTBOX_POLL
+seconds, so the figures include the hand-off through the outbox. With
+`worker_thread` the loop gets its own thread and database connection,
+like the separate worker process in production. That needs a database
+other connections can see, such as the command's file-backed test
+database. Otherwise it shares the requests' connection, as tests must.
+
+Reports can be saved as the baseline (latency_baseline.json next to this
+module) and later runs compared with it. Absolute timings only mean
+something on the hardware they were taken on, so each report records its
+machine (see machine()) and a baseline from another machine is reported
+as a mismatch rather than compared: re-record it there with
+`latency_benchmark --save-baseline`. Used by
+`python manage.py latency_benchmark` (on a throwaway test database) and by
+the test suite.
+"""
+import io
+import os
+import re
+import json
+import time
+import uuid
+import wave
+import asyncio
+import logging
+import platform
+import tempfile
+import statistics
+from pathlib import Path
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import AsyncClient, override_settings
+
+from sos.transport import FakeTransport, set_transport
+
+logger = logging.getLogger(__name__)
+
+SCENARIOS = ('tap', 'passphrase', 'voice', 'transcript')
+METRICS = ('first_alert_ms', 'last_alert_ms', 'response_ms')
+DEFAULTS = {
+    'users': 20,
+    'contacts': 5,
+    'helplines': 3,
+    'provider_latency': 0.2,     # seconds per send
+    'recognition_latency': 0.3,  # seconds per clip (voice scenario)
+}
+BASELINE_PATH = Path(__file__).resolve().parent / 'latency_baseline.json'
+
+# A run regresses when a percentile exceeds baseline * (1 + TOLERANCE) + SLACK_MS
+DEFAULT_TOLERANCE = 0.25
+DEFAULT_SLACK_MS = 25
+
+OUTBOX_POLL = 0.05  # seconds between empty outbox polls (deliver_alerts uses 0.5)
+CHANNELS = 2        # every recipient gets an SMS and a call
+PASSPHRASE = 'bench-passphrase'
+KEYWORD = 'help me'
+_USERNAME = re.compile(r'bench-[a-z]+-\d{4}')
+
+
+def percentiles(values):
+    """p50/p95/p99 of `values`, rounded to 0.1 (None when there are none)."""
+    if not values:
+        return {'p50': None, 'p95': None, 'p99': None}
+    cuts = statistics.quantiles(values, n=100, method='inclusive') if len(values) > 1 else values * 99
+    return {'p50': round(cuts[49], 1), 'p95': round(cuts[94], 1), 'p99': round(cuts[98], 1)}
+
+
+def machine():
+    """The CPU and runtime a report is measured on."""
+    cpu = platform.processor()
+    try:
+        for line in Path('/proc/cpuinfo').read_text().splitlines():
+            if line.startswith('model name'):
+                cpu = line.split(':', 1)[1].strip()
+                break
+    except OSError:
+        pass
+    return {
+        'python': '.'.join(platform.python_version_tuple()[:2]),
+        'platform': platform.system(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'cpu': cpu,
+    }
+
+
+def _clip(seconds=1.0, rate=16000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(b'\x00\x10' * int(seconds * rate))
+    return buffer.getvalue()
+
+
+def _stand_in_recognizer(latency):
+    from ai_module.voice import VoiceResult
+
+    def analyze_clip(pcm, keyword):
+        time.sleep(latency)
+        return VoiceResult(KEYWORD, True, KEYWORD, 1.0, engine='kws')
+    return analyze_clip
+
+
+# -----------------------------
+# Seeding (bulk inserts; no password hashing)
+# -----------------------------
+def _seed_helplines(count):
+    from contacts.models import Helpline
+    from sos.recipients import invalidate_helplines
+
+    numbers = [f"+9170{j:08d}" for j in range(count)]
+    Helpline.objects.bulk_create(
+        Helpline(label=f"Helpline {j}", phone_number=number, phone_normalized=number) for j, number in enumerate(numbers)
+    )
+    invalidate_helplines()
+
+
+def _seed_users(scenario, count, contacts):
+    from contacts.models import TrustedContact
+    from users.models import Profile
+    from sos.recipients import invalidate_contacts
+
+    users = User.objects.bulk_create(
+        User(username=f"bench-{scenario}-{i:04d}", password=make_password(None)) for i in range(count)
+    )
+    Profile.objects.bulk_create(Profile(user=user, secret_passphrase=PASSPHRASE, voice_keyword=KEYWORD) for user in users)
+    rows = []
+    for i, user in enumerate(users):
+        for k in range(contacts):
+            number = f"+9180{i:04d}{k:04d}"
+            rows.append(TrustedContact(
+                user=user, name=f"Contact {k}", phone_number=number, phone_normalized=number,
+                email="bench@example.com", relationship="friend",
+            ))
+    TrustedContact.objects.bulk_create(rows)
+    for user in users:
+        invalidate_contacts(user.pk)
+    return users
+
+
+# -----------------------------
+# Driving the triggers
+# -----------------------------
+async def _fire(client, scenario):
+    key = uuid.uuid4().hex
+    if scenario == 'tap':
+        return await client.post('/sos/emergency/', {'trigger_button': '1', 'idempotency_key': key})
+    if scenario == 'passphrase':
+        return await client.post('/sos/emergency/', {'passphrase': PASSPHRASE, 'idempotency_key': key})
+    if scenario == 'voice':
+        audio = SimpleUploadedFile('clip.wav', _clip(), content_type='audio/wav')
+        return await client.post('/sos/voice_trigger/', {'audio': audio, 'idempotency_key': key})
+    return await client.post(
+        '/ai_module/voice_trigger/', json.dumps({'transcript': KEYWORD, 'idempotency_key': key}), content_type='application/json'
+    )
+
+
+def _alerts_by_user(transport, prefix):
+    by_user = {}
+    for sent in list(transport.sent):
+        match = _USERNAME.search(sent['body'])
+        if match and match.group().startswith(prefix):
+            by_user.setdefault(match.group(), []).append(sent['at'])
+    return by_user
+
+
+async def _deliver_loop(stop, executor=None):
+    from sos.outbox import process_outbox
+
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        try:
+            if executor:
+                handled = await loop.run_in_executor(executor, process_outbox)
+            else:
+                handled = await sync_to_async(process_outbox)()
+        except Exception as e:
+            # like deliver_alerts: keep going, the rows are retried
+            logger.warning(f"Outbox batch failed during benchmark: {e}")
+            handled = 0
+        if not handled:
+            await asyncio.sleep(OUTBOX_POLL)
+    if executor:
+        await loop.run_in_executor(executor, lambda: connection.close())  # the worker thread's own connection
+
+
+async def _run_scenario(scenario, users, transport, expected, outbox, timeout, worker_thread=False):
+    clients = []
+    for user in users:
+        client = AsyncClient()
+        await client.aforce_login(user)
+        clients.append(client)
+
+    stop = asyncio.Event()
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='bench-outbox') if outbox and worker_thread else None
+    worker = asyncio.ensure_future(_deliver_loop(stop, executor)) if outbox else None
+    started, answered = {}, {}
+
+    async def trigger(client, user):
+        started[user.username] = time.monotonic()
+        response = await _fire(client, scenario)
+        answered[user.username] = time.monotonic()
+        return response.status_code
+
+    try:
+        statuses = await asyncio.gather(*(trigger(client, user) for client, user in zip(clients, users)))
+        # outbox deliveries (and late sends) may still be on their way
+        prefix = f"bench-{scenario}-"
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if sum(map(len, _alerts_by_user(transport, prefix).values())) >= expected * len(users):
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        stop.set()
+        if worker:
+            await worker
+        if executor:
+            executor.shutdown()
+
+    alerts = _alerts_by_user(transport, f"bench-{scenario}-")
+    first, last, response = [], [], []
+    for user in users:
+        t0 = started[user.username]
+        response.append((answered[user.username] - t0) * 1000)
+        times = alerts.get(user.username)
+        if times:
+            first.append((min(times) - t0) * 1000)
+            last.append((max(times) - t0) * 1000)
+    return {
+        'triggers': len(users),
+        'errors': sum(status != 200 for status in statuses),
+        'missing_alerts': expected * len(users) - sum(map(len, alerts.values())),
+        'first_alert_ms': percentiles(first),
+        'last_alert_ms': percentiles(last),
+        'response_ms': percentiles(response),
+    }
+
+
+def run_benchmark(scenarios=SCENARIOS, outbox=None, timeout=30, worker_thread=False, **params):
+    """
+    Seed, fire every scenario and return the report:
+      {"config": {...}, "machine": {...},
+       "scenarios": {name: {"triggers", "errors", "missing_alerts",
+                            "first_alert_ms": {"p50", "p95", "p99"}, ...}}}
+    Needs a database with the schema; run it on a test database.
+    """
+    from sos import views
+
+    config = {**DEFAULTS, **params}
+    config['outbox'] = getattr(settings, 'SOS_USE_OUTBOX', False) if outbox is None else outbox
+    expected = (config['contacts'] + config['helplines']) * CHANNELS
+    transport = FakeTransport(latency=config['provider_latency'])
+    set_transport(transport)
+    try:
+        # clips from the voice scenario go to a throwaway media root
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(SOS_USE_OUTBOX=config['outbox'], MEDIA_ROOT=media_root), \
+                mock.patch.object(views, 'analyze_clip', _stand_in_recognizer(config['recognition_latency'])):
+            _seed_helplines(config['helplines'])
+            results = {}
+            for scenario in scenarios:
+                users = _seed_users(scenario, config['users'], config['contacts'])
+                results[scenario] = async_to_sync(_run_scenario)(
+                    scenario, users, transport, expected, config['outbox'], timeout, worker_thread
+                )
+    finally:
+        set_transport(None)
+    return {'config': config, 'machine': machine(), 'scenarios': results}
+
+
+# -----------------------------
+# Baseline
+# -----------------------------
+def load_baseline(path=BASELINE_PATH):
+    path = Path(path)
+    return json.loads(path.read_text()) if path.exists() else None
+
+
+def save_baseline(report, path=BASELINE_PATH):
+    Path(path).write_text(json.dumps(report, indent=2, sort_keys=True) + "\n")
+
+
+def regressions(report, baseline, tolerance=DEFAULT_TOLERANCE, slack_ms=DEFAULT_SLACK_MS):
+    """Regressions of `report` against `baseline`, as human-readable strings (empty when none)."""
+    problems = []
+    for scenario, result in report['scenarios'].items():
+        if result['errors'] or result['missing_alerts']:
+            problems.append(f"{scenario}: {result['errors']} failed request(s), {result['missing_alerts']} alert(s) never sent")
+    if baseline is None:
+        return problems
+    if baseline['config'] != report['config']:
+        return problems + [f"baseline was recorded with {baseline['config']}, this run used {report['config']}"]
+    if baseline.get('machine') != report['machine']:
+        return problems + [
+            f"baseline was recorded on {baseline.get('machine')}, this run is on {report['machine']}; "
+            "re-record it on this machine with --save-baseline"
+        ]
+    for scenario, result in report['scenarios'].items():
+        base = baseline['scenarios'].get(scenario)
+        if base is None:
+            continue
+        for metric in METRICS:
+            for p, value in result[metric].items():
+                before = base[metric][p]
+                if value is not None and before is not None and value > before * (1 + tolerance) + slack_ms:
+                    problems.append(f"{scenario} {metric} {p}: {value} ms (baseline {before} ms)")
+    return problems
@@ -0,0 +1,37 @@
+import time
+import logging
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from sos.outbox import process_outbox
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Deliver queued SOS alerts from the outbox, retrying failures with backoff."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help="Rows claimed per batch")
+        parser.add_argument('--interval', type=float, default=0.5, help="Seconds to sleep when the outbox is empty")
+        parser.add_argument('--once', action='store_true', help="Drain due rows and exit")
+
+    def handle(self, *args, **options):
+        self.stdout.write("📤 SOS alert worker started")
+        try:
+            while True:
+                try:
+                    handled = process_outbox(options['batch_size'])
+                except Exception as e:
+                    # keep the worker alive; claimed rows are released after the lease expires
+                    logger.exception(f"Outbox batch failed: {e}")
+                    handled = 0
+                if handled:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+                close_old_connections()  # recycle past CONN_MAX_AGE or after errors
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write("SOS alert worker stopped")
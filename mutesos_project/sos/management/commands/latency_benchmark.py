@@ -0,0 +1,80 @@
+import os
+import json
+import tempfile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from ._latency import (
+    BASELINE_PATH, DEFAULTS, DEFAULT_TOLERANCE, METRICS, SCENARIOS,
+    load_baseline, regressions, run_benchmark, save_baseline,
+)
+
+
+class Command(BaseCommand):
+    help = "Measure SOS time-to-first/last-alert (p50/p95/p99) against a fake provider, on a throwaway test database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', action='append', dest='scenarios', choices=SCENARIOS, help="Scenario to run (repeatable; default: all)")
+        parser.add_argument('--users', type=int, default=DEFAULTS['users'], help="Concurrent triggering users per scenario")
+        parser.add_argument('--contacts', type=int, default=DEFAULTS['contacts'], help="Trusted contacts per user")
+        parser.add_argument('--helplines', type=int, default=DEFAULTS['helplines'], help="Active helplines")
+        parser.add_argument('--provider-latency', type=float, default=DEFAULTS['provider_latency'], help="Seconds per fake provider send")
+        parser.add_argument('--recognition-latency', type=float, default=DEFAULTS['recognition_latency'], help="Seconds per clip for the stand-in recognizer")
+        parser.add_argument('--mode', choices=('outbox', 'inline'), default=None, help="Alert delivery path (default: settings.SOS_USE_OUTBOX)")
+        parser.add_argument('--json', action='store_true', help="Print the raw report as JSON")
+        parser.add_argument('--baseline', default=str(BASELINE_PATH), help="Baseline file")
+        parser.add_argument('--save-baseline', action='store_true', help="Store this run as the baseline")
+        parser.add_argument('--check', action='store_true', help="Fail on failed triggers or a regression against the baseline")
+        parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help="Allowed slowdown vs the baseline (0.25 = 25%%)")
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as tmp:
+            if connection.vendor == 'sqlite':
+                # a file, not shared memory, so the outbox worker thread can use its own connection
+                connection.settings_dict['TEST']['NAME'] = os.path.join(tmp, 'latency.sqlite3')
+            report = self.measure(options)
+        self.report(report, options)
+
+    def measure(self, options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            return run_benchmark(
+                options['scenarios'] or SCENARIOS,
+                outbox=None if options['mode'] is None else options['mode'] == 'outbox',
+                worker_thread=True,
+                users=options['users'], contacts=options['contacts'], helplines=options['helplines'],
+                provider_latency=options['provider_latency'], recognition_latency=options['recognition_latency'],
+            )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def report(self, report, options):
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            config = report['config']
+            self.stdout.write(
+                f"⏱️ SOS latency: {config['users']} users x ({config['contacts']} contacts + {config['helplines']} helplines), "
+                f"provider {config['provider_latency'] * 1000:.0f} ms, {'outbox' if config['outbox'] else 'inline'} delivery"
+            )
+            host = report['machine']
+            self.stdout.write(f"  on {host['cpu'] or host['machine']} x{host['cpus']}, {host['platform']}, Python {host['python']}")
+            self.stdout.write(f"  {'scenario':<12} {'metric':<15} {'p50':>9} {'p95':>9} {'p99':>9}")
+            for scenario, result in report['scenarios'].items():
+                for metric in METRICS:
+                    values = " ".join(f"{'-' if v is None else f'{v:.1f}':>9}" for v in result[metric].values())
+                    self.stdout.write(f"  {scenario:<12} {metric:<15} {values}")
+                if result['errors'] or result['missing_alerts']:
+                    self.stdout.write(self.style.WARNING(f"  {scenario}: {result['errors']} failed, {result['missing_alerts']} alerts missing"))
+
+        if options['save_baseline']:
+            save_baseline(report, options['baseline'])
+            self.stdout.write(f"Baseline saved to {options['baseline']}")
+        elif options['check']:
+            problems = regressions(report, load_baseline(options['baseline']), options['tolerance'])
+            if problems:
+                raise CommandError("SOS latency regressed:\n  " + "\n  ".join(problems))
+            self.stdout.write(self.style.SUCCESS("SOS latency within baseline"))
@@ -0,0 +1,35 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+
+from sos.startup import DEFAULT_URLS, measure, over_budget
+
+
+class Command(BaseCommand):
+    help = "Measure cold-start cost: boot/import time and first-request latency per URL, each in a fresh interpreter."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', action='append', dest='urls', help="URL to request (repeatable; default: main pages)")
+        parser.add_argument('--repeat', type=int, default=3, help="Fresh interpreters to measure (median is reported)")
+        parser.add_argument('--json', action='store_true', help="Print the raw report as JSON")
+        parser.add_argument('--check', action='store_true', help="Fail when the report exceeds sos.startup.BUDGET")
+
+    def handle(self, *args, **options):
+        report = measure(options['urls'] or DEFAULT_URLS, repeat=options['repeat'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.stdout.write(f"🚀 Cold start (median of {report['runs']} runs)")
+            self.stdout.write(f"  django.setup():   {report['setup_seconds'] * 1000:8.1f} ms")
+            self.stdout.write(f"  URLconf import:   {report['urlconf_seconds'] * 1000:8.1f} ms")
+            self.stdout.write("  First requests:")
+            for url, result in report['requests'].items():
+                self.stdout.write(f"    {url:<24} {result['status']}  {result['seconds'] * 1000:8.1f} ms")
+            self.stdout.write(f"  Heavy modules after boot:     {', '.join(report['heavy_after_boot']) or 'none'}")
+            self.stdout.write(f"  Heavy modules after requests: {', '.join(report['heavy_after_requests']) or 'none'}")
+
+        if options['check']:
+            problems = over_budget(report)
+            if problems:
+                raise CommandError("Startup budget exceeded:\n  " + "\n  ".join(problems))
+            self.stdout.write(self.style.SUCCESS("Startup within budget"))
@@ -0,0 +1,38 @@
+import time
+import logging
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from sos.retention import run_retention
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Apply voice-evidence retention: delete expired interactions and clips, compact old clips, remove orphans."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help="Rows/files handled per batch")
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would be done")
+        parser.add_argument('--no-compact', action='store_true', help="Skip transcoding old clips")
+        parser.add_argument('--interval', type=float, default=None, help="Keep running, sweeping every N seconds")
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                try:
+                    report = run_retention(options['batch_size'], options['dry_run'], compact=not options['no_compact'])
+                    verb = "Would remove" if options['dry_run'] else "Removed"
+                    self.stdout.write(
+                        f"🧹 {verb} {report['expired']} expired interactions and {report['orphans']} orphaned clips; "
+                        f"{report['compacted']} clips {'to compact' if options['dry_run'] else 'compacted'}"
+                    )
+                except Exception as e:
+                    # keep the sweeper alive; the next pass picks up where this one failed
+                    logger.exception(f"Retention sweep failed: {e}")
+                if options['interval'] is None:
+                    break
+                time.sleep(options['interval'])
+                close_old_connections()  # recycle past CONN_MAX_AGE or after errors
+        except KeyboardInterrupt:
+            pass
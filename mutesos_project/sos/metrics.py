@@ -0,0 +1,167 @@
+# sos/metrics.py
+"""
+Hot-path stage timing.
+
+Wrap a stage of the SOS/voice path in `with stage('stt'):`. The elapsed
+time goes into the mutesos_stage_seconds histogram, exposed at /metrics in
+the Prometheus text format (with settings.METRICS_TOKEN, or under DEBUG).
+With settings.SERVER_TIMING (or DEBUG) it is also added to the current
+request's breakdown, which ServerTimingMiddleware (sos.middleware) returns
+in the Server-Timing header; the stage names describe the internals, so
+the header is opt-in.
+
+Recording costs two perf_counter() calls, a bisect and a short lock per
+stage, so it can stay on in production (settings.METRICS_ENABLED). With
+it off, stage() is a shared no-op. Histograms live in the worker process;
+like prometheus_client without multiprocess mode, each worker serves its
+own figures.
+"""
+import time
+import bisect
+import threading
+from contextvars import ContextVar
+from django.conf import settings
+
+# Upper bounds in seconds; the last bucket is +Inf
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Stage timings of the request being served: {stage: [count, total, longest]}
+_request_timings = ContextVar('mutesos_request_timings', default=None)
+# Dispatch threads run in copies of the request context, which share its dict
+_request_timings_lock = threading.Lock()
+
+
+def metrics_enabled():
+    return getattr(settings, 'METRICS_ENABLED', True)
+
+
+def server_timing_enabled():
+    return metrics_enabled() and (settings.DEBUG or getattr(settings, 'SERVER_TIMING', False))
+
+
+class Histogram:
+    """A Prometheus histogram with one label (e.g. stage="stt")."""
+
+    def __init__(self, name, documentation, label, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # label value -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, label_value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {key: list(series) for key, series in self._series.items()}
+        for label_value, series in sorted(snapshot.items()):
+            label = f'{self.label}="{label_value}"'
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), series[:-1]):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label}}} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{{{label}}} {cumulative}")
+        return "\n".join(lines)
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+STAGE_SECONDS = Histogram('mutesos_stage_seconds', "Time spent in each stage of the SOS and voice paths.", 'stage')
+REQUEST_SECONDS = Histogram('mutesos_request_seconds', "Time to respond, per view.", 'view')
+REGISTRY = (STAGE_SECONDS, REQUEST_SECONDS)
+
+
+def record_stage(name, seconds):
+    """Record a stage timed elsewhere."""
+    STAGE_SECONDS.observe(seconds, name)
+    timings = _request_timings.get()
+    if timings is not None:
+        with _request_timings_lock:
+            entry = timings.get(name)
+            if entry is None:
+                timings[name] = [1, seconds, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+                entry[2] = max(entry[2], seconds)
+
+
+class _Stage:
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record_stage(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class _NoStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name):
+    """Context manager timing one stage (wall time, awaits included)."""
+    return _Stage(name) if metrics_enabled() else _NO_STAGE
+
+
+# -----------------------------
+# Per-request breakdown (ServerTimingMiddleware)
+# -----------------------------
+def begin_request():
+    """Start collecting stage timings for this request; returns the reset token."""
+    return _request_timings.set({})
+
+
+def end_request(token):
+    """Stop collecting and return {stage: [count, total, longest]}."""
+    timings = _request_timings.get()
+    _request_timings.reset(token)
+    return timings or {}
+
+
+def server_timing(timings, total=None):
+    """
+    Server-Timing header value. A stage seen several times (e.g. one send per
+    recipient, run concurrently) reports its longest run and the count.
+    """
+    parts = []
+    for name, (count, spent, longest) in timings.items():
+        if count == 1:
+            parts.append(f"{name};dur={spent * 1000:.1f}")
+        else:
+            parts.append(f'{name};dur={longest * 1000:.1f};desc="longest of {count}"')
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def render_metrics():
+    """Every histogram in the Prometheus text exposition format."""
+    return "\n".join(histogram.render() for histogram in REGISTRY) + "\n"
@@ -0,0 +1,53 @@
+# sos/middleware.py
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .metrics import REQUEST_SECONDS, begin_request, end_request, metrics_enabled, server_timing, server_timing_enabled
+
+
+class ServerTimingMiddleware:
+    """
+    Time each request: the total goes into mutesos_request_seconds (per view).
+    With settings.SERVER_TIMING (or DEBUG) the response also gets a
+    Server-Timing header with the stages recorded while it was served (see
+    sos.metrics).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not metrics_enabled():
+            return self.get_response(request)
+        started, token = time.perf_counter(), begin_request() if server_timing_enabled() else None
+        try:
+            response = self.get_response(request)
+        finally:
+            timings = end_request(token) if token else None
+        return self.finish(request, response, timings, started)
+
+    async def __acall__(self, request):
+        if not metrics_enabled():
+            return await self.get_response(request)
+        started, token = time.perf_counter(), begin_request() if server_timing_enabled() else None
+        try:
+            response = await self.get_response(request)
+        finally:
+            timings = end_request(token) if token else None
+        return self.finish(request, response, timings, started)
+
+    def finish(self, request, response, timings, started):
+        total = time.perf_counter() - started
+        match = request.resolver_match
+        # unresolved paths (404s, probes) share one series to keep the label set small
+        REQUEST_SECONDS.observe(total, match.view_name if match else 'unmatched')
+        if timings is not None:
+            response['Server-Timing'] = server_timing(timings, total)
+        return response
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.4 on 2026-10-17 12:07
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sos', '0003_alertoutbox'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sosalert',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='sosalert',
+            name='last_triggered_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='sosalert',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='sosalert',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='sosalert',
+            name='trigger_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddIndex(
+            model_name='sosalert',
+            index=models.Index(fields=['user', 'last_triggered_at'], name='sos_sosaler_user_id_8435b0_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='sosalert',
+            constraint=models.UniqueConstraint(fields=('user', 'idempotency_key'), name='unique_sos_idempotency_key'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-17 12:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sos', '0004_sosalert_idempotency'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('to_number', models.CharField(max_length=20)),
+                ('channel', models.CharField(choices=[('sms', 'SMS'), ('call', 'Call')], max_length=10)),
+                ('provider_sid', models.CharField(blank=True, max_length=64)),
+                ('status', models.CharField(default='pending', max_length=20)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('latency_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('incident', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='sos.sosalert')),
+                ('outbox', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='deliveries', to='sos.alertoutbox')),
+            ],
+            options={
+                'verbose_name_plural': 'alert deliveries',
+                'indexes': [models.Index(condition=models.Q(('provider_sid', ''), _negated=True), fields=['provider_sid'], name='delivery_by_sid'), models.Index(fields=['status', 'id'], name='delivery_status_keyset'), models.Index(fields=['channel', 'id'], name='delivery_channel_keyset')],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.4 on 2026-10-17 12:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sos', '0005_alert_deliveries'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='alertdelivery',
+            name='delivery_by_sid',
+        ),
+        migrations.AddIndex(
+            model_name='alertdelivery',
+            index=models.Index(fields=['provider_sid'], name='delivery_by_sid'),
+        ),
+    ]
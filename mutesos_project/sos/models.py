@@ -1,11 +1,27 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 
 class SosAlert(models.Model):
+    """
+    One SOS incident. Repeat triggers by the same user inside the coalescing
+    window, or replays of the same idempotency key, fold into this row.
+    """
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    method = models.CharField(max_length=50)  # e.g., "passphrase", "tap"
+    method = models.CharField(max_length=50)  # e.g., "passphrase", "tap", "voice"
     timestamp = models.DateTimeField(auto_now_add=True)
+    idempotency_key = models.CharField(max_length=64, null=True, blank=True)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    last_triggered_at = models.DateTimeField(default=timezone.now)
+    trigger_count = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'idempotency_key'], name='unique_sos_idempotency_key'),
+        ]
+        indexes = [models.Index(fields=['user', 'last_triggered_at'])]
 
     def __str__(self):
         return f"{self.user.username} triggered via {self.method} at {self.timestamp}"
@@ -18,3 +34,78 @@ class Helpline(models.Model):
 
     def __str__(self):
         return f"{self.name} ({self.phone_number})"
+
+
+class AlertOutbox(models.Model):
+    """
+    One pending alert per recipient. Trigger views write rows here and return;
+    the deliver_alerts worker claims them in batches and sends them.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_CLAIMED = 'claimed'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_CLAIMED, 'Claimed'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    to_number = models.CharField(max_length=20)
+    message = models.TextField()
+    channels = models.CharField(max_length=20, default='sms,call')  # comma separated, e.g. "sms,call"
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claim_token = models.CharField(max_length=32, blank=True, db_index=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    result = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+    def __str__(self):
+        return f"{self.to_number} [{self.channels}] {self.status}"
+
+
+class AlertDelivery(models.Model):
+    """
+    One alert to one recipient over one channel, for an incident.
+    Written in bulk with the incident's outbox rows (or from the inline
+    fan-out) and updated in bulk as the worker delivers them.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'  # accepted by a provider that reported no status of its own
+    STATUS_RETRYING = 'retrying'
+    STATUS_FAILED = 'failed'
+    # Once accepted, status holds the provider's own value ("queued", "delivered", ...)
+    CHANNEL_CHOICES = [('sms', 'SMS'), ('call', 'Call')]
+
+    incident = models.ForeignKey(SosAlert, on_delete=models.CASCADE, related_name='deliveries')
+    outbox = models.ForeignKey(AlertOutbox, on_delete=models.SET_NULL, null=True, blank=True, related_name='deliveries')
+    to_number = models.CharField(max_length=20)
+    channel = models.CharField(max_length=10, choices=CHANNEL_CHOICES)
+    provider_sid = models.CharField(max_length=64, blank=True)
+    status = models.CharField(max_length=20, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    latency_ms = models.PositiveIntegerField(null=True, blank=True)  # provider round trip of the last attempt
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'alert deliveries'
+        indexes = [
+            # full index: status callbacks look SIDs up with IN (...), which a partial index cannot serve
+            models.Index(fields=['provider_sid'], name='delivery_by_sid'),
+            models.Index(fields=['status', 'id'], name='delivery_status_keyset'),
+            models.Index(fields=['channel', 'id'], name='delivery_channel_keyset'),
+        ]
+
+    def __str__(self):
+        return f"{self.channel} to {self.to_number}: {self.status}"
@@ -0,0 +1,302 @@
+# sos/outbox.py
+import random
+import logging
+import uuid
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import AlertDelivery, AlertOutbox
+from .dispatch import SUCCESS_KEYS, dispatch_alerts
+from .deliveries import UPDATE_FIELDS, apply_result, pending_deliveries
+
+logger = logging.getLogger(__name__)
+
+# Defaults (override via settings.SOS_OUTBOX_*)
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BACKOFF = 5      # seconds before the first retry, doubled per attempt
+DEFAULT_MAX_BACKOFF = 300
+DEFAULT_LEASE = 120      # seconds before a claimed row from a dead worker is reclaimed
+
+
+def _setting(name, default):
+    return getattr(settings, f'SOS_OUTBOX_{name}', default)
+
+
+# -----------------------------
+# Producer side (trigger views)
+# -----------------------------
+def _queue(user, numbers, message, channels, incident, claim_token=''):
+    channels = ",".join(channels or SUCCESS_KEYS)
+    status = AlertOutbox.STATUS_CLAIMED if claim_token else AlertOutbox.STATUS_PENDING
+    claimed_at = timezone.now() if claim_token else None
+    seen = set()
+    rows = []
+    for number in numbers:
+        if not isinstance(number, str) or not number.strip() or number.strip() in seen:
+            continue
+        seen.add(number.strip())
+        rows.append(AlertOutbox(
+            user=user, to_number=number.strip(), message=message, channels=channels,
+            status=status, claim_token=claim_token, claimed_at=claimed_at,
+        ))
+
+    deliveries = []
+    with transaction.atomic(savepoint=False):  # or the caller's, with its incident
+        AlertOutbox.objects.bulk_create(rows)
+        if incident is not None:
+            deliveries = AlertDelivery.objects.bulk_create(pending_deliveries(incident, rows))
+    return rows, deliveries
+
+
+def enqueue_alerts(user, numbers, message, channels=None, incident=None):
+    """
+    Write one outbox row per recipient in a single transaction, together
+    with the incident's pending delivery rows when `incident` is given.
+    Returns the number of rows queued.
+    """
+    rows, _ = _queue(user, numbers, message, channels, incident)
+    logger.info(f"Queued {len(rows)} SOS alert(s) for {getattr(user, 'username', user)}")
+    return len(rows)
+
+
+def claim_alerts(user, numbers, message, channels=None, incident=None):
+    """
+    enqueue_alerts for an inline send: the rows are written already claimed
+    by the caller, which sends them at once and settles them (see settle).
+    The worker only sees them again to retry failures, or after the lease
+    if the caller dies mid-send. Returns (rows, deliveries).
+    """
+    return _queue(user, numbers, message, channels, incident, claim_token=uuid.uuid4().hex)
+
+
+# -----------------------------
+# Consumer side (deliver_alerts worker)
+# -----------------------------
+def release_stale_claims():
+    """Return rows claimed by a worker that died mid-batch to the pending pool."""
+    cutoff = timezone.now() - timedelta(seconds=_setting('LEASE', DEFAULT_LEASE))
+    released = AlertOutbox.objects.filter(status=AlertOutbox.STATUS_CLAIMED, claimed_at__lt=cutoff).update(
+        status=AlertOutbox.STATUS_PENDING, claim_token=''
+    )
+    if released:
+        logger.warning(f"Released {released} stale outbox claim(s)")
+    return released
+
+
+def claim_batch(limit=None):
+    """
+    Atomically claim up to `limit` due rows for this worker.
+    The status guard on the UPDATE keeps two workers from claiming the same row.
+    """
+    limit = limit or _setting('BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    with transaction.atomic():
+        due = AlertOutbox.objects.filter(status=AlertOutbox.STATUS_PENDING, next_attempt_at__lte=now)
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        ids = list(due.order_by('next_attempt_at', 'id').values_list('id', flat=True)[:limit])
+        if not ids:
+            return []
+        AlertOutbox.objects.filter(id__in=ids, status=AlertOutbox.STATUS_PENDING).update(
+            status=AlertOutbox.STATUS_CLAIMED, claim_token=token, claimed_at=now
+        )
+    return list(AlertOutbox.objects.filter(claim_token=token, status=AlertOutbox.STATUS_CLAIMED))
+
+
+def _backoff(attempts):
+    base = _setting('BACKOFF', DEFAULT_BACKOFF)
+    delay = min(base * (2 ** (attempts - 1)), _setting('MAX_BACKOFF', DEFAULT_MAX_BACKOFF))
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def claimed_deliveries(rows):
+    """Unfinished deliveries of outbox `rows`, keyed by (outbox id, channel)."""
+    return {
+        (delivery.outbox_id, delivery.channel): delivery
+        for delivery in AlertDelivery.objects.filter(
+            outbox__in=rows, status__in=[AlertDelivery.STATUS_PENDING, AlertDelivery.STATUS_RETRYING]
+        )
+    }
+
+
+def fan_outs(rows):
+    """Group rows sharing a message and channel set: {(message, channels): [rows]}; each group is one fan-out."""
+    groups = {}
+    for row in rows:
+        groups.setdefault((row.message, row.channels), []).append(row)
+    return groups
+
+
+def _finish(row, remaining, now, max_attempts):
+    """Release a settled row: sent, or back to the pool (failed after max_attempts). Returns its new status."""
+    row.claim_token = ''
+    if not remaining:
+        row.status = AlertOutbox.STATUS_SENT
+        row.sent_at = now
+        row.last_error = ''
+        return row.status
+
+    row.channels = ",".join(remaining)
+    row.last_error = "; ".join(str(row.result.get(c, {}).get("error") or "unknown") for c in remaining)
+    if row.attempts >= max_attempts:
+        row.status = AlertOutbox.STATUS_FAILED
+        logger.error(f"Giving up on SOS alert to {row.to_number} after {row.attempts} attempt(s): {row.last_error}")
+    else:
+        row.status = AlertOutbox.STATUS_PENDING
+        row.next_attempt_at = now + _backoff(row.attempts)
+    return row.status
+
+
+def settle(groups, deliveries, outcomes):
+    """
+    Record the outcome of sending claimed rows. `outcomes` holds the
+    dispatch aggregate of each fan_outs() group. Channels that succeeded
+    are dropped from the row so a retry never re-sends them; failures go
+    back to the pool with backoff. A row with a send still in flight past
+    the dispatch deadline stays claimed until settle_late records it, so
+    nothing retries it meanwhile. Outbox and delivery rows are updated
+    together, one bulk UPDATE each. Returns (sent, retried, failed)
+    counts; retried includes rows still in flight.
+    """
+    max_attempts = _setting('MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+    counts = {AlertOutbox.STATUS_SENT: 0, AlertOutbox.STATUS_PENDING: 0, AlertOutbox.STATUS_FAILED: 0}
+    now = timezone.now()
+    rows = []
+    for key, group in groups.items():
+        rows.extend(group)
+        channels = [c for c in key[1].split(",") if c in SUCCESS_KEYS]
+        targets = dict(zip(dict.fromkeys(row.to_number for row in group), outcomes[key]["targets"]))
+
+        for row in group:
+            target = targets.get(row.to_number, {})
+            remaining = [c for c in channels if not target.get(c, {}).get(SUCCESS_KEYS[c])]
+            in_flight = [c for c in remaining if target.get(c, {}).get("in_flight")]
+            row.attempts += 1
+            row.result = {c: {k: v for k, v in target.get(c, {}).items() if k != "traceback"} for c in channels}
+            for channel in channels:
+                if (row.pk, channel) in deliveries and channel not in in_flight:
+                    apply_result(deliveries[(row.pk, channel)], target.get(channel, {}), final=row.attempts >= max_attempts)
+            if in_flight:
+                row.channels = ",".join(remaining)
+                counts[AlertOutbox.STATUS_PENDING] += 1
+                continue
+            counts[_finish(row, remaining, now, max_attempts)] += 1
+
+    with transaction.atomic(savepoint=False):
+        AlertOutbox.objects.bulk_update(
+            rows, ['status', 'attempts', 'channels', 'claim_token', 'result', 'last_error', 'next_attempt_at', 'sent_at']
+        )
+        AlertDelivery.objects.bulk_update(
+            [delivery for delivery in deliveries.values() if delivery.attempts], UPDATE_FIELDS
+        )
+    return counts[AlertOutbox.STATUS_SENT], counts[AlertOutbox.STATUS_PENDING], counts[AlertOutbox.STATUS_FAILED]
+
+
+def settle_late(row_id, claim_token, channel, res):
+    """
+    Record one send that was still in flight when settle ran, and settle
+    its row once none of its channels are. Does nothing if the claim has
+    been released meanwhile (the send outlived the lease): the worker then
+    owns the row again.
+    """
+    max_attempts = _setting('MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+    with transaction.atomic():
+        row = AlertOutbox.objects.select_for_update().filter(
+            pk=row_id, status=AlertOutbox.STATUS_CLAIMED, claim_token=claim_token
+        ).first()
+        if row is None:
+            logger.warning(f"Late {channel} result for SOS alert {row_id} arrived after its claim was released")
+            return
+        delivery = AlertDelivery.objects.filter(
+            outbox=row, channel=channel, status__in=[AlertDelivery.STATUS_PENDING, AlertDelivery.STATUS_RETRYING]
+        ).first()
+        if delivery is not None:
+            apply_result(delivery, res, final=row.attempts >= max_attempts).save(update_fields=UPDATE_FIELDS)
+
+        row.result[channel] = {k: v for k, v in res.items() if k != "traceback"}
+        remaining = [c for c in row.channels.split(",") if not row.result.get(c, {}).get(SUCCESS_KEYS.get(c, "sent"))]
+        if any(row.result.get(c, {}).get("in_flight") for c in remaining):
+            row.save(update_fields=['result'])
+            return
+        _finish(row, remaining, timezone.now(), max_attempts)
+        row.save(update_fields=['status', 'channels', 'claim_token', 'result', 'last_error', 'next_attempt_at', 'sent_at'])
+
+
+class LateSends:
+    """
+    on_late callback for dispatch_alerts: records sends that finish after
+    the dispatch deadline on their outbox rows (see settle_late). Results
+    that arrive before the batch has been settled are held until release(),
+    so settle never overwrites them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._held = []
+        self._released = False
+
+    def callback(self, rows):
+        """on_late callback for one dispatch_alerts call over claimed `rows`."""
+        claims = {row.to_number: (row.pk, row.claim_token) for row in rows}
+
+        def on_late(number, channel, res):
+            with self._lock:
+                if not self._released:
+                    self._held.append((claims[number], channel, res))
+                    return
+            try:
+                self._record(claims[number], channel, res)
+            finally:
+                connection.close()  # a dispatch pool thread
+        return on_late
+
+    def release(self):
+        """Call once the batch is settled: record held results now, later ones as they arrive."""
+        with self._lock:
+            self._released = True
+            held, self._held = self._held, []
+        for claim, channel, res in held:
+            self._record(claim, channel, res)
+
+    def _record(self, claim, channel, res):
+        try:
+            settle_late(*claim, channel, res)
+        except Exception as e:
+            logger.exception(f"Recording a late {channel} result for SOS alert {claim[0]} failed: {e}")
+
+
+def deliver_batch(rows):
+    """
+    Send claimed rows and record the outcome (see settle).
+    Rows sharing a message and channel set go out in one concurrent fan-out.
+    Returns (sent, retried, failed) counts.
+    """
+    from .utils import CHANNEL_SENDERS
+
+    deliveries = claimed_deliveries(rows)
+    groups = fan_outs(rows)
+    late = LateSends()
+    outcomes = {}
+    for (message, channels), group in groups.items():
+        senders = {c: CHANNEL_SENDERS[c] for c in channels.split(",") if c in CHANNEL_SENDERS}
+        outcomes[(message, channels)] = dispatch_alerts(
+            [row.to_number for row in group], message, senders, on_late=late.callback(group)
+        )
+    counts = settle(groups, deliveries, outcomes)
+    late.release()
+    return counts
+
+
+def process_outbox(limit=None):
+    """Release stale claims, then claim and deliver one batch. Returns rows handled."""
+    release_stale_claims()
+    rows = claim_batch(limit)
+    if rows:
+        sent, retried, failed = deliver_batch(rows)
+        logger.info(f"Outbox batch: {sent} sent, {retried} retrying, {failed} failed")
+    return len(rows)
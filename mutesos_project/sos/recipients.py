@@ -0,0 +1,115 @@
+# sos/recipients.py
+"""
+Cached, normalized recipient lists for the SOS hot path.
+
+Active trusted contacts are cached per user and active helplines once for
+everybody; both are dropped by the post_save/post_delete receivers in
+sos.signals, so deciding whom to alert needs no database query.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from contacts.models import TrustedContact, Helpline
+from .helpers import format_phone_number
+
+CONTACTS_KEY = "sos:recipients:contacts:{user_id}"
+HELPLINES_KEY = "sos:recipients:helplines"
+
+# Safety net in case a bulk .update() skips the invalidation signals
+DEFAULT_TIMEOUT = 3600
+
+
+def _timeout():
+    return getattr(settings, 'SOS_RECIPIENT_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+
+
+def _contact_entry(contact):
+    return {
+        "name": contact.name,
+        "relationship": contact.relationship,
+        "phone_number": contact.phone_number,
+        "number": contact.phone_normalized or format_phone_number(contact.phone_number),
+    }
+
+
+def _helpline_entry(helpline):
+    return {
+        "label": helpline.label,
+        "phone_number": helpline.phone_number,
+        "number": helpline.phone_normalized or format_phone_number(helpline.phone_number),
+    }
+
+
+def _contacts_queryset(user_id):
+    return TrustedContact.objects.filter(user_id=user_id, is_active=True).order_by('id')
+
+
+def _helplines_queryset():
+    return Helpline.objects.filter(is_active=True).order_by('id')
+
+
+def merge_recipients(contacts, helplines):
+    """Normalized numbers of contacts then helplines, deduplicated in order."""
+    return list(dict.fromkeys(entry["number"] for entry in list(contacts) + list(helplines)))
+
+
+# -----------------------------
+# Sync API
+# -----------------------------
+def get_active_contacts(user_id):
+    """Active trusted contacts of a user as display dicts (name, relationship, phone_number, number)."""
+    key = CONTACTS_KEY.format(user_id=user_id)
+    contacts = cache.get(key)
+    if contacts is None:
+        contacts = [_contact_entry(c) for c in _contacts_queryset(user_id)]
+        cache.set(key, contacts, _timeout())
+    return contacts
+
+
+def get_active_helplines():
+    """Active helplines as display dicts (label, phone_number, number)."""
+    helplines = cache.get(HELPLINES_KEY)
+    if helplines is None:
+        helplines = [_helpline_entry(h) for h in _helplines_queryset()]
+        cache.set(HELPLINES_KEY, helplines, _timeout())
+    return helplines
+
+
+def get_recipients(user_id):
+    """Deduplicated, normalized numbers to alert for a user."""
+    return merge_recipients(get_active_contacts(user_id), get_active_helplines())
+
+
+# -----------------------------
+# Async API (ASGI views)
+# -----------------------------
+async def aget_active_contacts(user_id):
+    key = CONTACTS_KEY.format(user_id=user_id)
+    contacts = await cache.aget(key)
+    if contacts is None:
+        contacts = [_contact_entry(c) async for c in _contacts_queryset(user_id)]
+        await cache.aset(key, contacts, _timeout())
+    return contacts
+
+
+async def aget_active_helplines():
+    helplines = await cache.aget(HELPLINES_KEY)
+    if helplines is None:
+        helplines = [_helpline_entry(h) async for h in _helplines_queryset()]
+        await cache.aset(HELPLINES_KEY, helplines, _timeout())
+    return helplines
+
+
+async def aget_recipients(user_id):
+    return merge_recipients(await aget_active_contacts(user_id), await aget_active_helplines())
+
+
+# -----------------------------
+# Invalidation
+# -----------------------------
+def invalidate_contacts(user_id):
+    cache.delete(CONTACTS_KEY.format(user_id=user_id))
+
+
+def invalidate_helplines():
+    cache.delete(HELPLINES_KEY)
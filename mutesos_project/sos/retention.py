@@ -0,0 +1,211 @@
+# sos/retention.py
+"""
+Retention for voice evidence (the sos.audio_store blobs and AIInteraction rows).
+
+Interactions are kept for a TTL that depends on their class: 'danger'
+(keyword detected, or a High distress analysis) or 'routine'. Expired rows
+are deleted together with their clips (a blob shared with a surviving row
+stays). Clips older than AUDIO_COMPACT_AFTER_DAYS are transcoded to a
+compact mono Opus file (the cold tier) and their rows are pointed at it.
+Files nobody references are removed once they are older than the routine
+TTL. A blob written or reused (sos.audio_store) within AUDIO_SWEEP_GRACE_SECONDS
+is never removed or compacted: the row that will refer to it may not be
+written yet. Blobs are moved out of the store before they go (see
+sos.audio_store.retire_blob), so an upload reusing one while it is checked
+keeps it.
+
+Everything works in batches of AUDIO_SWEEP_BATCH_SIZE, so a sweep never
+holds the database (or memory) for long; run it with
+`python manage.py sweep_retention`.
+"""
+import os
+import shutil
+import logging
+import subprocess
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from ai_module.models import AIInteraction
+from .audio_store import STORE_DIR, blob_path, retire_blob
+
+logger = logging.getLogger(__name__)
+
+# Defaults (override via settings.AUDIO_*)
+DEFAULT_RETENTION_DAYS = {'danger': 365, 'routine': 30}
+DEFAULT_COMPACT_AFTER_DAYS = 2
+DEFAULT_SWEEP_BATCH_SIZE = 200
+DEFAULT_SWEEP_GRACE_SECONDS = 3600
+
+# Cold tier: 16 kHz mono Opus, ~3 KB per second of speech
+COMPACT_EXTENSION = '.ogg'
+COMPACT_ARGS = ['-ac', '1', '-ar', '16000', '-c:a', 'libopus', '-b:a', '24k', '-application', 'voip']
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _grace_cutoff():
+    """Blobs written or reused after this timestamp are in use."""
+    return timezone.now().timestamp() - _setting('AUDIO_SWEEP_GRACE_SECONDS', DEFAULT_SWEEP_GRACE_SECONDS)
+
+
+def _in_use(path):
+    """True when the blob at `path` was written or reused within the grace period."""
+    try:
+        return os.stat(path).st_mtime > _grace_cutoff()
+    except FileNotFoundError:
+        return False
+
+
+def _remove(name):
+    retired = retire_blob(blob_path(name), _grace_cutoff())
+    if retired is None:
+        return False
+    os.remove(retired)
+    return True
+
+
+def _referenced(names):
+    return set(AIInteraction.objects.filter(input_voice_file__in=names).values_list('input_voice_file', flat=True))
+
+
+def danger_filter():
+    return Q(detected_danger=True) | Q(voice_analysis__danger_level='High')
+
+
+def expired_filter(now=None):
+    """Rows past the TTL of their class."""
+    now = now or timezone.now()
+    days = {**DEFAULT_RETENTION_DAYS, **_setting('AUDIO_RETENTION_DAYS', {})}
+    return (
+        (danger_filter() & Q(timestamp__lt=now - timedelta(days=days['danger'])))
+        | (~danger_filter() & Q(timestamp__lt=now - timedelta(days=days['routine'])))
+    )
+
+
+def sweep_expired(batch_size=None, dry_run=False):
+    """Delete expired interactions and their clips, one batch at a time. Returns rows deleted."""
+    batch_size = batch_size or _setting('AUDIO_SWEEP_BATCH_SIZE', DEFAULT_SWEEP_BATCH_SIZE)
+    expired = AIInteraction.objects.filter(expired_filter())
+    if dry_run:
+        return expired.count()
+    deleted = 0
+    while True:
+        batch = list(expired.values_list('pk', 'input_voice_file')[:batch_size])
+        if not batch:
+            return deleted
+        AIInteraction.objects.filter(pk__in=[pk for pk, _ in batch]).delete()  # cascades to VoiceAnalysis
+        names = {name for _, name in batch if name}
+        for name in names - _referenced(names):
+            _remove(name)
+        deleted += len(batch)
+
+
+def transcode(source, target):
+    """Encode `source` into the compact tier at `target`; True on success."""
+    result = subprocess.run(
+        ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y', '-i', source, *COMPACT_ARGS, target],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        logger.warning(f"Compacting {source} failed: {result.stderr.strip()}")
+        if os.path.exists(target):
+            os.remove(target)
+        return False
+    return True
+
+
+def compact_old_clips(batch_size=None, dry_run=False):
+    """Move clips older than AUDIO_COMPACT_AFTER_DAYS to the compact tier. Returns clips compacted."""
+    batch_size = batch_size or _setting('AUDIO_SWEEP_BATCH_SIZE', DEFAULT_SWEEP_BATCH_SIZE)
+    cutoff = timezone.now() - timedelta(days=_setting('AUDIO_COMPACT_AFTER_DAYS', DEFAULT_COMPACT_AFTER_DAYS))
+    pending = (
+        AIInteraction.objects.filter(timestamp__lt=cutoff)
+        .exclude(input_voice_file__isnull=True).exclude(input_voice_file='')
+        .exclude(input_voice_file__endswith=COMPACT_EXTENSION)
+        .order_by('pk')
+    )
+    if dry_run:
+        return pending.count()
+    if not shutil.which('ffmpeg'):
+        logger.warning("ffmpeg not found: skipping audio compaction")
+        return 0
+
+    compacted, last_pk = 0, 0
+    while True:
+        batch = list(pending.filter(pk__gt=last_pk).only('pk', 'input_voice_file')[:batch_size])
+        if not batch:
+            return compacted
+        last_pk = batch[-1].pk
+        # a blob may be shared by several rows: compact it once, repoint them all
+        for name in dict.fromkeys(interaction.input_voice_file.name for interaction in batch):
+            source = blob_path(name)
+            if not os.path.exists(source):
+                AIInteraction.objects.filter(input_voice_file=name).update(input_voice_file='')  # nothing left to keep
+                continue
+            if _in_use(source):
+                continue  # reused just now: compact it on a later pass
+            target = os.path.splitext(source)[0] + COMPACT_EXTENSION
+            if not transcode(source, target):
+                continue
+            # reused while it was transcoding: the new row must keep the original
+            retired = retire_blob(source, _grace_cutoff())
+            if retired is None:
+                os.remove(target)
+                continue
+            try:
+                AIInteraction.objects.filter(input_voice_file=name).update(input_voice_file=os.path.splitext(name)[0] + COMPACT_EXTENSION)
+            except Exception:
+                os.replace(retired, source)
+                raise
+            os.remove(retired)
+            compacted += 1
+
+
+def sweep_orphans(batch_size=None, dry_run=False):
+    """Delete clips no interaction refers to, once older than the routine TTL. Returns files deleted."""
+    batch_size = batch_size or _setting('AUDIO_SWEEP_BATCH_SIZE', DEFAULT_SWEEP_BATCH_SIZE)
+    days = {**DEFAULT_RETENTION_DAYS, **_setting('AUDIO_RETENTION_DAYS', {})}['routine']
+    cutoff = (timezone.now() - timedelta(days=days)).timestamp()
+    root = os.path.join(settings.MEDIA_ROOT, STORE_DIR)
+    if not os.path.isdir(root):
+        return 0
+
+    deleted, batch = 0, []
+
+    def flush():
+        nonlocal deleted
+        names = {os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/'): path for path in batch}
+        referenced = _referenced([*names, *names.values()])
+        for name, path in names.items():
+            if name not in referenced and path not in referenced:
+                if dry_run or _remove(path):
+                    deleted += 1
+        batch.clear()
+
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            try:
+                if os.stat(path).st_mtime >= cutoff:
+                    continue
+            except FileNotFoundError:
+                continue
+            batch.append(path)
+            if len(batch) >= batch_size:
+                flush()
+    if batch:
+        flush()
+    return deleted
+
+
+def run_retention(batch_size=None, dry_run=False, compact=True):
+    """One full pass: expire rows, compact old clips, remove orphans."""
+    return {
+        'expired': sweep_expired(batch_size, dry_run),
+        'compacted': compact_old_clips(batch_size, dry_run) if compact else 0,
+        'orphans': sweep_orphans(batch_size, dry_run),
+    }
@@ -0,0 +1,13 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from contacts.models import TrustedContact, Helpline
+from .recipients import invalidate_contacts, invalidate_helplines
+
+# Drop cached recipient lists whenever a contact or helpline changes
+@receiver([post_save, post_delete], sender=TrustedContact)
+def trusted_contact_changed(sender, instance, **kwargs):
+    invalidate_contacts(instance.user_id)
+
+@receiver([post_save, post_delete], sender=Helpline)
+def helpline_changed(sender, instance, **kwargs):
+    invalidate_helplines()
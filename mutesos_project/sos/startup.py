@@ -0,0 +1,122 @@
+# sos/startup.py
+"""
+Cold-start measurement for a worker process.
+
+Every measurement runs in a fresh interpreter (`python -m sos.startup`), so
+nothing is already imported: it times django.setup(), the URLconf import and
+the first request to each URL, and records which heavy optional
+dependencies got imported along the way. Requests run against a throwaway
+test database, never the real one.
+
+Used by `python manage.py startup_benchmark`. Its `--check` compares
+wall-clock figures against BUDGET, so run it as a CI step of its own on a
+quiet machine; the test suite only covers the budget logic.
+"""
+import os
+import sys
+import json
+import time
+import statistics
+import subprocess
+from pathlib import Path
+
+# Only the voice/alert paths need these; a booting worker must not import them
+HEAVY_MODULES = (
+    'speech_recognition', 'pydub', 'pocketsphinx', 'twilio', 'aiohttp', 'requests', 'numpy', 'h5py',
+)
+
+# Pages served on a cold worker (anonymous: login-protected ones redirect)
+DEFAULT_URLS = ('/', '/user/login/', '/user/register/', '/contacts/', '/sos/emergency/', '/offline/')
+
+# Budget checked by `startup_benchmark --check`
+BUDGET = {
+    'boot_seconds': 2.0,          # django.setup() + URLconf import
+    'first_request_seconds': 1.0,  # slowest first request
+}
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+
+def _heavy_loaded():
+    return sorted({name.split('.')[0] for name in sys.modules} & set(HEAVY_MODULES))
+
+
+def _child(urls):
+    t0 = time.perf_counter()
+    import django
+    django.setup()
+    t1 = time.perf_counter()
+    from django.urls import get_resolver
+    get_resolver().url_patterns
+    t2 = time.perf_counter()
+    heavy_after_boot = _heavy_loaded()
+
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+    client = Client(raise_request_exception=False)
+    requests = {}
+    for url in urls:
+        start = time.perf_counter()
+        response = client.get(url)
+        requests[url] = {'status': response.status_code, 'seconds': round(time.perf_counter() - start, 4)}
+
+    return {
+        'setup_seconds': round(t1 - t0, 4),
+        'urlconf_seconds': round(t2 - t1, 4),
+        'boot_seconds': round(t2 - t0, 4),
+        'heavy_after_boot': heavy_after_boot,
+        'heavy_after_requests': _heavy_loaded(),
+        'requests': requests,
+    }
+
+
+def measure_once(urls=DEFAULT_URLS, settings_module=None):
+    """Measure one cold start in a fresh interpreter."""
+    env = dict(os.environ)
+    env['DJANGO_SETTINGS_MODULE'] = settings_module or env.get('DJANGO_SETTINGS_MODULE', 'mutesos_project.settings')
+    proc = subprocess.run(
+        [sys.executable, '-m', 'sos.startup', *urls],
+        cwd=PROJECT_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def measure(urls=DEFAULT_URLS, repeat=3, settings_module=None):
+    """Median cold-start figures over `repeat` fresh interpreters."""
+    runs = [measure_once(urls, settings_module) for _ in range(repeat)]
+    median = lambda values: round(statistics.median(values), 4)
+    return {
+        'runs': repeat,
+        'setup_seconds': median([r['setup_seconds'] for r in runs]),
+        'urlconf_seconds': median([r['urlconf_seconds'] for r in runs]),
+        'boot_seconds': median([r['boot_seconds'] for r in runs]),
+        'heavy_after_boot': sorted({m for r in runs for m in r['heavy_after_boot']}),
+        'heavy_after_requests': sorted({m for r in runs for m in r['heavy_after_requests']}),
+        'requests': {
+            url: {'status': runs[-1]['requests'][url]['status'], 'seconds': median([r['requests'][url]['seconds'] for r in runs])}
+            for url in urls
+        },
+    }
+
+
+def over_budget(report, budget=BUDGET):
+    """Budget violations in a report, as human-readable strings (empty when within budget)."""
+    problems = []
+    if report['heavy_after_boot']:
+        problems.append(f"heavy modules imported at boot: {', '.join(report['heavy_after_boot'])}")
+    if report['heavy_after_requests']:
+        problems.append(f"heavy modules imported by page requests: {', '.join(report['heavy_after_requests'])}")
+    if report['boot_seconds'] > budget['boot_seconds']:
+        problems.append(f"boot took {report['boot_seconds']}s (budget {budget['boot_seconds']}s)")
+    slowest = max(report['requests'].items(), key=lambda item: item[1]['seconds'], default=None)
+    if slowest and slowest[1]['seconds'] > budget['first_request_seconds']:
+        problems.append(f"first request to {slowest[0]} took {slowest[1]['seconds']}s (budget {budget['first_request_seconds']}s)")
+    return problems
+
+
+if __name__ == '__main__':
+    print(json.dumps(_child(sys.argv[1:] or DEFAULT_URLS)))
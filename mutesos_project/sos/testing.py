@@ -0,0 +1,38 @@
+# sos/testing.py
+"""
+Test helpers shared by the app test suites.
+"""
+from contextlib import contextmanager
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin:
+    """assertMaxQueries: fail when a block runs more queries than its budget (N+1 guard)."""
+
+    @contextmanager
+    def assertMaxQueries(self, budget, using=connection):
+        with CaptureQueriesContext(using) as queries:
+            yield queries
+        if len(queries) > budget:
+            listing = "\n".join(f"{i}. {q['sql']}" for i, q in enumerate(queries, 1))
+            self.fail(f"{len(queries)} queries executed, budget is {budget}:\n{listing}")
+
+    def seed_recipients(self, username, **profile):
+        """
+        Log in a new user (with `profile` fields set) who has five trusted
+        contacts, next to five helplines: enough rows for an N+1 pattern to
+        exceed a budget. Returns the user.
+        """
+        from django.contrib.auth.models import User
+        from contacts.models import Helpline, TrustedContact
+
+        user = User.objects.create_user(username, password="pw")
+        for field, value in profile.items():
+            setattr(user.profile, field, value)
+        user.profile.save()
+        for i in range(5):
+            TrustedContact.objects.create(user=user, name=f"Contact {i}", phone_number=f"+9198765432{i}0", email="c@example.com", relationship="friend")
+            Helpline.objects.create(label=f"Helpline {i}", phone_number=f"10{i}")
+        self.client.force_login(user)
+        return user
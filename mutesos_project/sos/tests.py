@@ -1,3 +1,823 @@
-from django.test import TestCase
+import io
+import atexit
+import asyncio
+import contextvars
+import os
+import json
+import wave
+import time
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import mock, skipUnless
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import StopFutureHandlers
+from django.db import OperationalError, connection, connections, transaction
+from django.conf import settings
+from asgiref.sync import async_to_sync
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.crypto import get_random_string
 
-# Create your tests here.
+from ai_module.models import AIInteraction, VoiceAnalysis
+from ai_module.voice import VoiceResult
+from contacts.models import TrustedContact
+from .audio import AUDIO_FIELD, StreamingAudioUploadHandler, discard_upload
+from .audio_store import blob_path, retire_blob
+from .callbacks import StatusBuffer
+from .incidents import open_incident, parse_event_time, trigger_incident, NEW, REPLAY, COALESCED, LOCATION_UPDATE
+from .management.commands._latency import SCENARIOS, regressions, run_benchmark
+from .metrics import STAGE_SECONDS, begin_request, end_request, record_stage, stage
+from .models import AlertDelivery, AlertOutbox, SosAlert
+from . import outbox
+from .outbox import enqueue_alerts, process_outbox
+from .retention import compact_old_clips, run_retention
+from .startup import over_budget
+from . import views
+from .testing import QueryBudgetMixin
+from .transport import FakeTransport, set_transport
+from .utils import aalert_recipients, alert_recipients, save_uploaded_audio, send_sos_alert
+
+
+def make_wav(seconds, rate=16000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(b"\x00\x10" * int(seconds * rate))
+    return buffer.getvalue()
+
+
+class FakeTransportDispatchTests(TestCase):
+    def setUp(self):
+        self.transport = FakeTransport()
+        set_transport(self.transport)
+        self.addCleanup(set_transport, None)
+
+    def test_sends_sms_and_call_to_every_recipient(self):
+        result = send_sos_alert(["9876543210", "+919812345678"], message="help")
+
+        self.assertTrue(result["ok"])
+        self.assertEqual([t["to"] for t in result["targets"]], ["+919876543210", "+919812345678"])
+        self.assertEqual(len(self.transport.sent), 4)
+        self.assertEqual({s["channel"] for s in self.transport.sent}, {"sms", "call"})
+
+    def test_provider_failure_is_reported_per_channel(self):
+        self.transport.fail_numbers = {"+919876543210"}
+        result = send_sos_alert("9876543210", message="help")
+
+        self.assertFalse(result["ok"])
+        self.assertEqual({k for e in result["errors"] for k in e if k != "to"}, {"sms_error", "call_error"})
+
+
+class AlertOutboxTests(TestCase):
+    def setUp(self):
+        self.transport = FakeTransport()
+        set_transport(self.transport)
+        self.addCleanup(set_transport, None)
+        self.user = User.objects.create_user("alice", password="pw")
+
+    def test_queued_alerts_are_delivered_by_worker(self):
+        self.assertEqual(enqueue_alerts(self.user, ["+919876543210", "+919812345678"], "help"), 2)
+        self.assertEqual(self.transport.sent, [])
+
+        self.assertEqual(process_outbox(), 2)
+
+        self.assertEqual(AlertOutbox.objects.filter(status=AlertOutbox.STATUS_SENT).count(), 2)
+        self.assertEqual(len(self.transport.sent), 4)
+
+    def test_failed_alert_is_retried_with_backoff(self):
+        enqueue_alerts(self.user, ["+919876543210"], "help")
+        self.transport.fail_numbers = {"+919876543210"}
+        process_outbox()
+
+        row = AlertOutbox.objects.get()
+        self.assertEqual((row.status, row.attempts), (AlertOutbox.STATUS_PENDING, 1))
+        self.assertGreater(row.next_attempt_at, timezone.now())
+
+        self.transport.fail_numbers = set()
+        AlertOutbox.objects.update(next_attempt_at=timezone.now())
+        process_outbox()
+        row.refresh_from_db()
+        self.assertEqual((row.status, row.attempts), (AlertOutbox.STATUS_SENT, 2))
+
+
+class AlertDeliveryTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.transport = FakeTransport()
+        set_transport(self.transport)
+        self.addCleanup(set_transport, None)
+        self.user = User.objects.create_user("dave", password="pw")
+        self.incident, _ = open_incident(self.user, "tap")
+
+    def test_outbox_deliveries_are_written_and_updated_in_bulk(self):
+        numbers = ["+919876543210", "+919812345678", "+919800000000"]
+        self.transport.fail_numbers = {"+919800000000"}
+        with self.assertMaxQueries(2):  # outbox INSERT + delivery INSERT, in the caller's transaction
+            enqueue_alerts(self.user, numbers, "help", incident=self.incident)
+        self.assertEqual(set(AlertDelivery.objects.values_list("status", flat=True)), {AlertDelivery.STATUS_PENDING})
+
+        process_outbox()
+
+        deliveries = {(d.to_number, d.channel): d for d in self.incident.deliveries.all()}
+        self.assertEqual(len(deliveries), 6)
+        sms = deliveries[("+919876543210", "sms")]
+        self.assertEqual((sms.status, sms.attempts), ("queued", 1))
+        self.assertIn(sms.provider_sid, {s["sid"] for s in self.transport.sent})
+        self.assertIsNotNone(sms.latency_ms)
+        failed = deliveries[("+919800000000", "call")]
+        self.assertEqual((failed.status, failed.provider_sid), (AlertDelivery.STATUS_RETRYING, ""))
+        self.assertIn("rejected", failed.error)
+
+    @override_settings(SOS_USE_OUTBOX=False)
+    def test_inline_fan_out_records_every_target(self):
+        with self.assertMaxQueries(4) as queries:  # claimed outbox + delivery INSERTs, one bulk UPDATE each
+            alert_recipients(self.user, ["9876543210", "+919812345678"], "help", incident=self.incident)
+
+        self.assertEqual(sum(q["sql"].startswith("INSERT") for q in queries), 2)
+        self.assertEqual(set(AlertOutbox.objects.values_list("status", "claim_token")), {(AlertOutbox.STATUS_SENT, "")})
+        self.assertEqual(
+            sorted(self.incident.deliveries.values_list("to_number", "channel", "status")),
+            [("+919812345678", "call", "queued"), ("+919812345678", "sms", "queued"),
+             ("+919876543210", "call", "queued"), ("+919876543210", "sms", "queued")],
+        )
+
+    @override_settings(SOS_USE_OUTBOX=False)
+    def test_inline_incident_is_opened_together_with_its_deliveries(self):
+        user = User.objects.create_user("dora", password="pw")
+        with mock.patch("sos.incidents.claim_alerts", side_effect=OperationalError("database is locked")):
+            with self.assertRaises(OperationalError):
+                trigger_incident(user, "tap", ["+919876543210"], "help")
+        self.assertFalse(SosAlert.objects.filter(user=user).exists())
+
+        incident, outcome, queued, claimed = trigger_incident(user, "tap", ["+919876543210"], "help")
+        self.assertEqual((outcome, queued), (NEW, None))
+        self.assertEqual(AlertOutbox.objects.get(user=user).status, AlertOutbox.STATUS_CLAIMED)
+        self.assertEqual(set(incident.deliveries.values_list("channel", "status")), {("sms", "pending"), ("call", "pending")})
+        alert_recipients(user, ["+919876543210"], "help", incident=incident, claimed=claimed)
+        self.assertEqual(set(incident.deliveries.values_list("channel", "status")), {("sms", "queued"), ("call", "queued")})
+
+    @override_settings(SOS_USE_OUTBOX=False)
+    def test_failed_inline_sends_are_left_for_the_worker(self):
+        self.transport.fail_numbers = {"+919800000000"}
+        results = alert_recipients(self.user, ["+919876543210", "+919800000000"], "help", incident=self.incident)
+
+        self.assertEqual(results["queued"], 1)
+        self.assertEqual(len(self.transport.sent), 2)
+        row = AlertOutbox.objects.get(status=AlertOutbox.STATUS_PENDING)
+        self.assertEqual((row.to_number, row.attempts, row.claim_token), ("+919800000000", 1, ""))
+
+        self.transport.fail_numbers = set()
+        AlertOutbox.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(process_outbox(), 1)
+        self.assertEqual([s["to"] for s in self.transport.sent[2:]], ["+919800000000", "+919800000000"])
+        self.assertEqual(set(self.incident.deliveries.values_list("status", flat=True)), {"queued"})
+
+    @override_settings(SOS_USE_OUTBOX=False)
+    def test_trigger_says_queued_when_sends_are_left_for_the_worker(self):
+        self.client.force_login(self.user)
+        TrustedContact.objects.create(user=self.user, name="Sam", phone_number="+919800000000", email="s@example.com", relationship="friend")
+        self.transport.fail_numbers = {"+919800000000"}
+        SosAlert.objects.all().delete()
+
+        response = self.client.post("/sos/emergency/", {"trigger_button": "1", "idempotency_key": "q1"}, follow=True)
+        self.assertIn("SOS queued for 1 recipient(s)", [str(m) for m in response.context["messages"]][0])
+
+    def test_admin_pages_by_key_without_counting(self):
+        AlertDelivery.objects.bulk_create(
+            AlertDelivery(incident=self.incident, to_number=f"+9198{i:08d}", channel="sms") for i in range(120)
+        )
+        self.client.force_login(User.objects.create_superuser("root", password="pw"))
+
+        with CaptureQueriesContext(connection) as queries:
+            first = self.client.get("/admin/sos/alertdelivery/")
+        self.assertEqual(len(first.context["cl"].result_list), 100)
+        self.assertFalse([q for q in queries if "COUNT(" in q["sql"]])
+
+        older = self.client.get("/admin/sos/alertdelivery/" + first.context["cl"].next_page_url)
+        self.assertEqual(len(older.context["cl"].result_list), 20)
+        self.assertIsNone(older.context["cl"].next_page_url)
+        self.assertEqual(older.context["cl"].result_list[0].pk, first.context["cl"].result_list[-1].pk - 1)
+
+
+class GatedTransport(FakeTransport):
+    """FakeTransport whose SMS to `held` numbers block until `gate` is set (async ones never finish)."""
+
+    def __init__(self, held=()):
+        super().__init__()
+        self.held = set(held)
+        self.gate = threading.Event()
+
+    def send_sms(self, to, body):
+        if to in self.held:
+            self.gate.wait(5)
+        return super().send_sms(to, body)
+
+    async def asend_sms(self, to, body):
+        if to in self.held:
+            await asyncio.sleep(5)
+        return await super().asend_sms(to, body)
+
+
+@override_settings(SOS_USE_OUTBOX=False, SOS_DISPATCH_DEADLINE=0.2)
+class DispatchDeadlineTests(TransactionTestCase):
+    """The late send is recorded from a dispatch thread, so the rows must be committed."""
+
+    def setUp(self):
+        self.transport = GatedTransport(held={"+919800000000"})
+        set_transport(self.transport)
+        self.addCleanup(set_transport, None)
+        self.addCleanup(self.transport.gate.set)
+        self.user = User.objects.create_user("gina", password="pw")
+        self.incident, _ = open_incident(self.user, "tap")
+
+    def test_send_in_flight_at_the_deadline_is_recorded_not_retried(self):
+        results = alert_recipients(self.user, ["+919876543210", "+919800000000"], "help", incident=self.incident)
+
+        self.assertEqual(results["queued"], 1)
+        row = AlertOutbox.objects.get(to_number="+919800000000")
+        self.assertEqual((row.status, row.channels), (AlertOutbox.STATUS_CLAIMED, "sms"))
+        self.assertEqual(AlertDelivery.objects.get(outbox=row, channel="sms").status, AlertDelivery.STATUS_PENDING)
+        self.assertEqual(process_outbox(), 0)
+
+        recorded = threading.Event()
+        settle_late = outbox.settle_late
+        with mock.patch("sos.outbox.settle_late", side_effect=lambda *args: (settle_late(*args), recorded.set())):
+            self.transport.gate.set()
+            self.assertTrue(recorded.wait(5))
+
+        row.refresh_from_db()
+        self.assertEqual((row.status, row.claim_token, row.attempts), (AlertOutbox.STATUS_SENT, "", 1))
+        self.assertEqual(set(self.incident.deliveries.values_list("status", flat=True)), {"queued"})
+        self.assertEqual(sorted((s["to"], s["channel"]) for s in self.transport.sent), [
+            ("+919800000000", "call"), ("+919800000000", "sms"), ("+919876543210", "call"), ("+919876543210", "sms"),
+        ])
+
+
+@override_settings(SOS_USE_OUTBOX=False)
+class AsyncAlertTests(TestCase):
+    def setUp(self):
+        self.transport = GatedTransport(held={"+919800000000"})
+        set_transport(self.transport)
+        self.addCleanup(set_transport, None)
+        self.user = User.objects.create_user("hana", password="pw")
+        self.incident, _ = open_incident(self.user, "tap")
+
+    def test_async_fan_out_records_every_target(self):
+        results = async_to_sync(aalert_recipients)(self.user, ["9876543210", "+919812345678"], "help", incident=self.incident)
+
+        self.assertEqual((results["ok"], results["queued"]), (True, 0))
+        self.assertEqual(len(self.transport.sent), 4)
+        self.assertEqual(set(AlertOutbox.objects.values_list("status", "claim_token")), {(AlertOutbox.STATUS_SENT, "")})
+        self.assertEqual(set(self.incident.deliveries.values_list("status", flat=True)), {"queued"})
+
+    def test_only_sends_that_never_started_are_retried_after_the_deadline(self):
+        # one slot: the held SMS takes it, the other never starts
+        with self.settings(SOS_DISPATCH_DEADLINE=0.2, SOS_DISPATCH_MAX_WORKERS=1):
+            results = async_to_sync(aalert_recipients)(
+                self.user, ["+919800000000", "+919876543210"], "help", channels=("sms",), incident=self.incident
+            )
+
+        self.assertEqual(results["queued"], 2)
+        rows = {row.to_number: row for row in AlertOutbox.objects.all()}
+        self.assertEqual(rows["+919800000000"].status, AlertOutbox.STATUS_CLAIMED)
+        self.assertEqual((rows["+919876543210"].status, rows["+919876543210"].last_error), (AlertOutbox.STATUS_PENDING, "deadline_exceeded"))
+
+        AlertOutbox.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(process_outbox(), 1)
+        self.assertEqual([s["to"] for s in self.transport.sent], ["+919876543210"])
+
+
+@override_settings(SOS_USE_OUTBOX=False)
+class StatusCallbackTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.transport = FakeTransport()
+        set_transport(self.transport)
+        self.addCleanup(set_transport, None)
+        self.user = User.objects.create_user("erin", password="pw")
+        self.incident, _ = open_incident(self.user, "tap")
+        # buffered, but only flushed by the test
+        self.buffer = StatusBuffer(flush_interval=3600, max_batch=1000)
+        patcher = mock.patch("sos.callbacks._buffer", self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(atexit.unregister, self.buffer.flush)
+
+    def test_burst_of_callbacks_is_applied_in_one_bulk_update(self):
+        alert_recipients(self.user, [f"+9198{i:08d}" for i in range(50)], "help", incident=self.incident)
+        callbacks = self.transport.status_callbacks()
+        late = self.transport.status_callbacks(sms_status="sent", call_status="ringing")  # out of order
+        with self.assertMaxQueries(0):
+            for data in callbacks + late:
+                self.assertEqual(self.client.post("/sos/status/", data).status_code, 204)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.buffer.flush(), 100)
+
+        self.assertEqual(sum(q["sql"].startswith("UPDATE") for q in queries), 1)
+        self.assertLessEqual(len(queries), 4)
+        self.assertEqual(dict(self.incident.deliveries.values_list("channel", "status").distinct()), {"sms": "delivered", "call": "completed"})
+
+    def test_update_waits_for_a_delivery_recorded_after_the_callback(self):
+        self.client.post("/sos/status/", {"MessageSid": "SM1", "MessageStatus": "undelivered", "ErrorCode": "30003"})
+        self.assertEqual(self.buffer.flush(), 0)
+
+        delivery = AlertDelivery.objects.create(incident=self.incident, to_number="+919876543210", channel="sms", provider_sid="SM1", status="queued")
+        self.assertEqual(self.buffer.flush(), 1)
+        delivery.refresh_from_db()
+        self.assertEqual((delivery.status, delivery.error), ("undelivered", "30003"))
+
+    @override_settings(TWILIO_AUTH_TOKEN="secret", SOS_STATUS_CALLBACK_URL="https://example.com/sos/status/")
+    def test_unsigned_callbacks_are_rejected(self):
+        from twilio.request_validator import RequestValidator
+
+        data = {"CallSid": "CA1", "CallStatus": "completed"}
+        self.assertEqual(self.client.post("/sos/status/", data).status_code, 403)
+        signature = RequestValidator("secret").compute_signature("https://example.com/sos/status/", data)
+        self.assertEqual(self.client.post("/sos/status/", data, HTTP_X_TWILIO_SIGNATURE=signature).status_code, 204)
+
+
+@override_settings(SOS_USE_OUTBOX=False, SERVER_TIMING=True, METRICS_TOKEN="scrape")
+class StageTimingTests(TestCase):
+    def setUp(self):
+        set_transport(FakeTransport())
+        self.addCleanup(set_transport, None)
+        self.addCleanup(STAGE_SECONDS.clear)
+        self.user = User.objects.create_user("frank", password="pw")
+        for i in range(3):
+            TrustedContact.objects.create(user=self.user, name=f"Contact {i}", phone_number=f"+9198765432{i}0", email="c@example.com", relationship="friend")
+        self.client.force_login(self.user)
+
+    def test_trigger_is_broken_down_in_server_timing_and_metrics(self):
+        response = self.client.post("/sos/emergency/", {"trigger_button": "1", "idempotency_key": "t1"})
+
+        timing = dict(entry.split(";", 1) for entry in response["Server-Timing"].split(", "))
+        self.assertLessEqual({"recipients", "incident", "dispatch", "record", "sms", "call", "total"}, set(timing))
+        self.assertRegex(timing["sms"], r'^dur=[\d.]+;desc="longest of \d+"$')
+
+        metrics = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer scrape")
+        self.assertEqual(metrics["Content-Type"], "text/plain; version=0.0.4; charset=utf-8")
+        body = metrics.content.decode()
+        self.assertIn('mutesos_stage_seconds_bucket{stage="sms",le="+Inf"}', body)
+        self.assertIn('mutesos_stage_seconds_count{stage="call"}', body)
+        self.assertIn('mutesos_request_seconds_count{view="sos:emergency_trigger"} 1', body)
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+
+    @override_settings(SERVER_TIMING=False, METRICS_TOKEN=None)
+    def test_breakdown_is_not_public_by_default(self):
+        response = self.client.post("/sos/emergency/", {"trigger_button": "1", "idempotency_key": "t2"})
+        self.assertNotIn("Server-Timing", response)
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
+        with self.settings(DEBUG=True):
+            self.assertEqual(self.client.get("/metrics").status_code, 200)
+
+    def test_stages_recorded_from_dispatch_threads_all_count(self):
+        def record_many():
+            for _ in range(2000):
+                record_stage("sms", 0.001)
+
+        token = begin_request()
+        threads = [threading.Thread(target=contextvars.copy_context().run, args=(record_many,)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(end_request(token)["sms"][0], 16000)
+
+    def test_stage_overhead_is_negligible(self):
+        rounds = 20000
+        started = time.perf_counter()
+        for _ in range(rounds):
+            with stage("noop"):
+                pass
+        self.assertLess((time.perf_counter() - started) / rounds, 50e-6)
+
+
+class SqliteConcurrencyTests(SimpleTestCase):
+    """Several connections on one database file, as the web workers and deliver_alerts have."""
+    alias = "concurrency"
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # a file database with the production OPTIONS, not the shared-memory test
+        # database; registered after setup so the runner does not create it
+        cls.tmp = tempfile.mkdtemp()
+        connections.settings[cls.alias] = {**connections.settings["default"], "NAME": os.path.join(cls.tmp, "db.sqlite3")}
+        cls.databases = {*cls.databases, cls.alias}
+
+    @classmethod
+    def tearDownClass(cls):
+        del connections.settings[cls.alias]
+        shutil.rmtree(cls.tmp)
+        super().tearDownClass()
+
+    def run_on_own_connection(self, work, errors):
+        try:
+            work(connections[self.alias].cursor())
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connections[self.alias].close()
+
+    def test_parallel_readers_and_writers_never_hit_a_lock(self):
+        writers, readers, rounds = 4, 4, 40
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute("CREATE TABLE log (id INTEGER PRIMARY KEY, writer INTEGER, seen INTEGER)")
+            cursor.execute("PRAGMA journal_mode")
+            self.assertEqual(cursor.fetchone()[0], "wal")
+        connections[self.alias].close()
+
+        def write(cursor, writer):
+            for _ in range(rounds):
+                # read, then write: a deferred transaction would fail to upgrade its lock
+                with transaction.atomic(using=self.alias):
+                    cursor.execute("SELECT COUNT(*) FROM log")
+                    seen = cursor.fetchone()[0]
+                    time.sleep(0.001)
+                    cursor.execute("INSERT INTO log (writer, seen) VALUES (%s, %s)", [writer, seen])
+
+        def read(cursor):
+            for _ in range(rounds * 2):
+                cursor.execute("SELECT COUNT(*), MAX(seen) FROM log")
+                cursor.fetchone()
+
+        errors = []
+        threads = [threading.Thread(target=self.run_on_own_connection, args=(lambda c, w=w: write(c, w), errors)) for w in range(writers)]
+        threads += [threading.Thread(target=self.run_on_own_connection, args=(read, errors)) for _ in range(readers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute("SELECT COUNT(*), COUNT(DISTINCT seen) FROM log")
+            self.assertEqual(cursor.fetchone(), (writers * rounds, writers * rounds))  # writes were serialized, none lost
+        connections[self.alias].close()
+
+
+class IncidentCoalescingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("carol", password="pw")
+
+    def test_repeat_triggers_fold_into_one_incident(self):
+        incident, outcome = open_incident(self.user, "tap", "key-1", 12.9, 77.5)
+        self.assertEqual(outcome, NEW)
+
+        self.assertEqual(open_incident(self.user, "tap", "key-1", 12.9, 77.5), (incident, REPLAY))
+        self.assertEqual(open_incident(self.user, "tap", None, 12.9, 77.5), (incident, COALESCED))
+        self.assertEqual(open_incident(self.user, "voice", None, 13.0, 77.5), (incident, LOCATION_UPDATE))
+        self.assertEqual(SosAlert.objects.count(), 1)
+
+    def test_trigger_after_window_opens_new_incident(self):
+        first, _ = open_incident(self.user, "tap")
+        SosAlert.objects.update(last_triggered_at=timezone.now() - timedelta(hours=1))
+
+        second, outcome = open_incident(self.user, "tap")
+        self.assertEqual(outcome, NEW)
+        self.assertNotEqual(first.pk, second.pk)
+
+    def test_replays_do_not_count_and_repeats_do_not_extend_the_window(self):
+        incident, _ = open_incident(self.user, "tap", "key-1")
+        open_incident(self.user, "tap", "key-1")
+        incident.refresh_from_db()
+        self.assertEqual(incident.trigger_count, 1)
+
+        # kept repeating, but the incident itself is older than the window
+        SosAlert.objects.update(timestamp=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(open_incident(self.user, "tap")[1], NEW)
+
+    @override_settings(SOS_USE_OUTBOX=True)
+    def test_failed_enqueue_rolls_back_the_incident(self):
+        numbers = ["+919876543210", "+919812345678"]
+        with mock.patch("sos.incidents.enqueue_alerts", side_effect=OperationalError("database is locked")):
+            with self.assertRaises(OperationalError):
+                trigger_incident(self.user, "tap", numbers, "help")
+        self.assertFalse(SosAlert.objects.exists())
+
+        incident, outcome, queued, _ = trigger_incident(self.user, "tap", numbers, "help")
+        self.assertEqual((outcome, queued), (NEW, 2))
+        self.assertEqual(AlertOutbox.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(incident.deliveries.count(), 4)
+
+
+class OfflineReplayTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("carol", password="pw")
+        self.user.profile.secret_passphrase = "bluebird"
+        self.user.profile.save()
+        self.client.force_login(self.user)
+
+    def replay(self, events):
+        return self.client.post("/sos/replay/", json.dumps({"events": events}), content_type="application/json").json()
+
+    def test_queued_triggers_raise_one_sos_for_the_latest(self):
+        now_ms = time.time() * 1000
+        data = self.replay([
+            {"idempotency_key": "a", "method": "tap", "timestamp": now_ms - 60000},
+            {"idempotency_key": "b", "method": "passphrase", "passphrase": "bluebird", "timestamp": now_ms - 5000, "latitude": 12.9, "longitude": 77.6},
+            {"idempotency_key": "c", "method": "passphrase", "passphrase": "wrong", "timestamp": now_ms},
+            {"idempotency_key": "d", "method": "tap", "timestamp": "2020-01-01T10:00:00Z"},
+        ])
+
+        self.assertEqual((data["accepted"], data["rejected"], data["expired"]), (["a", "b"], ["c"], ["d"]))
+        self.assertEqual(data["results"]["outcome"], NEW)
+        incident = SosAlert.objects.get(user=self.user)
+        self.assertEqual((incident.idempotency_key, incident.method, incident.latitude), ("b", "passphrase", 12.9))
+
+    def test_passphrase_trigger_is_authenticated_by_the_session(self):
+        data = self.replay([{"idempotency_key": "p", "method": "passphrase", "timestamp": time.time() * 1000}])
+
+        self.assertEqual(data["accepted"], ["p"])
+        self.assertEqual(SosAlert.objects.get(user=self.user).method, "passphrase")
+
+        self.user.profile.secret_passphrase = ""
+        self.user.profile.save()
+        self.assertEqual(self.replay([{"idempotency_key": "q", "method": "passphrase"}])["rejected"], ["q"])
+
+    def test_unusable_timestamps_fall_back_to_now(self):
+        now = timezone.now()
+        for value in (1e20, -1e18, float("nan"), float("inf"), True, "2026-13-45T00:00:00", "soon", None):
+            with self.subTest(value=value):
+                self.assertEqual(parse_event_time(value, now), now)
+        self.assertEqual(parse_event_time(now.timestamp() * 1000 - 5000, now), now - timedelta(seconds=5))
+
+        data = self.replay([{"idempotency_key": "a", "timestamp": 1e20}, {"idempotency_key": "b", "timestamp": "2026-13-45T00:00:00"}])
+        self.assertEqual(data["accepted"], ["a", "b"])
+        self.assertEqual(data["results"]["outcome"], NEW)
+
+    def test_already_delivered_keys_are_skipped(self):
+        open_incident(self.user, "tap", "sent-online")
+
+        data = self.replay([{"idempotency_key": "sent-online"}, {"idempotency_key": "sent-online"}])
+
+        self.assertEqual(data["duplicates"], ["sent-online", "sent-online"])
+        self.assertIsNone(data["results"])
+        self.assertEqual(SosAlert.objects.count(), 1)
+
+
+class RetentionTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        media_settings = override_settings(MEDIA_ROOT=self.media)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        os.makedirs(os.path.join(self.media, "sos_audio"))
+        self.user = User.objects.create_user("carol", password="pw")
+
+    def clip(self, name, days_old, **fields):
+        path = os.path.join(self.media, "sos_audio", name)
+        with open(path, "wb") as f:
+            f.write(b"RIFF")
+        then = time.time() - days_old * 86400
+        os.utime(path, (then, then))
+        interaction = AIInteraction.objects.create(user=self.user, input_voice_file=path, **fields)
+        AIInteraction.objects.filter(pk=interaction.pk).update(timestamp=timezone.now() - timedelta(days=days_old))
+        return interaction, path
+
+    def test_expired_rows_go_with_their_clips_and_danger_is_kept_longer(self):
+        _, old_routine = self.clip("a.wav", 40)
+        _, old_danger = self.clip("b.wav", 40, detected_danger=True)
+        distressed, _ = self.clip("c.wav", 40)
+        VoiceAnalysis.objects.create(interaction=distressed, danger_level="High")
+        _, recent = self.clip("d.wav", 1)
+        orphan = os.path.join(self.media, "sos_audio", "orphan.wav")
+        open(orphan, "wb").close()
+        os.utime(orphan, (0, 0))
+
+        report = run_retention(batch_size=1, compact=False)
+
+        self.assertEqual((report["expired"], report["orphans"]), (1, 1))
+        self.assertEqual(AIInteraction.objects.count(), 3)
+        self.assertFalse(os.path.exists(old_routine) or os.path.exists(orphan))
+        self.assertTrue(all(os.path.exists(p) for p in (old_danger, recent)))
+
+    def test_blob_reused_by_an_upload_outlives_a_concurrent_sweep(self):
+        name = save_uploaded_audio(SimpleUploadedFile("clip.wav", make_wav(0.5)))
+        then = time.time() - 40 * 86400
+        os.utime(blob_path(name), (then, then))
+        old = AIInteraction.objects.create(user=self.user, input_voice_file=name)
+        AIInteraction.objects.filter(pk=old.pk).update(timestamp=timezone.now() - timedelta(days=40))
+
+        # the same clip arrives again; its row is not written yet when the sweep runs
+        self.assertEqual(save_uploaded_audio(SimpleUploadedFile("clip.wav", make_wav(0.5))), name)
+        self.assertEqual(run_retention(compact=False), {"expired": 1, "compacted": 0, "orphans": 0})
+        self.assertTrue(os.path.exists(blob_path(name)))
+        self.assertGreater(os.stat(blob_path(name)).st_mtime, time.time() - 60)
+
+    def test_clip_reused_while_compacting_keeps_its_blob(self):
+        name = save_uploaded_audio(SimpleUploadedFile("clip.wav", make_wav(0.5)))
+        then = time.time() - 5 * 86400
+        os.utime(blob_path(name), (then, then))
+        old = AIInteraction.objects.create(user=self.user, input_voice_file=name)
+        AIInteraction.objects.filter(pk=old.pk).update(timestamp=timezone.now() - timedelta(days=5))
+
+        def transcode(source, target):
+            open(target, "wb").close()
+            # the same clip arrives mid-transcode; its row is not written yet
+            save_uploaded_audio(SimpleUploadedFile("clip.wav", make_wav(0.5)))
+            return True
+
+        with mock.patch("sos.retention.shutil.which", return_value="ffmpeg"), mock.patch("sos.retention.transcode", side_effect=transcode):
+            self.assertEqual(compact_old_clips(), 0)
+
+        old.refresh_from_db()
+        self.assertEqual(old.input_voice_file.name, name)
+        self.assertTrue(os.path.exists(blob_path(name)))
+        self.assertFalse(os.path.exists(os.path.splitext(blob_path(name))[0] + ".ogg"))
+
+    def test_blob_reused_between_the_check_and_the_move_is_put_back(self):
+        name = save_uploaded_audio(SimpleUploadedFile("clip.wav", make_wav(0.5)))
+        then = time.time() - 5 * 86400
+        os.utime(blob_path(name), (then, then))
+        rename = os.rename
+
+        def reuse_then_rename(source, target):
+            save_uploaded_audio(SimpleUploadedFile("clip.wav", make_wav(0.5)))
+            rename(source, target)
+
+        with mock.patch("sos.audio_store.os.rename", side_effect=reuse_then_rename):
+            self.assertIsNone(retire_blob(blob_path(name), time.time() - 60))
+        self.assertTrue(os.path.exists(blob_path(name)))
+        self.assertEqual(len(os.listdir(os.path.dirname(blob_path(name)))), 1)
+
+        retired = retire_blob(blob_path(name), time.time() + 60)
+        self.assertFalse(os.path.exists(blob_path(name)))
+        self.assertTrue(os.path.exists(retired))
+
+    def test_identical_uploads_share_one_sharded_blob(self):
+        names = [save_uploaded_audio(SimpleUploadedFile("retry.WAV", make_wav(0.5))) for _ in range(2)]
+
+        self.assertEqual(names[0], names[1])
+        digest = os.path.basename(names[0]).split(".")[0]
+        self.assertEqual(names[0], f"sos_audio/{digest[:2]}/{digest[2:4]}/{digest}.wav")
+        self.assertEqual(os.listdir(os.path.join(self.media, "sos_audio", "tmp")), [])
+
+        # expiring one of the rows keeps the blob the other still links to
+        old, kept = (AIInteraction.objects.create(user=self.user, input_voice_file=name) for name in names)
+        AIInteraction.objects.filter(pk=old.pk).update(timestamp=timezone.now() - timedelta(days=40))
+        self.assertEqual(run_retention(compact=False)["expired"], 1)
+        self.assertTrue(os.path.exists(blob_path(kept.input_voice_file.name)))
+
+    @skipUnless(shutil.which("ffmpeg"), "ffmpeg not installed")
+    def test_old_clips_move_to_the_compact_tier(self):
+        interaction, path = self.clip("e.wav", 5)
+        with open(path, "wb") as f:
+            f.write(make_wav(1.0))
+
+        self.assertEqual(compact_old_clips(), 1)
+
+        interaction.refresh_from_db()
+        self.assertTrue(interaction.input_voice_file.name.endswith(".ogg"))
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.exists(interaction.input_voice_file.name))
+
+
+class VoiceUploadTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        media_settings = override_settings(MEDIA_ROOT=self.media)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.client = Client(enforce_csrf_checks=True)
+        self.client.force_login(User.objects.create_user("gina", password="pw"))
+
+    def upload(self, clip):
+        return self.client.post("/sos/voice_trigger/", {"audio": SimpleUploadedFile("clip.wav", clip)})
+
+    def stored(self):
+        return sorted(name for _, _, names in os.walk(os.path.join(self.media, "sos_audio")) for name in names)
+
+    def test_upload_failing_the_csrf_check_is_not_kept(self):
+        self.assertEqual(self.upload(make_wav(0.5)).status_code, 403)  # no CSRF cookie: rejected before storing
+        self.assertEqual(self.stored(), [])
+
+        self.client.cookies[settings.CSRF_COOKIE_NAME] = get_random_string(32)
+        self.assertEqual(self.upload(make_wav(0.5)).status_code, 403)  # stored while parsing, then removed
+        self.assertEqual(self.stored(), [])
+
+        # a blob that was already stored for someone else stays
+        kept = save_uploaded_audio(SimpleUploadedFile("clip.wav", make_wav(0.5)))
+        self.assertEqual(self.upload(make_wav(0.5)).status_code, 403)
+        self.assertEqual(self.stored(), [os.path.basename(kept)])
+
+    def stream(self, clip):
+        handler = StreamingAudioUploadHandler(mock.Mock(path="/sos/voice_trigger/"))
+        with self.assertRaises(StopFutureHandlers):
+            handler.new_file(AUDIO_FIELD, "clip.wav", "audio/wav", len(clip))
+        handler.receive_data_chunk(clip, 0)
+        return handler.file_complete(len(clip))
+
+    def test_discarded_upload_keeps_a_blob_another_upload_reused(self):
+        audio_file = self.stream(make_wav(0.5))
+        time.sleep(0.01)
+        # an identical upload reuses the blob before its row is written
+        self.assertEqual(save_uploaded_audio(SimpleUploadedFile("clip.wav", make_wav(0.5))), audio_file.stored_name)
+        discard_upload(audio_file)
+        self.assertTrue(os.path.exists(audio_file.saved_path))
+
+        AIInteraction.objects.create(user=User.objects.get(username="gina"), input_voice_file=audio_file.stored_name)
+        discard_upload(self.stream(make_wav(0.5)))
+        self.assertTrue(os.path.exists(audio_file.saved_path))
+
+
+@override_settings(SOS_USE_OUTBOX=True)
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.user = self.seed_recipients("carol", secret_passphrase="bluebird", voice_keyword="help me")
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        media_settings = override_settings(MEDIA_ROOT=self.media)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def test_views_stay_within_query_budget(self):
+        replay = json.dumps({"events": [{"idempotency_key": f"r{i}"} for i in range(5)]})
+        cases = [
+            ("get", "/sos/emergency/", {}, 5),
+            ("post", "/sos/emergency/", {"trigger_button": "1", "idempotency_key": "a"}, 12),
+            ("post", "/sos/emergency/", {"passphrase": "bluebird", "idempotency_key": "b"}, 9),
+            ("post", "/sos/replay/", replay, 9),
+            ("post", "/sos/voice_trigger/", {}, 2),
+        ]
+        for method, url, data, budget in cases:
+            with self.subTest(method=method, url=url), self.assertMaxQueries(budget):
+                if isinstance(data, str):
+                    response = self.client.post(url, data, content_type="application/json")
+                else:
+                    response = getattr(self.client, method)(url, data)
+                self.assertEqual(response.status_code, 200)
+
+    def test_voice_clip_stays_within_query_budget(self):
+        # the real upload, storage and trigger path; only recognition is stubbed
+        heard = VoiceResult("help me", True, "help me", 1.0, engine="kws")
+        with mock.patch.object(views, "analyze_clip", return_value=heard):
+            cases = [
+                ({"idempotency_key": "v1"}, 16),  # new incident: its outbox and delivery rows, the interaction and its analysis
+                ({"idempotency_key": "v1"}, 10),  # replayed clip: recipients cached, nothing queued
+            ]
+            for data, budget in cases:
+                with self.subTest(data=data), self.assertMaxQueries(budget):
+                    audio = SimpleUploadedFile("clip.wav", make_wav(0.5), content_type="audio/wav")
+                    response = self.client.post("/sos/voice_trigger/", {"audio": audio, **data})
+                    self.assertEqual(response.status_code, 200)
+                    self.assertTrue(response.json()["status"].startswith("✅"), response.json())
+
+
+class LatencyBenchmarkTests(TestCase):
+    def test_every_scenario_reaches_all_recipients_and_is_compared_to_baseline(self):
+        report = run_benchmark(users=3, contacts=2, helplines=1, provider_latency=0.01, recognition_latency=0, outbox=True)
+
+        self.assertEqual(list(report["scenarios"]), list(SCENARIOS))
+        for scenario, result in report["scenarios"].items():
+            with self.subTest(scenario=scenario):
+                self.assertEqual((result["triggers"], result["errors"], result["missing_alerts"]), (3, 0, 0))
+                self.assertLessEqual(result["first_alert_ms"]["p50"], result["last_alert_ms"]["p99"])
+        self.assertEqual(regressions(report, report), [])
+
+        faster = json.loads(json.dumps(report))
+        faster["scenarios"]["tap"]["last_alert_ms"]["p95"] = 0.0
+        report["scenarios"]["tap"]["last_alert_ms"]["p95"] = 100.0
+        self.assertEqual(regressions(report, faster), ["tap last_alert_ms p95: 100.0 ms (baseline 0.0 ms)"])
+
+        elsewhere = json.loads(json.dumps(faster))
+        elsewhere["machine"]["cpus"] += 1
+        self.assertEqual(len(regressions(report, elsewhere)), 1)
+        self.assertIn("re-record it on this machine", regressions(report, elsewhere)[0])
+
+
+class StartupBudgetTests(SimpleTestCase):
+    """The budget logic only; the wall-clock check is `manage.py startup_benchmark --check`."""
+
+    def report(self, boot=0.5, first_request=0.2, heavy_after_boot=(), heavy_after_requests=()):
+        return {
+            "boot_seconds": boot,
+            "heavy_after_boot": list(heavy_after_boot),
+            "heavy_after_requests": list(heavy_after_requests),
+            "requests": {"/": {"status": 200, "seconds": 0.05}, "/sos/emergency/": {"status": 302, "seconds": first_request}},
+        }
+
+    def test_report_within_budget_passes(self):
+        self.assertEqual(over_budget(self.report()), [])
+        self.assertEqual(over_budget(dict(self.report(), requests={})), [])
+
+    def test_every_violation_is_reported(self):
+        problems = over_budget(self.report(boot=2.5, first_request=1.5, heavy_after_boot=["numpy"], heavy_after_requests=["twilio"]))
+
+        self.assertEqual(problems, [
+            "heavy modules imported at boot: numpy",
+            "heavy modules imported by page requests: twilio",
+            "boot took 2.5s (budget 2.0s)",
+            "first request to /sos/emergency/ took 1.5s (budget 1.0s)",
+        ])
+
+    def test_custom_budget(self):
+        budget = {"boot_seconds": 0.1, "first_request_seconds": 5.0}
+        self.assertEqual(over_budget(self.report(first_request=1.5), budget), ["boot took 0.5s (budget 0.1s)"])
@@ -0,0 +1,168 @@
+# sos/transport.py
+import time
+import asyncio
+import weakref
+import logging
+import threading
+import itertools
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# Dotted path of the transport class (override via settings.SOS_TRANSPORT)
+DEFAULT_TRANSPORT = 'sos.transport.TwilioTransport'
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+class TwilioTransport:
+    """
+    Real provider transport.
+    Holds one twilio Client whose HTTP session keeps pooled keep-alive
+    connections, so only the first send in a worker pays for the TLS handshake.
+    """
+
+    def __init__(self, account_sid=None, auth_token=None, from_number=None, pool_size=None, timeout=10, max_retries=2, status_callback=None):
+        self.account_sid = account_sid or getattr(settings, 'TWILIO_ACCOUNT_SID', None)
+        self.auth_token = auth_token or getattr(settings, 'TWILIO_AUTH_TOKEN', None)
+        self.from_number = from_number or getattr(settings, 'TWILIO_PHONE_NUMBER', None)
+        # Public URL of the status_callback view; without it no delivery updates are requested
+        self.status_callback = status_callback or getattr(settings, 'SOS_STATUS_CALLBACK_URL', None)
+        self.configured = bool(self.account_sid and self.auth_token and self.from_number)
+        self.timeout = timeout
+        self.client = None
+        self._async_clients = weakref.WeakKeyDictionary()
+        if not self.configured:
+            return
+
+        from requests.adapters import HTTPAdapter
+        from twilio.rest import Client
+        from twilio.http.http_client import TwilioHttpClient
+
+        # One pool slot per dispatch worker so concurrent sends never open throwaway connections
+        if pool_size is None:
+            pool_size = getattr(settings, 'SOS_DISPATCH_MAX_WORKERS', 32)
+        http_client = TwilioHttpClient(pool_connections=True, timeout=timeout)
+        http_client.session.mount(
+            "https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=max_retries)
+        )
+        self.client = Client(self.account_sid, self.auth_token, http_client=http_client)
+
+    def _sms_options(self):
+        return {'status_callback': self.status_callback} if self.status_callback else {}
+
+    def _call_options(self):
+        if not self.status_callback:
+            return {}
+        return {'status_callback': self.status_callback, 'status_callback_event': ['initiated', 'ringing', 'answered', 'completed']}
+
+    def send_sms(self, to, body):
+        """Send an SMS. Returns (sid, status)."""
+        msg_obj = self.client.messages.create(body=body, from_=self.from_number, to=to, **self._sms_options())
+        return getattr(msg_obj, "sid", None), getattr(msg_obj, "status", None)
+
+    def place_call(self, to, twiml):
+        """Place a voice call reading `twiml`. Returns (sid, status)."""
+        call_obj = self.client.calls.create(twiml=twiml, from_=self.from_number, to=to, **self._call_options())
+        return getattr(call_obj, "sid", None), getattr(call_obj, "status", None)
+
+    def _async_client(self):
+        """
+        Client backed by twilio's aiohttp transport. aiohttp sessions are bound
+        to their event loop, so one pooled client is kept per running loop.
+        """
+        from twilio.rest import Client
+        from twilio.http.async_http_client import AsyncTwilioHttpClient
+
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            http_client = AsyncTwilioHttpClient(pool_connections=True, timeout=self.timeout)
+            client = Client(self.account_sid, self.auth_token, http_client=http_client)
+            self._async_clients[loop] = client
+        return client
+
+    async def asend_sms(self, to, body):
+        """Async send_sms for ASGI views. Returns (sid, status)."""
+        msg_obj = await self._async_client().messages.create_async(
+            body=body, from_=self.from_number, to=to, **self._sms_options()
+        )
+        return getattr(msg_obj, "sid", None), getattr(msg_obj, "status", None)
+
+    async def aplace_call(self, to, twiml):
+        """Async place_call for ASGI views. Returns (sid, status)."""
+        call_obj = await self._async_client().calls.create_async(
+            twiml=twiml, from_=self.from_number, to=to, **self._call_options()
+        )
+        return getattr(call_obj, "sid", None), getattr(call_obj, "status", None)
+
+
+class FakeTransport:
+    """
+    In-process stand-in for the provider, for tests and benchmarks.
+    Never touches the network; records every send and can simulate latency
+    and failing numbers.
+    """
+    configured = True
+
+    def __init__(self, latency=0.0, fail_numbers=()):
+        self.latency = float(latency)
+        self.fail_numbers = set(fail_numbers)
+        self.sent = []
+        self._lock = threading.Lock()
+        self._counter = itertools.count(1)
+
+    def _record(self, prefix, channel, to, payload):
+        if to in self.fail_numbers:
+            raise RuntimeError(f"Fake provider rejected {to}")
+        sid = f"{prefix}{next(self._counter):032d}"
+        with self._lock:
+            self.sent.append({"channel": channel, "to": to, "body": payload, "sid": sid, "at": time.monotonic()})
+        return sid, "queued"
+
+    def send_sms(self, to, body):
+        time.sleep(self.latency)
+        return self._record("SM", "sms", to, body)
+
+    def place_call(self, to, twiml):
+        time.sleep(self.latency)
+        return self._record("CA", "call", to, twiml)
+
+    async def asend_sms(self, to, body):
+        await asyncio.sleep(self.latency)
+        return self._record("SM", "sms", to, body)
+
+    async def aplace_call(self, to, twiml):
+        await asyncio.sleep(self.latency)
+        return self._record("CA", "call", to, twiml)
+
+    def status_callbacks(self, sms_status="delivered", call_status="completed"):
+        """Webhook payloads the provider would post for everything sent so far."""
+        with self._lock:
+            sent = list(self.sent)
+        return [
+            {"MessageSid": s["sid"], "MessageStatus": sms_status} if s["channel"] == "sms"
+            else {"CallSid": s["sid"], "CallStatus": call_status}
+            for s in sent
+        ]
+
+
+def get_transport():
+    """Return the process-wide transport, building it on first use."""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                transport_class = import_string(getattr(settings, 'SOS_TRANSPORT', DEFAULT_TRANSPORT))
+                _transport = transport_class(**getattr(settings, 'SOS_TRANSPORT_OPTIONS', {}))
+                logger.info(f"SOS transport ready: {transport_class.__name__}")
+    return _transport
+
+
+def set_transport(transport):
+    """Swap the process-wide transport (tests/benchmarks). Pass None to rebuild from settings."""
+    global _transport
+    with _transport_lock:
+        _transport = transport
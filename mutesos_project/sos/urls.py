@@ -5,5 +5,7 @@ app_name = 'sos'
 
 urlpatterns = [
     path('emergency/', views.emergency_trigger, name='emergency_trigger'),
+    path('replay/', views.replay_triggers, name='replay_triggers'),
     path('voice_trigger/', views.voice_trigger, name='voice_trigger'),
+    path('status/', views.status_callback, name='status_callback'),
 ]
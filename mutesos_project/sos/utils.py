@@ -1,47 +1,38 @@
 # sos/utils.py
-import os
-import time
 import logging
 import traceback
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from twilio.rest import Client
-from dotenv import load_dotenv
 from .helpers import format_phone_number
+from .dispatch import dispatch_alerts, adispatch_alerts
+from .transport import get_transport
+from .outbox import LateSends, claim_alerts, enqueue_alerts, fan_outs, settle
+from .audio_store import store_file
+from .metrics import stage
 
 # Setup logger
 logger = logging.getLogger(__name__)
 
-# Load environment variables (safe to call again)
-load_dotenv()
-TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID')
-TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
-TWILIO_PHONE_NUMBER = os.getenv('TWILIO_PHONE_NUMBER')
-
 # -----------------------------
-# Twilio alert functions
+# Alert functions
 # -----------------------------
 def send_sms_alert(to_number, message):
     """
-    Send SMS via Twilio.
+    Send SMS via the process-wide transport (see sos.transport).
     Returns a dict: {"to": str, "sent": bool, "sid": Optional[str], "error": Optional[str]}
     """
     result = {"to": to_number, "sent": False, "sid": None, "error": None}
     try:
-        if not TWILIO_ACCOUNT_SID or not TWILIO_AUTH_TOKEN or not TWILIO_PHONE_NUMBER:
+        transport = get_transport()
+        if not transport.configured:
             msg = "Twilio credentials missing — skipping SMS send"
             logger.warning(msg)
             result["error"] = "missing_credentials"
             return result
 
-        client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
         formatted = format_phone_number(to_number)
-        msg_obj = client.messages.create(
-            body=message,
-            from_=TWILIO_PHONE_NUMBER,
-            to=formatted
-        )
-        sid = getattr(msg_obj, "sid", None)
-        status = getattr(msg_obj, "status", None)
+        with stage('sms'):
+            sid, status = transport.send_sms(formatted, message)
         logger.info(f"SMS sent to {formatted} sid={sid} status={status}")
         result.update({"to": formatted, "sent": True, "sid": sid, "status": status})
         return result
@@ -56,30 +47,25 @@ def send_sms_alert(to_number, message):
 
 def make_call_alert(to_number, message):
     """
-    Place voice call via Twilio.
+    Place voice call via the process-wide transport (see sos.transport).
     Returns a dict: {"to": str, "placed": bool, "sid": Optional[str], "error": Optional[str]}
     """
     result = {"to": to_number, "placed": False, "sid": None, "error": None}
     try:
-        if not TWILIO_ACCOUNT_SID or not TWILIO_AUTH_TOKEN or not TWILIO_PHONE_NUMBER:
+        transport = get_transport()
+        if not transport.configured:
             msg = "Twilio credentials missing — skipping call"
             logger.warning(msg)
             result["error"] = "missing_credentials"
             return result
 
-        client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
         formatted = format_phone_number(to_number)
 
         # TwiML inline message
         twiml = f'<Response><Say voice="alice">{message}</Say></Response>'
 
-        call_obj = client.calls.create(
-            twiml=twiml,
-            from_=TWILIO_PHONE_NUMBER,
-            to=formatted
-        )
-        sid = getattr(call_obj, "sid", None)
-        status = getattr(call_obj, "status", None)
+        with stage('call'):
+            sid, status = transport.place_call(formatted, twiml)
         logger.info(f"Call placed to {formatted} sid={sid} status={status}")
         result.update({"to": formatted, "placed": True, "sid": sid, "status": status})
         return result
@@ -91,6 +77,58 @@ def make_call_alert(to_number, message):
         result["traceback"] = tb
         return result
 
+async def asend_sms_alert(to_number, message):
+    """Async send_sms_alert for ASGI views; same result dict."""
+    result = {"to": to_number, "sent": False, "sid": None, "error": None}
+    try:
+        transport = get_transport()
+        if not transport.configured:
+            logger.warning("Twilio credentials missing — skipping SMS send")
+            result["error"] = "missing_credentials"
+            return result
+
+        formatted = format_phone_number(to_number)
+        with stage('sms'):
+            sid, status = await transport.asend_sms(formatted, message)
+        logger.info(f"SMS sent to {formatted} sid={sid} status={status}")
+        result.update({"to": formatted, "sent": True, "sid": sid, "status": status})
+        return result
+
+    except Exception as e:
+        logger.exception(f"❌ SMS alert error to {to_number}: {e}")
+        result["error"] = str(e)
+        return result
+
+
+async def amake_call_alert(to_number, message):
+    """Async make_call_alert for ASGI views; same result dict."""
+    result = {"to": to_number, "placed": False, "sid": None, "error": None}
+    try:
+        transport = get_transport()
+        if not transport.configured:
+            logger.warning("Twilio credentials missing — skipping call")
+            result["error"] = "missing_credentials"
+            return result
+
+        formatted = format_phone_number(to_number)
+        twiml = f'<Response><Say voice="alice">{message}</Say></Response>'
+        with stage('call'):
+            sid, status = await transport.aplace_call(formatted, twiml)
+        logger.info(f"Call placed to {formatted} sid={sid} status={status}")
+        result.update({"to": formatted, "placed": True, "sid": sid, "status": status})
+        return result
+
+    except Exception as e:
+        logger.exception(f"❌ Call alert error to {to_number}: {e}")
+        result["error"] = str(e)
+        return result
+
+
+# Channel name -> sender, used by the fan-out dispatchers
+CHANNEL_SENDERS = {"sms": send_sms_alert, "call": make_call_alert}
+ASYNC_CHANNEL_SENDERS = {"sms": asend_sms_alert, "call": amake_call_alert}
+
+
 # -----------------------------
 # Helper: normalize helplines config
 # -----------------------------
@@ -132,12 +170,17 @@ def _iter_active_helplines():
 # -----------------------------
 # SOS Alert wrapper
 # -----------------------------
-def send_sos_alert(user_or_number, message=None, latitude=None, longitude=None):
+def send_sos_alert(user_or_number, message=None, latitude=None, longitude=None, channels=None):
     """
     Trigger SOS alert.
     Works for:
       - user_or_number as a User instance: sends to trusted contacts and active helplines
       - user_or_number as a phone-number string: sends SMS+call directly
+      - user_or_number as a list/tuple of phone-number strings: sends SMS+call to each
+
+    All recipients and channels are dispatched concurrently (see sos.dispatch),
+    bounded by settings.SOS_DISPATCH_DEADLINE. `channels` restricts the channels
+    used, e.g. ("sms",) for a location update.
 
     Returns:
       {
@@ -149,36 +192,23 @@ def send_sos_alert(user_or_number, message=None, latitude=None, longitude=None):
         "errors": [ ... ]
       }
     """
-    results = {"ok": True, "targets": [], "errors": []}
-
     location_link = ""
     if latitude is not None and longitude is not None:
         location_link = f"\n📍 Location: https://www.google.com/maps?q={latitude},{longitude}"
 
-    # Helper to attempt sms + call and collect results
-    def _alert_number(number, full_message):
-        sms_res = send_sms_alert(number, full_message)
-        call_res = make_call_alert(number, full_message)
-        target_entry = {"to": sms_res.get("to") or call_res.get("to") or number, "sms": sms_res, "call": call_res}
-        results["targets"].append(target_entry)
-        # If either failed, mark ok as False and record error
-        if (not sms_res.get("sent")) or (not call_res.get("placed")):
-            results["ok"] = False
-            # aggregate errors
-            if sms_res.get("error"):
-                results["errors"].append({"to": number, "sms_error": sms_res.get("error")})
-            if call_res.get("error"):
-                results["errors"].append({"to": number, "call_error": call_res.get("error")})
-        return target_entry
-
-    # If a raw phone number string is passed, send directly
+    senders = {channel: CHANNEL_SENDERS[channel] for channel in (channels or CHANNEL_SENDERS)}
+
+    # If raw phone number(s) are passed, send directly
     if isinstance(user_or_number, str):
+        user_or_number = [user_or_number]
+    if isinstance(user_or_number, (list, tuple)):
         full_message = (message or "🚨 Emergency Alert!") + location_link
-        _alert_number(user_or_number, full_message)
-        return results
+        return dispatch_alerts(user_or_number, full_message, senders)
 
     # Otherwise treat as a user object
     user = user_or_number
+    errors = []
+    numbers = []
     # Build a readable message
     display = ""
     try:
@@ -200,35 +230,91 @@ def send_sos_alert(user_or_number, message=None, latitude=None, longitude=None):
                     # support model instance or dict
                     number = getattr(contact, 'phone_number', None) or getattr(contact, 'phone', None) or (contact.get('phone_number') if isinstance(contact, dict) else None)
                 if number and isinstance(number, str) and number.strip():
-                    try:
-                        _alert_number(number, full_message)
-                    except Exception as e:
-                        tb = traceback.format_exc()
-                        logger.exception(f"Failed alert to trusted contact {number}: {e}\n{tb}")
-                        results["ok"] = False
-                        results["errors"].append({"to": number, "error": str(e)})
+                    numbers.append(number)
     except Exception as e:
         tb = traceback.format_exc()
         logger.exception(f"Failed to iterate trusted contacts for user {getattr(user, 'username', repr(user))}: {e}\n{tb}")
-        results["ok"] = False
-        results["errors"].append({"trusted_contacts_iteration_error": str(e)})
+        errors.append({"trusted_contacts_iteration_error": str(e)})
 
     # Active emergency helplines
     try:
-        for helpline_num in _iter_active_helplines():
-            try:
-                _alert_number(helpline_num, full_message)
-            except Exception as e:
-                tb = traceback.format_exc()
-                logger.exception(f"Failed alert to helpline {helpline_num}: {e}\n{tb}")
-                results["ok"] = False
-                results["errors"].append({"to": helpline_num, "error": str(e)})
+        numbers.extend(_iter_active_helplines())
     except Exception as e:
         tb = traceback.format_exc()
         logger.exception(f"Error while sending to emergency helplines: {e}\n{tb}")
+        errors.append({"helplines_error": str(e)})
+
+    results = dispatch_alerts(numbers, full_message, senders)
+    if errors:
         results["ok"] = False
-        results["errors"].append({"helplines_error": str(e)})
+        results["errors"].extend(errors)
+    return results
+
+
+# -----------------------------
+# Trigger entry point
+# -----------------------------
+def _settle_inline(rows, deliveries, results, late):
+    """
+    Record an inline fan-out on its claimed rows (see sos.outbox.settle),
+    then let `late` (a LateSends) record sends that outlived the deadline.
+    Returns how many rows were left for the worker to retry or are still
+    in flight. The alerts are out already, so never raise: unsettled rows
+    are resent after the lease.
+    """
+    groups = fan_outs(rows)
+    try:
+        _, retried, _ = settle(groups, {(d.outbox_id, d.channel): d for d in deliveries}, {key: results for key in groups})
+    except Exception as e:
+        logger.exception(f"Recording inline SOS results failed; the worker resends {len(rows)} alert(s) after the lease: {e}")
+        return len(rows)
+    late.release()
+    return retried
+
 
+def alert_recipients(user, numbers, message, channels=None, incident=None, claimed=None):
+    """
+    Alert `numbers` on behalf of `user` from a trigger view.
+    By default the alerts are sent inline, from outbox rows claimed by the
+    request: whatever fails stays in the outbox for the deliver_alerts
+    worker to retry with backoff. With settings.SOS_USE_OUTBOX every alert
+    is left to the worker and the request returns at once. Either way
+    `incident` (a SosAlert) gets one AlertDelivery row per recipient and
+    channel, written with the outbox rows. `claimed` holds the (rows,
+    deliveries) when the caller already claimed them in the incident's
+    transaction (see sos.incidents).
+    Returns the send_sos_alert aggregate plus a "queued" count: alerts
+    waiting for the worker.
+    """
+    channels = tuple(channels or CHANNEL_SENDERS)
+    if getattr(settings, 'SOS_USE_OUTBOX', False):
+        with stage('enqueue'):
+            queued = enqueue_alerts(user, numbers, message, channels, incident=incident)
+        return {"ok": True, "queued": queued, "targets": [], "errors": []}
+    rows, deliveries = claimed or claim_alerts(user, numbers, message, channels, incident=incident)
+    senders = {channel: CHANNEL_SENDERS[channel] for channel in channels}
+    late = LateSends()
+    with stage('dispatch'):
+        results = dispatch_alerts([row.to_number for row in rows], message, senders, on_late=late.callback(rows))
+    with stage('record'):
+        results["queued"] = _settle_inline(rows, deliveries, results, late)
+    return results
+
+
+async def aalert_recipients(user, numbers, message, channels=None, incident=None, claimed=None):
+    """Async alert_recipients for ASGI views; inline sends go through twilio's aiohttp client."""
+    channels = tuple(channels or ASYNC_CHANNEL_SENDERS)
+    if getattr(settings, 'SOS_USE_OUTBOX', False):
+        with stage('enqueue'):
+            queued = await sync_to_async(enqueue_alerts)(user, numbers, message, channels, incident=incident)
+        return {"ok": True, "queued": queued, "targets": [], "errors": []}
+    rows, deliveries = claimed or await sync_to_async(claim_alerts)(user, numbers, message, channels, incident=incident)
+    senders = {channel: ASYNC_CHANNEL_SENDERS[channel] for channel in channels}
+    late = LateSends()
+    with stage('dispatch'):
+        results = await adispatch_alerts([row.to_number for row in rows], message, senders, on_late=late.callback(rows))
+    with stage('record'):
+        results["queued"] = await sync_to_async(_settle_inline)(rows, deliveries, results, late)
     return results
 
 
@@ -237,26 +323,21 @@ def send_sos_alert(user_or_number, message=None, latitude=None, longitude=None):
 # -----------------------------
 def save_uploaded_audio(file):
     """
-    Save uploaded audio to MEDIA_ROOT/sos_audio and return the path.
+    Store uploaded audio in the content-addressed store (see sos.audio_store)
+    and return its blob name. Clips received through
+    sos.audio.StreamingAudioUploadHandler are already stored, so their name
+    is returned without copying.
     """
-    audio_dir = os.path.join(settings.MEDIA_ROOT, 'sos_audio')
-    os.makedirs(audio_dir, exist_ok=True)
-    timestamp = int(time.time() * 1000)
-    _, ext = os.path.splitext(getattr(file, 'name', '') or '')
-    ext = ext if ext else '.wav'
-    filename = f"sos_audio_{timestamp}{ext}"
-    file_path = os.path.join(audio_dir, filename)
-
+    if getattr(file, 'stored_name', None):
+        return file.stored_name
     try:
-        with open(file_path, 'wb') as f:
-            for chunk in file.chunks():
-                f.write(chunk)
-        logger.info(f"Saved audio file: {file_path}")
+        with stage('save'):
+            name = store_file(file)
+        logger.info(f"Saved audio file: {name}")
     except Exception as e:
-        logger.error(f"Failed to save uploaded audio to {file_path}: {e}")
+        logger.error(f"Failed to save uploaded audio: {e}")
         raise
-
-    return file_path
+    return name
 
 
 # -----------------------------
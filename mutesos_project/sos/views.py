@@ -1,78 +1,87 @@
 # sos/views.py
-import os
-import tempfile
+import json
+import asyncio
 import logging
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from dotenv import load_dotenv
-from django.http import JsonResponse
-import speech_recognition as sr
-from pydub import AudioSegment
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
 
 from .forms import SecretPassphraseForm
+from .metrics import stage
+from .models import SosAlert
 from ai_module.models import AIInteraction
+from ai_module.interactions import alog_interaction
 from users.models import Profile
-from contacts.models import TrustedContact, Helpline
-from .utils import send_sos_alert, save_uploaded_audio
-
-# Load environment variables
-load_dotenv()
-TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID')
-TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
-TWILIO_PHONE_NUMBER = os.getenv('TWILIO_PHONE_NUMBER')
+from .utils import save_uploaded_audio
+from ai_module.voice import analyze_clip
+from .audio import stream_audio_uploads, uploaded_pcm
+from .callbacks import get_status_buffer, parse_callback
+from .incidents import atrigger_incident, get_idempotency_key, parse_coordinate, parse_event_time, LOCATION_UPDATE, COALESCED, REPLAY
+from .recipients import aget_active_contacts, aget_active_helplines, aget_recipients, merge_recipients
 
 logger = logging.getLogger(__name__)
 
-# -------------------------
-# Phone formatting helper
-# -------------------------
-def format_phone_number(number):
-    """Format phone number to include +91 if missing (India default)."""
-    number = number.strip()
-    if number.startswith('+'):
-        return number
-    if number.startswith('0') and len(number) == 11:
-        return '+91' + number[1:]
-    if len(number) == 10 and number.isdigit():
-        return '+91' + number
-    return number
-
 # -------------------------
 # Emergency Trigger View
 # -------------------------
+def _report_trigger(request, results, success_text):
+    """Flash the right message for a new, repeated or location-only trigger."""
+    outcome = results.get("outcome")
+    if outcome == LOCATION_UPDATE:
+        messages.success(request, "📍 Location update sent to your contacts.")
+    elif outcome in (COALESCED, REPLAY):
+        messages.info(request, "ℹ️ SOS already sent moments ago — your contacts have been alerted.")
+    elif results.get("queued"):
+        messages.warning(request, f"📤 SOS queued for {results['queued']} recipient(s); it will be sent as soon as possible.")
+    else:
+        messages.success(request, success_text)
+
+
 @login_required
-def emergency_trigger(request):
+async def emergency_trigger(request):
     triggered = False
     passphrase_form = SecretPassphraseForm()
-    results_summary = []
+    results_summary = {}
 
-    active_contacts = request.user.contacts_trusted_contacts.filter(is_active=True)
-    active_helplines = Helpline.objects.filter(is_active=True)
-    profile = getattr(request.user, 'profile', None)
+    user = await request.auser()
+    # Cached, normalized recipient lists (see sos.recipients); shared with the template
+    with stage('recipients'):
+        active_contacts = await aget_active_contacts(user.pk)
+        active_helplines = await aget_active_helplines()
+    profile = await Profile.objects.filter(user=user).afirst()
     voice_keyword = profile.voice_keyword.lower() if profile and profile.voice_keyword else None
 
     if request.method == 'POST':
         latitude = request.POST.get("latitude")
         longitude = request.POST.get("longitude")
         maps_link = f"\n📍 Location: https://www.google.com/maps?q={latitude},{longitude}" if latitude and longitude else ""
+        incident_args = {
+            'idempotency_key': get_idempotency_key(request),
+            'latitude': parse_coordinate(latitude),
+            'longitude': parse_coordinate(longitude),
+        }
 
-        recipients = [c.phone_number for c in active_contacts] + [h.phone_number for h in active_helplines]
+        # Contacts and helplines are already merged and deduplicated by number
+        recipients = merge_recipients(active_contacts, active_helplines)
 
         # -------------------------
         # Manual SOS Trigger
         # -------------------------
         if 'trigger_button' in request.POST:
             if recipients:
-                for number in recipients:
-                    formatted_number = format_phone_number(number)
-                    res = send_sos_alert(
-                        formatted_number,
-                        message=f"🚨 MuteSOS Alert: {request.user.username} triggered SOS!{maps_link}",
-                    )
-                    results_summary.append({formatted_number: res})
+                results_summary = await atrigger_incident(
+                    user, 'tap', recipients,
+                    f"🚨 MuteSOS Alert: {user.username} triggered SOS!{maps_link}",
+                    **incident_args,
+                )
                 triggered = True
-                messages.success(request, "✅ SOS sent to all active contacts and helplines!")
+                _report_trigger(request, results_summary, "✅ SOS sent to all active contacts and helplines!")
             else:
                 messages.warning(request, "⚠️ No active contacts or helplines found.")
 
@@ -85,21 +94,22 @@ def emergency_trigger(request):
                 entered_pass = passphrase_form.cleaned_data['passphrase']
                 if profile and profile.secret_passphrase and entered_pass == profile.secret_passphrase:
                     if recipients:
-                        for number in recipients:
-                            formatted_number = format_phone_number(number)
-                            res = send_sos_alert(
-                                formatted_number,
-                                message=f"🚨 MuteSOS Alert: {request.user.username} triggered SOS via secret passphrase!{maps_link}",
-                            )
-                            results_summary.append({formatted_number: res})
+                        results_summary = await atrigger_incident(
+                            user, 'passphrase', recipients,
+                            f"🚨 MuteSOS Alert: {user.username} triggered SOS via secret passphrase!{maps_link}",
+                            **incident_args,
+                        )
                         triggered = True
-                        messages.success(request, "✅ SOS triggered via secret passphrase!")
+                        _report_trigger(request, results_summary, "✅ SOS triggered via secret passphrase!")
                     else:
                         messages.warning(request, "⚠️ No active contacts or helplines found.")
                 else:
                     messages.error(request, "❌ Invalid secret passphrase.")
 
-    return render(request, "sos/emergency_trigger.html", {
+    # Template rendering (auth/messages context) is sync code; hand it the user
+    # loaded above so the auth context processor does not fetch it again
+    request.user = user
+    return await sync_to_async(render)(request, "sos/emergency_trigger.html", {
         'triggered': triggered,
         'passphrase_form': passphrase_form,
         'active_contacts': active_contacts,
@@ -109,88 +119,183 @@ def emergency_trigger(request):
     })
 
 
+# -------------------------
+# Offline Trigger Replay
+# -------------------------
+DEFAULT_REPLAY_MAX_EVENTS = 20
+DEFAULT_REPLAY_MAX_AGE = 6 * 3600  # seconds; older queued triggers are acknowledged but do not alert
+
+
+@login_required
+async def replay_triggers(request):
+    """
+    Triggers queued by the service worker while offline, replayed on reconnect.
+    Accepts JSON: { "events": [ { "idempotency_key": "...", "method": "tap" | "passphrase",
+                                  "timestamp": <ISO or epoch ms>,
+                                  "latitude": ..., "longitude": ... }, ... ] }
+    Keys already seen are skipped with one indexed lookup; at most one SOS is
+    raised per batch, for the latest valid trigger. The service worker does
+    not store the secret passphrase, so a queued passphrase trigger is
+    authenticated by the session replaying it (like a tap). Entries from
+    older clients still carry the passphrase and are checked against it.
+    """
+    if request.method != "POST":
+        return JsonResponse({'status': 'error', 'message': 'POST required'}, status=405)
+    try:
+        events = json.loads(request.body.decode('utf-8') or "{}").get('events')
+    except (ValueError, AttributeError):
+        return HttpResponseBadRequest("Invalid JSON")
+    if not isinstance(events, list) or not all(isinstance(e, dict) for e in events):
+        return HttpResponseBadRequest("'events' must be a list of objects")
+    if len(events) > getattr(settings, 'SOS_REPLAY_MAX_EVENTS', DEFAULT_REPLAY_MAX_EVENTS):
+        return JsonResponse({'status': 'error', 'message': 'Too many events'}, status=413)
+
+    user = await request.auser()
+    keys = [str(event.get('idempotency_key') or '').strip()[:64] for event in events]
+    if not all(keys):
+        return HttpResponseBadRequest("Every event needs an idempotency_key")
+    seen = {key async for key in SosAlert.objects.filter(user=user, idempotency_key__in=keys).values_list('idempotency_key', flat=True)}
+
+    now = timezone.now()
+    max_age = timedelta(seconds=getattr(settings, 'SOS_REPLAY_MAX_AGE', DEFAULT_REPLAY_MAX_AGE))
+    profile = None
+    response = {'status': 'Nothing to send', 'accepted': [], 'duplicates': [], 'rejected': [], 'expired': [], 'results': None}
+    latest = None
+    for key, event in zip(keys, events):
+        if key in seen:
+            response['duplicates'].append(key)
+            continue
+        seen.add(key)
+        method = 'passphrase' if event.get('method') == 'passphrase' else 'tap'
+        if method == 'passphrase':
+            if profile is None:
+                profile = await Profile.objects.filter(user=user).afirst() or Profile()
+            if not profile.secret_passphrase or ('passphrase' in event and event['passphrase'] != profile.secret_passphrase):
+                response['rejected'].append(key)
+                continue
+        occurred_at = parse_event_time(event.get('timestamp'), now)
+        if now - occurred_at > max_age:
+            response['expired'].append(key)
+            continue
+        response['accepted'].append(key)
+        if latest is None or occurred_at >= latest[0]:
+            latest = (occurred_at, key, method, event)
+
+    if latest:
+        occurred_at, key, method, event = latest
+        latitude, longitude = str(event.get('latitude') or ''), str(event.get('longitude') or '')
+        maps_link = f"\n📍 Location: https://www.google.com/maps?q={latitude},{longitude}" if latitude and longitude else ""
+        sent_at = timezone.localtime(occurred_at).strftime('%H:%M')
+        recipients = await aget_recipients(user.pk)
+        response['results'] = await atrigger_incident(
+            user, method, recipients,
+            f"🚨 MuteSOS Alert: {user.username} triggered SOS at {sent_at} (sent when back online)!{maps_link}",
+            idempotency_key=key, latitude=parse_coordinate(latitude), longitude=parse_coordinate(longitude),
+        )
+        response['status'] = '✅ Queued SOS sent'
+    return JsonResponse(response)
+
+
 # -------------------------
 # Voice Trigger View
 # -------------------------
 @login_required
-def voice_trigger(request):
+@stream_audio_uploads
+async def voice_trigger(request):
     if request.method != "POST" or 'audio' not in request.FILES:
         return JsonResponse({'status': 'No audio received', 'spoken_text': ''})
 
+    user = await request.auser()
     audio_file = request.FILES['audio']
 
-    # Save audio
-    saved_path = save_uploaded_audio(audio_file)
-    interaction = AIInteraction.objects.create(user=request.user, input_voice_file=saved_path, detected_danger=False)
+    # Audio was streamed to storage while uploading (see sos.audio)
+    stored_name = await sync_to_async(save_uploaded_audio, thread_sensitive=False)(audio_file)
+    # Built in memory and logged once, with its analysis (see ai_module.interactions)
+    interaction = AIInteraction(user=user, input_voice_file=stored_name, detected_danger=False)
 
-    tmp_path, wav_path, spoken_text = None, None, ""
+    # Check voice keyword (spotted on-box; see ai_module.voice)
+    profile = await Profile.objects.filter(user=user).afirst()
+    keyword = (profile.voice_keyword or '') if profile else ""
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".tmp") as tmp:
-            for chunk in audio_file.chunks():
-                tmp.write(chunk)
-            tmp_path = tmp.name
-
-        wav_path = tmp_path + ".wav"
-        sound = AudioSegment.from_file(tmp_path)
-        sound.export(wav_path, format="wav")
-
-        recognizer = sr.Recognizer()
-        with sr.AudioFile(wav_path) as source:
-            recognizer.adjust_for_ambient_noise(source, duration=0.5)
-            audio_data = recognizer.record(source)
-            try:
-                spoken_text = recognizer.recognize_google(audio_data)
-            except sr.UnknownValueError:
-                spoken_text = ""
-            except sr.RequestError:
-                spoken_text = "[Google API error]"
+        from ai_module.emotion import aanalyze_voice  # NumPy: loaded on first voice request
 
+        pcm = await sync_to_async(uploaded_pcm, thread_sensitive=False)(audio_file)
+        # distress analysis runs alongside detection and the SOS itself
+        analysis = asyncio.ensure_future(aanalyze_voice(pcm))
+        result = await sync_to_async(analyze_clip, thread_sensitive=False)(pcm, keyword)
     except Exception as e:
         logger.exception("Audio processing failed")
+        await alog_interaction(interaction)
         return JsonResponse({'status': 'error', 'message': f'Audio processing failed: {str(e)}'})
+    spoken_text = result.transcript
 
-    finally:
-        for path in [tmp_path, wav_path]:
-            try:
-                if path and os.path.exists(path):
-                    os.remove(path)
-            except Exception:
-                pass
-
-    # Save spoken text
     interaction.input_text = spoken_text
-    interaction.save()
-
-    # Check voice keyword
-    profile = getattr(request.user, 'profile', None)
-    keyword = getattr(profile, 'voice_keyword', '').lower().strip() if profile else ""
-    results_summary = []
-
-    if keyword and spoken_text and keyword in spoken_text.lower():
-        interaction.detected_danger = True
-        interaction.save()
+    interaction.detected_danger = result.detected
+    results_summary = {}
 
+    if result.detected:
         latitude = request.POST.get("latitude")
         longitude = request.POST.get("longitude")
         maps_link = f"\n📍 Location: https://www.google.com/maps?q={latitude},{longitude}" if latitude and longitude else ""
 
-        recipients = [c.phone_number for c in request.user.contacts_trusted_contacts.filter(is_active=True)] + \
-                     [h.phone_number for h in Helpline.objects.filter(is_active=True)]
-        for number in recipients:
-            formatted_number = format_phone_number(number)
-            res = send_sos_alert(
-                formatted_number,
-                message=f"🚨 MuteSOS Alert: {request.user.username} triggered SOS via voice keyword!{maps_link}",
-            )
-            results_summary.append({formatted_number: res})
+        with stage('recipients'):
+            recipients = await aget_recipients(user.pk)
+        results_summary = await atrigger_incident(
+            user, 'voice', recipients,
+            f"🚨 MuteSOS Alert: {user.username} triggered SOS via voice keyword!{maps_link}",
+            idempotency_key=get_idempotency_key(request),
+            latitude=parse_coordinate(latitude),
+            longitude=parse_coordinate(longitude),
+        )
 
+        voice_analysis = await analysis
+        await alog_interaction(interaction, voice_analysis)
         return JsonResponse({
             'status': '✅ SOS Triggered via voice keyword!',
             'spoken_text': spoken_text,
+            'confidence': result.confidence,
+            'danger_level': voice_analysis.danger_level if voice_analysis else None,
             'results': results_summary
         })
 
-    return JsonResponse({'status': 'No keyword detected', 'spoken_text': spoken_text})
+    voice_analysis = await analysis
+    await alog_interaction(interaction, voice_analysis)
+    return JsonResponse({
+        'status': 'No keyword detected',
+        'spoken_text': spoken_text,
+        'confidence': result.confidence,
+        'danger_level': voice_analysis.danger_level if voice_analysis else None,
+    })
+
+
+# -------------------------
+# Provider Status Callbacks
+# -------------------------
+def _valid_signature(request):
+    """Check X-Twilio-Signature whenever the auth token is configured."""
+    auth_token = getattr(settings, 'TWILIO_AUTH_TOKEN', None)
+    if not auth_token:
+        return True
+    from twilio.request_validator import RequestValidator
+
+    url = getattr(settings, 'SOS_STATUS_CALLBACK_URL', None) or request.build_absolute_uri()
+    return RequestValidator(auth_token).validate(url, request.POST.dict(), request.headers.get('X-Twilio-Signature', ''))
+
+
+@csrf_exempt
+async def status_callback(request):
+    """
+    SMS/call status webhook from the provider. Only buffers the update; it is
+    applied to AlertDelivery in bulk with others (see sos.callbacks).
+    """
+    if request.method != "POST":
+        return HttpResponse(status=405)
+    if not _valid_signature(request):
+        return HttpResponseForbidden()
+    update = parse_callback(request.POST)
+    if update:
+        await get_status_buffer().arecord(*update)
+    return HttpResponse(status=204)
 
 
 # -------------------------
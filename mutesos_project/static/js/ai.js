@@ -5,8 +5,152 @@ document.addEventListener("DOMContentLoaded", function() {
     // =========================
     // VOICE TRIGGER FUNCTIONALITY
     // =========================
+    // Audio is streamed to /ai_module/voice_stream/ as 16 kHz PCM while it is
+    // recorded, so the SOS fires the moment the keyword is heard. Browsers or
+    // servers without streaming support fall back to a recorded 5-second clip.
+    const STREAM_RATE = 16000;
+    const STREAM_MAX_MS = 30000;
+    let activeStream = null;
+
+    function resetVoiceBtn() {
+        voiceBtn.innerText = "Start Voice Trigger";
+        voiceBtn.disabled = false;
+        activeStream = null;
+    }
+
+    function newIdempotencyKey() {
+        return (window.crypto && crypto.randomUUID) ? crypto.randomUUID() : String(Date.now()) + Math.random().toString(16).slice(2);
+    }
+
+    function toPcm16(samples, inputRate) {
+        // Linear-interpolation downsample to 16 kHz, then float -> signed 16-bit
+        const ratio = inputRate / STREAM_RATE;
+        const out = new Int16Array(Math.floor(samples.length / ratio));
+        for (let i = 0; i < out.length; i++) {
+            const pos = i * ratio, idx = Math.floor(pos), frac = pos - idx;
+            const next = idx + 1 < samples.length ? samples[idx + 1] : samples[idx];
+            const s = Math.max(-1, Math.min(1, samples[idx] + (next - samples[idx]) * frac));
+            out[i] = s < 0 ? s * 0x8000 : s * 0x7FFF;
+        }
+        return out;
+    }
+
+    function streamVoice(stream) {
+        // Resolves true when the server handled the stream, false to fall back to upload
+        return new Promise(resolve => {
+            if (!window.WebSocket || !(window.AudioContext || window.webkitAudioContext)) return resolve(false);
+
+            const proto = location.protocol === 'https:' ? 'wss://' : 'ws://';
+            const ws = new WebSocket(proto + location.host + '/ai_module/voice_stream/');
+            ws.binaryType = 'arraybuffer';
+            let handled = false, audioCtx = null, processor = null, source = null, stopTimer = null;
+
+            function stopAudio() {
+                clearTimeout(stopTimer);
+                if (processor) processor.disconnect();
+                if (source) source.disconnect();
+                if (audioCtx) audioCtx.close();
+                stream.getTracks().forEach(track => track.stop());
+            }
+
+            ws.onopen = () => {
+                ws.send(JSON.stringify({ type: 'start', idempotency_key: newIdempotencyKey() }));
+                if (navigator.geolocation) {
+                    navigator.geolocation.getCurrentPosition(pos => {
+                        if (ws.readyState === WebSocket.OPEN) {
+                            ws.send(JSON.stringify({ type: 'location', latitude: pos.coords.latitude, longitude: pos.coords.longitude }));
+                        }
+                    }, () => {}, { enableHighAccuracy: true, timeout: 10000 });
+                }
+            };
+
+            ws.onmessage = event => {
+                const data = JSON.parse(event.data);
+                if (data.type === 'ready') {
+                    handled = true;
+                    const Ctx = window.AudioContext || window.webkitAudioContext;
+                    audioCtx = new Ctx();
+                    source = audioCtx.createMediaStreamSource(stream);
+                    processor = audioCtx.createScriptProcessor(4096, 1, 1);
+                    processor.onaudioprocess = e => {
+                        if (ws.readyState === WebSocket.OPEN) {
+                            ws.send(toPcm16(e.inputBuffer.getChannelData(0), audioCtx.sampleRate).buffer);
+                        }
+                    };
+                    source.connect(processor);
+                    processor.connect(audioCtx.destination);
+                    activeStream = () => { if (ws.readyState === WebSocket.OPEN) ws.send(JSON.stringify({ type: 'stop' })); };
+                    stopTimer = setTimeout(activeStream, STREAM_MAX_MS);
+                    voiceBtn.innerText = "Listening... (tap to stop)";
+                    voiceBtn.disabled = false;
+                } else if (data.type === 'unavailable') {
+                    ws.close();
+                } else {
+                    handled = true;
+                    alert(data.status);
+                }
+            };
+
+            ws.onclose = () => {
+                if (handled) {
+                    stopAudio();
+                    resetVoiceBtn();
+                }
+                resolve(handled);
+            };
+        });
+    }
+
+    function recordAndUpload(stream) {
+        const mediaRecorder = new MediaRecorder(stream);
+        let audioChunks = [];
+
+        mediaRecorder.ondataavailable = event => {
+            if (event.data.size > 0) audioChunks.push(event.data);
+        };
+
+        mediaRecorder.onstop = async () => {
+            const audioBlob = new Blob(audioChunks, { type: 'audio/wav' });
+            const formData = new FormData();
+            formData.append('audio', audioBlob, 'voice_trigger.wav');
+            formData.append('idempotency_key', newIdempotencyKey());
+
+            // Send to backend
+            const response = await fetch('/ai_module/voice_trigger/', {
+                method: 'POST',
+                body: formData,
+                credentials: 'same-origin',
+                headers: {
+                    'X-CSRFToken': getCSRFToken()
+                }
+            });
+
+            const data = await response.json();
+            alert(data.status);
+
+            // Stop all audio tracks
+            stream.getTracks().forEach(track => track.stop());
+        };
+
+        // Start recording for 5 seconds
+        mediaRecorder.start();
+        voiceBtn.innerText = "Recording...";
+        voiceBtn.disabled = true;
+
+        setTimeout(() => {
+            mediaRecorder.stop();
+            resetVoiceBtn();
+        }, 5000); // 5 seconds recording
+    }
+
     if (voiceBtn) {
         voiceBtn.addEventListener('click', async function() {
+            // A second tap ends a live stream
+            if (activeStream) {
+                activeStream();
+                return;
+            }
+
             // Check for microphone support
             if (!navigator.mediaDevices || !navigator.mediaDevices.getUserMedia) {
                 alert("Microphone not supported in this browser.");
@@ -16,49 +160,13 @@ document.addEventListener("DOMContentLoaded", function() {
             try {
                 // Ask for microphone access
                 const stream = await navigator.mediaDevices.getUserMedia({ audio: true });
-                const mediaRecorder = new MediaRecorder(stream);
-                let audioChunks = [];
-
-                mediaRecorder.ondataavailable = event => {
-                    if (event.data.size > 0) audioChunks.push(event.data);
-                };
-
-                mediaRecorder.onstop = async () => {
-                    const audioBlob = new Blob(audioChunks, { type: 'audio/wav' });
-                    const formData = new FormData();
-                    formData.append('audio', audioBlob, 'voice_trigger.wav');
-
-                    // Send to backend
-                    const response = await fetch('/ai_module/voice_trigger/', {
-                        method: 'POST',
-                        body: formData,
-                        credentials: 'same-origin',
-                        headers: {
-                            'X-CSRFToken': getCSRFToken()
-                        }
-                    });
-
-                    const data = await response.json();
-                    alert(data.status);
-
-                    // Stop all audio tracks
-                    stream.getTracks().forEach(track => track.stop());
-                };
-
-                // Start recording for 5 seconds
-                mediaRecorder.start();
-                voiceBtn.innerText = "Recording...";
+                voiceBtn.innerText = "Connecting...";
                 voiceBtn.disabled = true;
-
-                setTimeout(() => {
-                    mediaRecorder.stop();
-                    voiceBtn.innerText = "Start Voice Trigger";
-                    voiceBtn.disabled = false;
-                }, 5000); // 5 seconds recording
-
+                if (!(await streamVoice(stream))) recordAndUpload(stream);
             } catch (err) {
                 console.error(err);
                 alert("Error accessing microphone.");
+                resetVoiceBtn();
             }
         });
     }
@@ -1,4 +1,17 @@
-const CACHE_NAME = "mutesos-cache-v1";
+const CACHE_NAME = "mutesos-cache-v2";
+
+// Offline SOS queue: triggers posted while offline are kept in IndexedDB
+// and replayed to REPLAY_URL (deduplicated server-side by idempotency key)
+// The secret passphrase is never stored: the replay is authenticated by the
+// session that queued it. Entries expire after MAX_AGE_MS (the server's
+// SOS_REPLAY_MAX_AGE) and are cleared on logout.
+const SOS_FORM_URL = "/sos/emergency/";
+const REPLAY_URL = "/sos/replay/";
+const LOGOUT_URL = "/user/logout/";
+const MAX_AGE_MS = 6 * 3600 * 1000;
+const SYNC_TAG = "sos-replay";
+const DB_NAME = "mutesos";
+const STORE = "sos-queue";
 const ASSETS_TO_CACHE = [
   "/",
   "/offline/",
@@ -34,7 +47,103 @@ self.addEventListener("activate", event => {
   self.clients.claim();
 });
 
+// ---------- IndexedDB helpers ----------
+function openDb() {
+  return new Promise((resolve, reject) => {
+    const req = indexedDB.open(DB_NAME, 1);
+    req.onupgradeneeded = () => req.result.createObjectStore(STORE, { keyPath: "idempotency_key" });
+    req.onsuccess = () => resolve(req.result);
+    req.onerror = () => reject(req.error);
+  });
+}
+
+function withStore(mode, fn) {
+  return openDb().then(db => new Promise((resolve, reject) => {
+    const tx = db.transaction(STORE, mode);
+    const result = fn(tx.objectStore(STORE));
+    tx.oncomplete = () => resolve(result && result.result);
+    tx.onerror = () => reject(tx.error);
+  }));
+}
+
+const queueEvent = entry => withStore("readwrite", store => store.put(entry));
+const queuedEvents = () => withStore("readonly", store => store.getAll());
+const dropEvents = keys => withStore("readwrite", store => keys.forEach(key => store.delete(key)));
+const clearEvents = () => withStore("readwrite", store => store.clear());
+
+// ---------- Offline SOS ----------
+function queueTrigger(form) {
+  const entry = {
+    idempotency_key: form.get("idempotency_key") || crypto.randomUUID(),
+    method: form.has("passphrase") ? "passphrase" : "tap",
+    latitude: form.get("latitude") || "",
+    longitude: form.get("longitude") || "",
+    csrf_token: form.get("csrfmiddlewaretoken") || "",
+    timestamp: Date.now()
+  };
+  return queueEvent(entry)
+    .then(() => self.registration.sync ? self.registration.sync.register(SYNC_TAG) : null)
+    .catch(err => console.log("[ServiceWorker] Background sync unavailable:", err))
+    .then(() => new Response(
+      "<!doctype html><meta charset=\"utf-8\"><meta name=\"viewport\" content=\"width=device-width\">" +
+      "<title>SOS queued</title><body style=\"font-family:sans-serif;text-align:center;padding:2em\">" +
+      "<h1>📡 SOS queued</h1><p>You are offline. Your SOS will be sent automatically as soon as the connection returns.</p>" +
+      "<p><a href=\"" + SOS_FORM_URL + "\">Back</a></p></body>",
+      { status: 202, headers: { "Content-Type": "text/html; charset=utf-8" } }
+    ));
+}
+
+function handleSosPost(request) {
+  // Read the form before the body is consumed by the network attempt
+  const form = request.clone().formData();
+  return fetch(request).catch(() => form.then(queueTrigger));
+}
+
+function flushQueue() {
+  return queuedEvents().then(queued => {
+    const expired = queued.filter(event => Date.now() - event.timestamp > MAX_AGE_MS);
+    const events = queued.filter(event => !expired.includes(event));
+    return dropEvents(expired.map(event => event.idempotency_key)).then(() => events);
+  }).then(events => {
+    if (!events.length) return;
+    const { csrf_token } = events[events.length - 1];
+    return fetch(REPLAY_URL, {
+      method: "POST",
+      credentials: "same-origin",
+      headers: { "Content-Type": "application/json", "X-CSRFToken": csrf_token },
+      body: JSON.stringify({ events: events.map(({ csrf_token, ...event }) => event) })
+    }).then(response => {
+      // Logged out (redirect), CSRF/5xx failures: keep the queue and retry later,
+      // until the entries expire; any other answer means the server has decided
+      // on every event
+      if (response.redirected || response.status === 403 || response.status >= 500) {
+        throw new Error("SOS replay failed: " + response.status);
+      }
+      return dropEvents(events.map(event => event.idempotency_key));
+    });
+  });
+}
+
+self.addEventListener("sync", event => {
+  if (event.tag === SYNC_TAG) event.waitUntil(flushQueue());
+});
+
+self.addEventListener("message", event => {
+  if (event.data === "flush-sos-queue") event.waitUntil(flushQueue().catch(() => {}));
+});
+
 self.addEventListener("fetch", event => {
+  const { request } = event;
+  if (request.method === "POST" && new URL(request.url).pathname === SOS_FORM_URL) {
+    event.respondWith(handleSosPost(request));
+    return;
+  }
+  if (new URL(request.url).pathname === LOGOUT_URL) {
+    // Triggers queued by this session must not be replayed by the next one
+    event.respondWith(clearEvents().catch(() => {}).then(() => fetch(request)));
+    return;
+  }
+  if (request.method !== "GET") return;
   event.respondWith(
     caches.match(event.request).then(response => {
       return response || fetch(event.request).catch(() => caches.match("/offline/"));
@@ -18,9 +18,10 @@ class UserRegisterForm(UserCreationForm):
         widget=forms.PasswordInput(attrs={'placeholder': 'Secret Passphrase for SOS'})
     )
     voice_keyword = forms.CharField(
-        max_length=50,
+        max_length=200,
         required=False,
-        widget=forms.TextInput(attrs={'placeholder': 'Voice Keyword for SOS'})
+        help_text="Separate several trigger phrases with commas.",
+        widget=forms.TextInput(attrs={'placeholder': 'Voice Keywords for SOS, comma-separated'})
     )
 
     class Meta:
@@ -38,8 +39,8 @@ class UserRegisterForm(UserCreationForm):
         if commit:
             user.save()
 
-            # Ensure profile exists
-            profile, created = Profile.objects.get_or_create(user=user)
+            # Ensure profile exists (the post_save signal normally just created it)
+            profile = getattr(user, 'profile', None) or Profile.objects.get_or_create(user=user)[0]
             profile.full_name = self.cleaned_data['full_name']
             profile.age = self.cleaned_data['age']
             profile.gender = self.cleaned_data['gender']
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 12:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_profile_voice_keyword'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='profile',
+            name='voice_keyword',
+            field=models.CharField(blank=True, max_length=200, null=True),
+        ),
+    ]
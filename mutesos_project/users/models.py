@@ -15,7 +15,7 @@ class Profile(models.Model):
     phone = models.CharField(max_length=15, blank=True)
     address = models.TextField(blank=True)
     secret_passphrase = models.CharField(max_length=100, blank=True)  # existing
-    voice_keyword = models.CharField(max_length=50, blank=True, null=True)  # ✅ Added
+    voice_keyword = models.CharField(max_length=200, blank=True, null=True)  # comma-separated trigger phrases
 
     def __str__(self):
         return self.user.username
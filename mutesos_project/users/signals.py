@@ -9,7 +9,10 @@ def create_user_profile(sender, instance, created, **kwargs):
     if created:
         Profile.objects.create(user=instance)
 
-# Save profile when user is saved
+# Save profile when user is saved (not for a brand-new profile, nor for
+# partial saves such as the last_login update on every login)
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
+def save_user_profile(sender, instance, created, update_fields=None, **kwargs):
+    if created or update_fields:
+        return
     instance.profile.save()
@@ -1,3 +1,31 @@
+from django.contrib.auth.models import User
 from django.test import TestCase
 
-# Create your tests here.
+from sos.testing import QueryBudgetMixin
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    def test_anonymous_views_stay_within_query_budget(self):
+        User.objects.create_user("carol", password="pw")
+        registration = {
+            "username": "dave", "email": "dave@example.com", "password1": "Xy!23456abc", "password2": "Xy!23456abc",
+            "full_name": "Dave", "age": 30, "gender": "M", "phone": "9876543210", "address": "Somewhere",
+        }
+        cases = [
+            ("get", "/user/register/", {}, 0),
+            ("post", "/user/register/", registration, 5),
+            ("get", "/user/login/", {}, 0),
+            ("post", "/user/login/", {"username": "carol", "password": "pw"}, 9),
+        ]
+        for method, url, data, budget in cases:
+            with self.subTest(method=method, url=url), self.assertMaxQueries(budget):
+                response = getattr(self.client, method)(url, data)
+                self.assertLess(response.status_code, 400)
+
+    def test_profile_stays_within_query_budget(self):
+        self.client.force_login(User.objects.create_user("carol", password="pw"))
+        update = {"full_name": "Carol", "age": 30, "gender": "F", "phone": "9876543210", "address": "Somewhere", "voice_keyword": "help me"}
+        for method, data, budget in [("get", {}, 4), ("post", update, 4)]:
+            with self.subTest(method=method), self.assertMaxQueries(budget):
+                response = getattr(self.client, method)("/user/profile/", data)
+                self.assertLess(response.status_code, 400)
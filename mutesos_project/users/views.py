@@ -16,9 +16,10 @@ class ProfileUpdateForm(forms.ModelForm):
         widget=forms.PasswordInput(attrs={'placeholder': 'Secret Passphrase for SOS'})
     )
     voice_keyword = forms.CharField(
-        max_length=50,
+        max_length=200,
         required=False,
-        widget=forms.TextInput(attrs={'placeholder': 'Voice Keyword for SOS'})
+        help_text="Separate several trigger phrases with commas.",
+        widget=forms.TextInput(attrs={'placeholder': 'Voice Keywords for SOS, comma-separated'})
     )
 
     class Meta:
@@ -43,18 +44,8 @@ def register(request):
     if request.method == 'POST':
         form = UserRegisterForm(request.POST)
         if form.is_valid():
-            user = form.save()
-
-            # Ensure profile exists and save extra fields
-            profile, created = Profile.objects.get_or_create(user=user)
-            profile.full_name = form.cleaned_data['full_name']
-            profile.age = form.cleaned_data['age']
-            profile.gender = form.cleaned_data['gender']
-            profile.phone = form.cleaned_data['phone']
-            profile.address = form.cleaned_data['address']
-            profile.secret_passphrase = form.cleaned_data.get('secret_passphrase', '')
-            profile.voice_keyword = form.cleaned_data.get('voice_keyword', '')
-            profile.save()
+            # Creates the user and fills in its profile (see UserRegisterForm.save)
+            form.save()
 
             messages.success(request, "✅ Account created successfully! You can now log in.")
             return redirect('users:login')